@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+import os.path
+import re
+
+from build_manifest import BuildManifest
+
+
+# Names of the batches, also the names of their output subdirectories
+BATCH_NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def parse_dept_filter(dept_filter):
+    """
+    :param dept_filter:     comma separated list of departement numbers or names, e.g. "  02,    oise, SOMME"
+    :return:                the list of the stripped and lower-cased numbers or names
+    """
+    return [dept.strip().lower() for dept in dept_filter.split(",")]
+
+
+def check_batch_name(name):
+    """
+    :param name:        the name of a batch
+    :raise ValueError:  if the name is not made of letters, digits, _ and -, so that its output subdirectory could be
+                        outside of the output directory (../x) or nested (a/b)
+    """
+    if not BATCH_NAME_RE.match(name):
+        raise ValueError(u"{} is not a valid batch name: only letters, digits, _ and - are allowed".format(name))
+
+
+def parse_batches(values):
+    """
+    :param values:      list of "name=departements filter" strings, e.g. "picardie=02,60,80"
+    :return:            dict of the departements filters by batch name
+    :raise ValueError:  if a value is not a name=departements filter or its name is not valid (see check_batch_name)
+    """
+    batches = {}
+    for value in values:
+        name, sep, dept_filter = value.partition("=")
+        if not sep or not name.strip() or not dept_filter.strip():
+            raise ValueError(u"{} is not a name=departements filter value".format(value))
+        check_batch_name(name.strip())
+        batches[name.strip()] = dept_filter
+    return batches
+
+
+class Batch(object):
+    """
+    One of the outputs of a batch build: the thesauri filtered on a list of departements, written in the name
+    subdirectory of the output directory with their own build manifest.
+    """
+
+    def __init__(self, name, dept_list, output_dir):
+        """
+        :param name:        the name of the batch, also the name of its output subdirectory
+        :param dept_list:   the departements filter, as returned by parse_dept_filter
+        :param output_dir:  the output directory of the build
+        """
+        self.name = name
+        self.dept_list = dept_list
+        self.output_dir = os.path.join(output_dir, name)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.manifest = BuildManifest(self.output_dir)
+
+
+class PartitionIndex(object):
+    """
+    Hash index of territories by departement keys (numbers and lower-cased names), selecting the territories of a
+    departements filter without testing every territory again.
+    """
+
+    def __init__(self, terr_list):
+        """
+        :param terr_list:   the territories sorted by code, each one with its set of departement keys as dept_keys
+        """
+        self.terr_list = terr_list
+        self.index = {}
+        for i, terr in enumerate(terr_list):
+            for key in terr.dept_keys:
+                self.index.setdefault(key, []).append(i)
+
+    def select(self, dept_list):
+        """
+        :param dept_list:   the departements filter, as returned by parse_dept_filter
+        :return:            the territories of the departements of the filter, still sorted by code, all the
+                            territories if the filter is empty
+        """
+        if not dept_list:
+            return self.terr_list
+        positions = set()
+        for key in dept_list:
+            positions.update(self.index.get(key, ()))
+        return [self.terr_list[i] for i in sorted(positions)]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+from build_manifest import get_shapefile_paths
+from layer_columns import LayerColumns
+from utils import LazyModule
+from utils import get_layer_label
+from utils import split_layer_source
+
+# Non standard imports (see requirements.txt), imported on first use
+numpy = LazyModule('numpy')
+
+
+BOUNDS_FILE_NAME = "bounds.npy"
+
+
+class BboxColumns(object):
+    """
+    Attributes and WGS84 bounding boxes of the features of a layer, as memory-mapped columns.
+    """
+
+    def __init__(self, path, fields):
+        """
+        :param path:    the directory of the cache entry
+        :param fields:  the configured fields, as a dict of shapefile field names by key
+        """
+        self.path = path
+        self.fields = fields
+        self.bounds = numpy.load(os.path.join(path, BOUNDS_FILE_NAME), mmap_mode='r')
+        self.columns = dict((key, numpy.load(os.path.join(path, u"{}.npy".format(key)), mmap_mode='r'))
+                            for key in fields)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def rows(self, start=None, stop=None):
+        """
+        :param start:   index of the first feature, the first feature of the layer if None
+        :param stop:    index of the feature to stop at, the end of the layer if None
+        :return:        an iterator over the (properties, bounds) tuples of the features, the properties being keyed
+                        by shapefile field name like the properties of the features read with fiona, the bounds being
+                        None for an empty geometry
+        """
+        for i in range(*slice(start, stop).indices(len(self))):
+            props = dict((self.fields[key], u"{}".format(self.columns[key][i])) for key in self.fields)
+            bounds = tuple(float(b) for b in self.bounds[i])
+            yield props, bounds if not numpy.isnan(bounds[0]) else None
+
+    def select(self, start=None, stop=None):
+        """
+        :param start:   index of the first feature, the first feature of the layer if None
+        :param stop:    index of the feature to stop at, the end of the layer if None
+        :return:        the LayerColumns of the range, without geometries, its columns being keyed by shapefile field
+                        name
+        """
+        selected = slice(start, stop)
+        return LayerColumns(dict((self.fields[key], self.columns[key][selected]) for key in self.fields),
+                            bounds=numpy.asarray(self.bounds[selected], dtype=numpy.float64),
+                            size=len(range(*selected.indices(len(self)))))
+
+
+class BboxColumnsWriter(object):
+    """
+    Collect the attributes and bounding boxes of the features of a layer and save them as a cache entry.
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self.values = dict((key, []) for key in fields)
+        self.bounds = []
+
+    def append(self, props, bounds):
+        """
+        :param props:   the properties of the feature
+        :param bounds:  its (lon_min, lat_min, lon_max, lat_max) tuple, None for an empty geometry
+        """
+        for key, field in self.fields.items():
+            value = props.get(field)
+            self.values[key].append(value if value is not None else u"")
+        # Stored as NaN, as by Reprojector.bounds_array, so that the positions of the features are kept
+        self.bounds.append(bounds if bounds is not None else (float('nan'),) * 4)
+
+    def extend(self, columns):
+        """
+        :param columns: the LayerColumns of features, with their bounds
+        """
+        for key, field in self.fields.items():
+            self.values[key].extend(value if value is not None else u"" for value in columns[field])
+        self.bounds.extend(columns.bounds.tolist())
+
+    def save(self):
+        parent_dir = os.path.dirname(self.path)
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+
+        # Written in a temporary directory renamed at the end, so that an entry is always complete
+        tmp_path = tempfile.mkdtemp(dir=parent_dir)
+        try:
+            numpy.save(os.path.join(tmp_path, BOUNDS_FILE_NAME),
+                       numpy.array(self.bounds, dtype=numpy.float64).reshape(-1, 4))
+            for key, values in self.values.items():
+                numpy.save(os.path.join(tmp_path, u"{}.npy".format(key)), numpy.array(values, dtype='U'))
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+
+class BboxCache(object):
+    """
+    On-disk cache of the configured attributes and the WGS84 bounding boxes of the features of the source layers,
+    so that the layers are only read and reprojected again when they change.
+
+    An entry is a directory of .npy files, one per configured field and one for the bounding boxes. Its key is
+    computed from the size and mtime of the files of the shapefile (the .prj giving its CRS included), the configured
+    fields and the reprojection settings.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_entry_path(self, layer_path, fields, settings):
+        """
+        :param layer_path:  the path of the layer, or its source for a layer of a file having several layers
+        :param fields:      the configured fields, as a dict of shapefile field names by key
+        :param settings:    the JSON serializable reprojection settings
+        :return:            the path of the cache entry
+        """
+        state = {
+            "files": [(p, os.path.getsize(p), os.path.getmtime(p)) for p in get_shapefile_paths(layer_path)],
+            "fields": fields,
+            "settings": settings,
+        }
+        layer_name = split_layer_source(layer_path)[1]
+        if layer_name:
+            # The layers of a GeoPackage share its file
+            state["layer"] = layer_name
+        key = hashlib.sha1(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, u"{}-{}".format(get_layer_label(layer_path), key[:16]))
+
+    def load(self, layer_path, fields, settings):
+        """
+        :return:    the BboxColumns of the layer, None if the layer is not cached
+        """
+        path = self.get_entry_path(layer_path, fields, settings)
+        if not os.path.isdir(path):
+            return None
+        return BboxColumns(path, fields)
+
+    def writer(self, layer_path, fields, settings):
+        """
+        :return:    the BboxColumnsWriter of the cache entry of the layer
+        """
+        return BboxColumnsWriter(self.get_entry_path(layer_path, fields, settings), fields)
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import datetime
+import json
+import math
+import os
+import os.path
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Non standard imports (see requirements.txt)
+import click
+from shapely.geometry import Polygon
+from shapely.geometry import box
+from shapely.geometry import mapping
+# Fiona should be imported after shapely - see https://github.com/Toblerity/Shapely/issues/288
+import fiona
+import yaml
+
+from profiler import PROFILE_FILE_NAME
+
+
+# Named sizes of the synthetic datasets, in number of communes
+SIZES = {
+    "small": 1000,
+    "medium": 35000,
+    "large": 500000,
+}
+
+# Extent of the synthetic datasets in Lambert-93 (EPSG:2154), roughly the one of metropolitan France
+EXTENT = (100000.0, 6100000.0, 1100000.0, 7100000.0)
+LAMBERT_93 = "EPSG:2154"
+
+# Number of departements per side of the grid, and of departements per side of a region or communes per side of an EPCI
+DEPTS_PER_SIDE = 10
+REGION_SIDE = 3
+EPCI_SIDE = 5
+
+META_FILE_NAME = "benchmark.json"
+ADE_CFG_FILE_NAME = "config_ade.yml"
+SHP_CFG_FILE_NAME = "config_simple_shp.yml"
+FILTER_FILE_NAME = "FILTER.shp"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@click.group()
+def cli():
+    """
+    Benchmark of the thesauri builders on synthetic ADMIN EXPRESS like shapefiles.
+
+    Examples:\n
+    python benchmark.py generate --size medium --vertices 64 bench/medium\n
+    python benchmark.py run --results bench/results.jsonl bench/medium\n
+    python benchmark.py startup --results bench/results.jsonl\n
+    python benchmark.py compare bench/results.jsonl\n
+    """
+
+
+def star_polygon(rnd, cx, cy, radius, vertices):
+    """
+    :return:    a simple star-shaped polygon of the given number of vertices around (cx, cy)
+    """
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * (0.8 + 0.2 * rnd.random())
+        points.append((cx + r * math.cos(angle), cy + r * math.sin(angle)))
+    return Polygon(points)
+
+
+def densified_box(x_min, y_min, x_max, y_max, vertices):
+    """
+    :return:    a rectangle with about the given number of vertices regularly spaced on its boundary
+    """
+    per_side = max(1, vertices // 4)
+    points = []
+    for (x0, y0), (x1, y1) in [((x_min, y_min), (x_max, y_min)), ((x_max, y_min), (x_max, y_max)),
+                               ((x_max, y_max), (x_min, y_max)), ((x_min, y_max), (x_min, y_min))]:
+        for i in range(per_side):
+            points.append((x0 + (x1 - x0) * i / per_side, y0 + (y1 - y0) * i / per_side))
+    return Polygon(points)
+
+
+def open_layer(path, fields):
+    schema = {'geometry': 'Polygon', 'properties': dict((field, 'str') for field in fields)}
+    return fiona.open(path, 'w', driver='ESRI Shapefile', crs=LAMBERT_93, schema=schema)
+
+
+@cli.command()
+@click.option('--size', default='small',
+              help='Number of communes, or one of small (1000), medium (35000) and large (500000)')
+@click.option('--vertices', type=click.IntRange(min=4), default=32,
+              help='Number of vertices of each polygon')
+@click.option('--seed', type=int, default=0,
+              help='Seed of the random generator')
+@click.argument('data-dir', nargs=1, type=click.Path(file_okay=False))
+def generate(size, vertices, seed, data_dir):
+    """
+    Generate the synthetic shapefiles and the config files of a benchmark dataset.
+    """
+    communes = SIZES[size] if size in SIZES else int(size)
+    side = max(DEPTS_PER_SIDE, int(math.ceil(math.sqrt(communes))))
+    cell = (EXTENT[2] - EXTENT[0]) / side
+    dept_side = int(math.ceil(float(side) / DEPTS_PER_SIDE))
+    rnd = random.Random(seed)
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    with open(os.path.join(BASE_DIR, "config_ade.yml"), 'r') as f:
+        ade_cfg = yaml.safe_load(f)
+    with open(os.path.join(BASE_DIR, "config_simple_shp.yml"), 'r') as f:
+        shp_cfg = yaml.safe_load(f)
+
+    def cell_box(i_min, j_min, i_max, j_max):
+        return densified_box(EXTENT[0] + i_min * cell, EXTENT[1] + j_min * cell,
+                             EXTENT[0] + min(i_max, side) * cell, EXTENT[1] + min(j_max, side) * cell, vertices)
+
+    def dept_code(i, j):
+        return u"{:02d}".format(1 + (i // dept_side) * DEPTS_PER_SIDE + j // dept_side)
+
+    def reg_code(di, dj):
+        return u"{:02d}".format(11 + (di // REGION_SIDE) * DEPTS_PER_SIDE + dj // REGION_SIDE)
+
+    # Communes, and the simple shapefile of communes
+    fields = ade_cfg['commune']['fields']
+    shp_fields = shp_cfg['thesauri']['communes']['fields']
+    ade_path = os.path.join(data_dir, ade_cfg['commune']['shp'])
+    shp_path = os.path.join(data_dir, os.path.basename(shp_cfg['thesauri']['communes']['shp']))
+    count = 0
+    with open_layer(ade_path, fields.values()) as ade_layer, open_layer(shp_path, shp_fields.values()) as shp_layer:
+        for i in range(side):
+            for j in range(side):
+                if count >= communes:
+                    break
+                count += 1
+                dept = dept_code(i, j)
+                code = u"{}{:03d}".format(dept, (i % dept_side) * dept_side + j % dept_side)
+                geometry = mapping(star_polygon(rnd, EXTENT[0] + (i + 0.5) * cell, EXTENT[1] + (j + 0.5) * cell,
+                                                cell * 0.45, vertices))
+                name = u"Commune {}".format(code)
+                ade_layer.write({'geometry': geometry, 'properties': {
+                    fields['nom']: name, fields['code']: code,
+                    fields['nomdept']: u"Departement {}".format(dept), fields['codedept']: dept}})
+                shp_layer.write({'geometry': geometry, 'properties': {
+                    shp_fields['name']: name, shp_fields['code']: code}})
+
+    # Departements and regions, made of blocks of communes
+    dept_count = int(math.ceil(float(side) / dept_side))
+    fields = ade_cfg['departement']['fields']
+    with open_layer(os.path.join(data_dir, ade_cfg['departement']['shp']), fields.values()) as layer:
+        for di in range(dept_count):
+            for dj in range(dept_count):
+                dept = dept_code(di * dept_side, dj * dept_side)
+                layer.write({'geometry': mapping(cell_box(di * dept_side, dj * dept_side,
+                                                          (di + 1) * dept_side, (dj + 1) * dept_side)),
+                             'properties': {fields['nom']: u"Departement {}".format(dept), fields['code']: dept,
+                                            fields['codereg']: reg_code(di, dj)}})
+
+    fields = ade_cfg['region']['fields']
+    pnr_fields = shp_cfg['thesauri']['pnr']['fields']
+    pnr_path = os.path.join(data_dir, os.path.basename(shp_cfg['thesauri']['pnr']['shp']))
+    with open_layer(os.path.join(data_dir, ade_cfg['region']['shp']), fields.values()) as layer, \
+            open_layer(pnr_path, pnr_fields.values()) as pnr_layer:
+        for ri in range(0, dept_count, REGION_SIDE):
+            for rj in range(0, dept_count, REGION_SIDE):
+                reg = reg_code(ri, rj)
+                geometry = mapping(cell_box(ri * dept_side, rj * dept_side,
+                                            (ri + REGION_SIDE) * dept_side, (rj + REGION_SIDE) * dept_side))
+                layer.write({'geometry': geometry,
+                             'properties': {fields['nom']: u"Region {}".format(reg), fields['code']: reg}})
+                pnr_layer.write({'geometry': geometry,
+                                 'properties': {pnr_fields['name']: u"Parc {}".format(reg), pnr_fields['code']: reg}})
+
+    # EPCI, made of blocks of communes
+    fields = ade_cfg['epci']['fields']
+    shp_fields = shp_cfg['thesauri']['epci']['fields']
+    shp_path = os.path.join(data_dir, os.path.basename(shp_cfg['thesauri']['epci']['shp']))
+    with open_layer(os.path.join(data_dir, ade_cfg['epci']['shp']), fields.values()) as ade_layer, \
+            open_layer(shp_path, shp_fields.values()) as shp_layer:
+        for ei in range(0, side, EPCI_SIDE):
+            for ej in range(0, side, EPCI_SIDE):
+                code = u"2{:08d}".format(ei * side + ej)
+                geometry = mapping(cell_box(ei, ej, ei + EPCI_SIDE, ej + EPCI_SIDE))
+                name = u"EPCI {}".format(code)
+                ade_layer.write({'geometry': geometry, 'properties': {fields['nom']: name, fields['code']: code}})
+                shp_layer.write({'geometry': geometry, 'properties': {shp_fields['name']: name,
+                                                                      shp_fields['code']: code}})
+
+    # Spatial filter: a square of a sixteenth of the extent in its middle
+    width = EXTENT[2] - EXTENT[0]
+    height = EXTENT[3] - EXTENT[1]
+    with fiona.open(os.path.join(data_dir, FILTER_FILE_NAME), 'w', driver='ESRI Shapefile', crs=LAMBERT_93,
+                    schema={'geometry': 'Polygon', 'properties': {'id': 'int'}}) as layer:
+        layer.write({'geometry': mapping(box(EXTENT[0] + width * 0.375, EXTENT[1] + height * 0.375,
+                                             EXTENT[0] + width * 0.625, EXTENT[1] + height * 0.625)),
+                     'properties': {'id': 1}})
+
+    # Config files reading the synthetic shapefiles
+    ade_cfg['ade_dir_name'] = os.path.abspath(data_dir)
+    with open(os.path.join(data_dir, ADE_CFG_FILE_NAME), 'w') as f:
+        yaml.safe_dump(ade_cfg, f, allow_unicode=True, default_flow_style=False)
+    for thesaurus_cfg in shp_cfg['thesauri'].values():
+        thesaurus_cfg['shp'] = os.path.join(os.path.abspath(data_dir), os.path.basename(thesaurus_cfg['shp']))
+    with open(os.path.join(data_dir, SHP_CFG_FILE_NAME), 'w') as f:
+        yaml.safe_dump(shp_cfg, f, allow_unicode=True, default_flow_style=False)
+
+    with open(os.path.join(data_dir, META_FILE_NAME), 'w') as f:
+        f.write(json.dumps({"communes": count, "vertices": vertices, "seed": seed}, indent=2, sort_keys=True))
+
+    click.echo(u"{} communes of {} vertices generated in {}".format(count, vertices, data_dir))
+
+
+def get_scenarios(data_dir):
+    """
+    :return:    the list of the (name, script, arguments) tuples of the benchmark scenarios
+    """
+    ade_cfg = os.path.join(data_dir, ADE_CFG_FILE_NAME)
+    shp_cfg = os.path.join(data_dir, SHP_CFG_FILE_NAME)
+    return [
+        ("ade", "build_thesaurus_from_ade.py", ["--cfg-path", ade_cfg]),
+        ("ade_dept_filter", "build_thesaurus_from_ade.py", ["--cfg-path", ade_cfg, "--dept-filter", "01"]),
+        ("ade_filter_shp", "build_thesaurus_from_ade.py",
+         ["--cfg-path", ade_cfg, "--filter-shp-path", os.path.join(data_dir, FILTER_FILE_NAME)]),
+        ("simple_shp", "build_thesaurus_from_simple_shp.py", ["--cfg-path", shp_cfg]),
+        ("ade_columnar", "build_thesaurus_from_ade.py", ["--cfg-path", ade_cfg, "--columnar"]),
+        ("ade_filter_shp_columnar", "build_thesaurus_from_ade.py",
+         ["--cfg-path", ade_cfg, "--filter-shp-path", os.path.join(data_dir, FILTER_FILE_NAME), "--columnar"]),
+        ("simple_shp_columnar", "build_thesaurus_from_simple_shp.py", ["--cfg-path", shp_cfg, "--columnar"]),
+    ]
+
+
+def get_commit():
+    """
+    :return:    the current commit of the repository, None if unknown
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+@click.option('--results', type=click.Path(dir_okay=False), default="benchmark_results.jsonl",
+              help='File the results are appended to, one JSON object per line')
+@click.option('--scenario', multiple=True,
+              help='Scenario to run (ade, ade_dept_filter, ade_filter_shp or simple_shp). Repeatable, all by default')
+@click.option('--repeat', type=click.IntRange(min=1), default=1,
+              help='Number of runs of each scenario')
+@click.argument('data-dir', nargs=1, type=click.Path(exists=True, file_okay=False))
+def run(results, scenario, repeat, data_dir):
+    """
+    Run the builders on a dataset created by the generate command and append the results to the results file.
+
+    Each scenario runs in its own process with --profile, giving the time of each stage of each thesaurus.
+    """
+    data_dir = os.path.abspath(data_dir)
+    with open(os.path.join(data_dir, META_FILE_NAME), 'r') as f:
+        meta = json.load(f)
+    commit = get_commit()
+
+    for name, script, args in get_scenarios(data_dir):
+        if scenario and name not in scenario:
+            continue
+        for i in range(repeat):
+            output_dir = tempfile.mkdtemp()
+            try:
+                # The output file names of the default configs are in an out subdirectory
+                os.makedirs(os.path.join(output_dir, "out"))
+                command = [sys.executable, os.path.join(BASE_DIR, script)] + args + \
+                          ["--overwrite", "--profile", output_dir]
+                start = time.time()
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.check_call(command, cwd=BASE_DIR, stdout=devnull)
+                wall_seconds = time.time() - start
+                with open(os.path.join(output_dir, PROFILE_FILE_NAME), 'r') as f:
+                    profile = json.load(f)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+            features = sum(thesaurus["counters"].get("features_read", 0) for thesaurus in profile["thesauri"].values())
+            result = {
+                "date": datetime.datetime.now().isoformat(),
+                "commit": commit,
+                "scenario": name,
+                "communes": meta["communes"],
+                "vertices": meta["vertices"],
+                "wall_seconds": wall_seconds,
+                "features": features,
+                "features_per_second": features / wall_seconds if wall_seconds > 0 else None,
+                "peak_rss_kb": profile["peak_rss_kb"],
+                "stages": dict((thesaurus, dict((stage, timing["seconds"])
+                                                for stage, timing in profile["thesauri"][thesaurus]["stages"].items()))
+                               for thesaurus in profile["thesauri"]),
+            }
+            with open(results, 'a') as f:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+            click.echo(u"{} ({} communes): {:.2f} s, {:.0f} features/s, {} KB peak RSS".format(
+                name, meta["communes"], wall_seconds, result["features_per_second"] or 0, result["peak_rss_kb"]))
+
+
+def get_startup_scenarios(output_dir):
+    """
+    :param output_dir:  the output directory of the runs refused without --overwrite
+    :return:            the list of the (name, script, arguments) tuples of the startup scenarios, run with the
+                        configuration files of the repository
+    """
+    scenarios = []
+    for name, script, cfg_file_name in (("ade", "build_thesaurus_from_ade.py", ADE_CFG_FILE_NAME),
+                                        ("simple_shp", "build_thesaurus_from_simple_shp.py", SHP_CFG_FILE_NAME)):
+        cfg_path = os.path.join(BASE_DIR, cfg_file_name)
+        scenarios.append((u"help_{}".format(name), script, ["--help"]))
+        scenarios.append((u"noop_{}".format(name), script, ["--cfg-path", cfg_path, output_dir]))
+    return scenarios
+
+
+def create_existing_outputs(output_dir):
+    """
+    Create empty files in place of the output files of the configuration files of the repository, so that the
+    builders refuse to overwrite them.
+    """
+    for cfg_file_name in (ADE_CFG_FILE_NAME, SHP_CFG_FILE_NAME):
+        with open(os.path.join(BASE_DIR, cfg_file_name), 'r') as f:
+            cfg = yaml.safe_load(f)
+        sections = [section for section in cfg.values() if isinstance(section, dict)]
+        sections.extend(section for section in (cfg.get('thesauri') or {}).values() if isinstance(section, dict))
+        for section in sections:
+            if section.get('out'):
+                path = os.path.join(output_dir, section['out'])
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                open(path, 'a').close()
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr:  the standard error of a python -X importtime run
+    :return:        the (total import time in seconds, cumulative import time in seconds by top-level module) tuple
+    """
+    total_us = 0
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            # Header line
+            continue
+        total_us += self_us
+        # The imported modules are indented by 2 spaces per level after the separator space
+        name = fields[2][1:].rstrip()
+        if not name.startswith(" "):
+            top_level[name] = top_level.get(name, 0) + cumulative_us / 1e6
+    return total_us / 1e6, top_level
+
+
+@cli.command()
+@click.option('--results', type=click.Path(dir_okay=False), default="benchmark_results.jsonl",
+              help='File the results are appended to, one JSON object per line')
+@click.option('--repeat', type=click.IntRange(min=1), default=5,
+              help='Number of runs of each scenario')
+def startup(results, repeat):
+    """
+    Measure the cost of an invocation of the builders doing nothing: --help, and a run whose output files all exist
+    and are not overwritten. Each run is timed with python -X importtime, giving the wall time, the time spent in
+    imports and the top-level modules imported, and the mean of the runs is appended to the results file.
+    """
+    commit = get_commit()
+    output_dir = tempfile.mkdtemp()
+    try:
+        create_existing_outputs(output_dir)
+        for name, script, args in get_startup_scenarios(output_dir):
+            wall_seconds = 0.
+            import_seconds = 0.
+            modules = {}
+            for i in range(repeat):
+                command = [sys.executable, "-X", "importtime", os.path.join(BASE_DIR, script)] + args
+                start = time.time()
+                process = subprocess.Popen(command, cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout, stderr = process.communicate()
+                wall_seconds += time.time() - start
+                if process.returncode != 0:
+                    raise click.ClickException(u"{} failed: {}".format(name, stderr.decode("utf-8")[-1000:]))
+                run_import_seconds, run_modules = parse_importtime(stderr.decode("utf-8"))
+                import_seconds += run_import_seconds
+                for module, seconds in run_modules.items():
+                    modules[module] = modules.get(module, 0.) + seconds
+
+            result = {
+                "date": datetime.datetime.now().isoformat(),
+                "commit": commit,
+                "scenario": name,
+                "communes": 0,
+                "vertices": 0,
+                "runs": repeat,
+                "wall_seconds": wall_seconds / repeat,
+                "import_seconds": import_seconds / repeat,
+                "modules": dict((module, seconds / repeat) for module, seconds in modules.items()),
+            }
+            with open(results, 'a') as f:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+            heaviest = sorted(result["modules"].items(), key=lambda m: -m[1])[:5]
+            click.echo(u"{}: {:.3f} s, {:.3f} s of imports ({})".format(
+                name, result["wall_seconds"], result["import_seconds"],
+                u", ".join(u"{} {:.3f} s".format(module, seconds) for module, seconds in heaviest)))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+@cli.command()
+@click.argument('results', nargs=1, type=click.Path(exists=True, dir_okay=False))
+def compare(results):
+    """
+    Print the mean wall time and throughput of each scenario and dataset, commit by commit.
+    """
+    runs = {}
+    commits = []
+    with open(results, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result["commit"] not in commits:
+                commits.append(result["commit"])
+            key = (result["scenario"], result["communes"], result["vertices"], result["commit"])
+            runs.setdefault(key, []).append(result)
+
+    for scenario, communes, vertices, commit in sorted(runs, key=lambda k: (k[0], k[1], k[2], commits.index(k[3]))):
+        key_runs = runs[(scenario, communes, vertices, commit)]
+        wall_seconds = sum(r["wall_seconds"] for r in key_runs) / len(key_runs)
+        if "import_seconds" in key_runs[0]:
+            import_seconds = sum(r["import_seconds"] for r in key_runs) / len(key_runs)
+            click.echo(u"{:<16} {:<31} {:<10} {:>9.3f} s {:>8.3f} s of imports".format(
+                scenario, u"", commit or u"-", wall_seconds, import_seconds))
+            continue
+        throughput = sum(r["features_per_second"] or 0 for r in key_runs) / len(key_runs)
+        click.echo(u"{:<16} {:>7} communes {:>4} vertices  {:<10} {:>9.2f} s {:>10.0f} features/s".format(
+            scenario, communes, vertices, commit or u"-", wall_seconds, throughput))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import hashlib
+import json
+import os
+import os.path
+
+from utils import replace_file
+from utils import split_layer_source
+
+
+MANIFEST_FILE_NAME = "thesaurus_manifest.json"
+
+# Files making a shapefile
+SHAPEFILE_EXTENSIONS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+
+def get_shapefile_paths(path):
+    """
+    :param path:    the path of a shapefile (or of any other file), or the source of a layer of a file having several
+                    layers (see utils.get_layer_source)
+    :return:        the paths of the existing files of the shapefile
+    """
+    path = split_layer_source(path)[0]
+    root, ext = os.path.splitext(path)
+    if ext.lower() != ".shp":
+        return [path]
+    return [root + e for e in SHAPEFILE_EXTENSIONS if os.path.isfile(root + e)] or [path]
+
+
+def get_layers_inputs(sources):
+    """
+    :param sources: the sources of the layers read (see utils.get_layer_source)
+    :return:        the (paths of their files, names of the layers read from files having several layers) tuple, each
+                    file being listed once even if several of its layers are read
+    """
+    files = []
+    layers = []
+    for source in sources:
+        files.extend(p for p in get_shapefile_paths(source) if p not in files)
+        if split_layer_source(source)[1]:
+            layers.append(source)
+    return files, layers
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    :param path:    the path of a file
+    :return:        the SHA-1 of the content of the file
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def settings_digest(settings):
+    """
+    :param settings:    JSON serializable settings
+    :return:            the SHA-1 of their canonical JSON serialization
+    """
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def template_digest(templates_dir_path, template_name):
+    """
+    :param templates_dir_path:  the directory of the templates
+    :param template_name:       the name of the template
+    :return:                    the SHA-1 of the template source, None if the template is not found
+    """
+    # The file is hashed as is, without creating the Jinja environment
+    path = os.path.join(templates_dir_path, *template_name.split("/"))
+    if not os.path.isfile(path):
+        return None
+    return file_digest(path)
+
+
+class BuildManifest(object):
+    """
+    Record of the inputs of the thesauri of an output directory, used to rebuild only the thesauri whose inputs
+    changed.
+
+    The inputs of a thesaurus are its input files (shapefiles, spatial filter) and its settings (configuration section,
+    template, filters and options). The size, mtime and SHA-1 of the input files are recorded: a file whose size and
+    mtime did not change is considered unchanged without being read, otherwise its content is hashed and compared.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.thesauri = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.thesauri = json.load(f).get("thesauri", {})
+            except ValueError:
+                self.thesauri = {}
+
+    def is_up_to_date(self, name, input_files, settings, output_path):
+        """
+        :param name:            the name of the thesaurus
+        :param input_files:     the paths of its input files
+        :param settings:        its JSON serializable settings
+        :param output_path:     the path of its output file
+        :return:                True if the output exists and was built from the same inputs
+        """
+        entry = self.thesauri.get(name)
+        if entry is None or not os.path.isfile(output_path):
+            return False
+        if entry.get("output") != output_path or entry.get("settings") != settings_digest(settings):
+            return False
+        if sorted(entry.get("files", {})) != sorted(input_files):
+            return False
+        touched = False
+        for path in input_files:
+            recorded = entry["files"][path]
+            if not os.path.isfile(path):
+                return False
+            stat = os.stat(path)
+            if recorded["size"] == stat.st_size and recorded["mtime"] == stat.st_mtime:
+                continue
+            if recorded["size"] != stat.st_size or recorded["sha1"] != file_digest(path):
+                return False
+            # Same content, the file is not hashed again on the next build
+            recorded["mtime"] = stat.st_mtime
+            touched = True
+        if touched:
+            self.save()
+        return True
+
+    def has_settings(self, name, settings, output_path):
+        """
+        :param name:            the name of the thesaurus
+        :param settings:        its JSON serializable settings
+        :param output_path:     the path of its output file
+        :return:                True if the output was recorded as built with the same settings (format, template...),
+                                whatever its input files
+        """
+        entry = self.thesauri.get(name)
+        return entry is not None and entry.get("output") == output_path and \
+            entry.get("settings") == settings_digest(settings)
+
+    def record(self, name, input_files, settings, output_path):
+        """
+        Record the inputs of a thesaurus just built and save the manifest.
+
+        :param name:            the name of the thesaurus
+        :param input_files:     the paths of its input files
+        :param settings:        its JSON serializable settings
+        :param output_path:     the path of its output file
+        """
+        previous_files = self.thesauri.get(name, {}).get("files", {})
+        files = {}
+        for path in input_files:
+            stat = os.stat(path)
+            previous = previous_files.get(path)
+            if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+                sha1 = previous["sha1"]
+            else:
+                sha1 = file_digest(path)
+            files[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1}
+
+        self.thesauri[name] = {
+            "output": output_path,
+            "settings": settings_digest(settings),
+            "files": files,
+        }
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({"thesauri": self.thesauri}, indent=2, sort_keys=True))
+        replace_file(tmp_path, self.path)
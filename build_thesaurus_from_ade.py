@@ -1,26 +1,40 @@
 # -*- coding: utf-8 -*-
 
 # Standard imports
-import datetime
 import os
 import os.path
-import codecs
 
 # Non standard imports (see requirements.txt)
 import click
-import jinja2
-from shapely.geometry import shape
-from shapely.ops import unary_union
-from shapely.ops import transform
-# Fiona should be imported after shapely - see https://github.com/Toblerity/Shapely/issues/288
-import fiona
-import pyproj
-from functools import partial
-import yaml
 
-from utils import Bunch
-from utils import get_geometry_from_file
-from utils import prettify_xml
+from reprojection import REPROJECTION_MODES
+from spatial_filter import INTERIORS_OVERLAP
+from spatial_filter import SpatialPredicate
+from spatial_filter import SpatialPartition
+from filter_geometry import load_filter_geometry
+from layer_columns import check_columnar
+from layer_columns import clean_strings
+from parallel import create_thesauri_in_parallel
+from build_manifest import get_layers_inputs
+from build_manifest import template_digest
+from batch import Batch
+from batch import PartitionIndex
+from batch import check_batch_name
+from batch import parse_batches
+from batch import parse_dept_filter
+from hierarchy import HierarchyIndex
+from layer_cache import Layer
+from utils import LazyModule
+from utils import get_layer_source
+from utils import split_layer_source
+from output import COMPRESSIONS
+from output import OUTPUT_FORMATS
+from output import check_compression
+from thesauri_builder import ThesauriBuilder
+
+# Imported on first use, as the modules reading the layers
+numpy = LazyModule('numpy')
+shapely_ops = LazyModule('shapely.ops')
 
 
 @click.command()
@@ -30,10 +44,70 @@ from utils import prettify_xml
               help='Allows to overwrite an existing thesaurus file')
 @click.option('--compact/--no-compact', default=False,
               help='Write compact rdf file')
+@click.option('--output-format', type=click.Choice(OUTPUT_FORMATS), default='rdf',
+              help='Format of the thesaurus files: RDF/XML (rdf, by default), N-Triples (nt) or Turtle (ttl) with '
+                   'one triple per line')
+@click.option('--compression', type=click.Choice(COMPRESSIONS), default=None,
+              help='Compress the thesaurus files with gzip (.gz) or zstd (.zst, requires the zstandard module)')
 @click.option('--dept-filter',
               help='List of departement numbers or names used to filter the municipalities.')
 @click.option('--filter-shp-path', type=click.Path(exists=True, dir_okay=False),
-              help='Path of a shapefile used to spatially filter the entities.')
+              help='Path of a shapefile (or GeoPackage, FlatGeobuf...) used to spatially filter the entities.')
+@click.option('--filter-layer',
+              help='Name of the layer of --filter-shp-path used as the filter, for a file having several layers '
+                   '(GeoPackage). Its first layer by default.')
+@click.option('--filter-tolerance', type=click.FloatRange(min=0), default=0,
+              help='Tolerance, in the units of the CRS of --filter-shp-path, of the simplified approximations of the '
+                   'spatial filter testing the entities away from its boundary without the exact geometry. '
+                   '0 (by default) to disable.')
+@click.option('--reprojection', type=click.Choice(REPROJECTION_MODES), default='hull',
+              help='Part of the geometries reprojected to compute the WGS84 bounding boxes: every vertex (exact), '
+                   'the convex hull (hull) or the densified envelope (envelope)')
+@click.option('--bbox-tolerance', type=float, default=1e-6,
+              help='Maximal deviation in degrees from the exact bounding box in hull or envelope mode. '
+                   'The exact mode is used for the geometries exceeding it. Negative to disable the check.')
+@click.option('--release-layers/--keep-layers', default=True,
+              help='Release the source layers from memory once no remaining thesaurus needs them')
+@click.option('--incremental', is_flag=True, default=False,
+              help='Only create the thesauri whose input files, configuration, template or filters changed since '
+                   'the last build')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of processes reading the features of the thesauri in parallel')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=2000,
+              help='Number of features read by a process at once when --jobs is greater than 1, or handled by a '
+                   'thread at once with --threads')
+@click.option('--threads', type=click.IntRange(min=0), default=0,
+              help='Number of threads computing the bounding boxes and the spatial filters of the features while a '
+                   'thread reads the next ones, a thread writing the thesaurus files meanwhile. 0 (by default) to '
+                   'handle the features in a single thread')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help='Directory caching the attributes and WGS84 bounding boxes of the features of the shapefiles, '
+                   'read instead of the shapefiles when no spatial filtering is needed')
+@click.option('--batch', multiple=True,
+              help='Batch output written in the NAME subdirectory of the output directory, given as '
+                   'NAME=DEPARTEMENTS with the same departements list as --dept-filter. Repeatable, added to the '
+                   'batches section of the config file. All the batches are created from a single read of the '
+                   'shapefiles.')
+@click.option('--batch-per-dept', is_flag=True, default=False,
+              help='Add a batch output per departement, or per departement of --dept-filter, named by its number')
+@click.option('--profile', is_flag=True, default=False,
+              help='Time the stages of the creation of each thesaurus, count the features read and kept, record '
+                   'the memory used and write the whole in thesaurus_profile.json in the output directory')
+@click.option('--cprofile', is_flag=True, default=False,
+              help='With --profile, also dump the cProfile statistics in thesaurus_profile.prof in the output '
+                   'directory')
+@click.option('--max-memory', type=click.IntRange(1, None), default=None,
+              help='Maximal memory in megabytes used to keep the territories of a thesaurus. Beyond it, the '
+                   'territories are sorted by chunks spilled to temporary files, then merged while writing the '
+                   'thesaurus.')
+@click.option('--columnar', is_flag=True, default=False,
+              help='Read the layers in bulk as columns (with pyogrio if installed) and compute the bounding boxes, '
+                   'the filters and the cleaning of the names with vectorized operations, instead of handling the '
+                   'features one by one. Requires shapely >= 2.0')
+@click.option('--delta', is_flag=True, default=False,
+              help='Compare each thesaurus to its existing file, only replaced if a concept was added, removed or '
+                   'modified, and write the changes in a .changeset.json file next to it. Requires --output-format '
+                   'rdf')
 @click.option('--cfg-path', type=click.Path(exists=True, dir_okay=False), default="config_ade.yml",
               help='Path of a config file.')
 @click.option('--thesaurus', multiple=True, type=click.Choice(['commune', 'region', 'departement', 'epci']),
@@ -47,7 +121,26 @@ def create_thesauri(
         output_dir,
         dept_filter=None,
         filter_shp_path=None,
-        cfg_path=None):
+        filter_layer=None,
+        filter_tolerance=0,
+        cfg_path=None,
+        reprojection='hull',
+        bbox_tolerance=1e-6,
+        release_layers=True,
+        jobs=1,
+        chunk_size=2000,
+        threads=0,
+        incremental=False,
+        cache_dir=None,
+        batch=(),
+        batch_per_dept=False,
+        profile=False,
+        cprofile=False,
+        max_memory=None,
+        output_format='rdf',
+        compression=None,
+        columnar=False,
+        delta=False):
     """
     This command creates a SKOS thesaurus for the french municipalities based on the ADMIN EXPRESS dataset from IGN
     (french mapping national agency). The created thesaurus can be used in Geonetwork.
@@ -60,10 +153,43 @@ def create_thesauri(
     python build_thesaurus_from_ade.py --dept-filter "02,60,80" output\n
     python build_thesaurus_from_ade.py --dept-filter "  02,    oise, SOMME" output\n
     python build_thesaurus_from_ade.py --dept-filter "02,60,80" --filter-shp-path my_filter.shp output\n
+    python build_thesaurus_from_ade.py --filter-shp-path my_filter.shp --filter-tolerance 50 --cache-dir cache output\n
     python build_thesaurus_from_ade.py --cfg-path config_ade.yml --dept-filter "02,60,80" --overwrite temp\n
     python build_thesaurus_from_ade.py --cfg-path ./temp/config.yml --dept-filter "02,60,80" --overwrite --thesaurus departement temp\n
+    python build_thesaurus_from_ade.py --reprojection exact --overwrite output\n
+    python build_thesaurus_from_ade.py --jobs 16 --overwrite output\n
+    python build_thesaurus_from_ade.py --incremental output\n
+    python build_thesaurus_from_ade.py --cache-dir cache --dept-filter "02,60,80" --overwrite output\n
+    python build_thesaurus_from_ade.py --batch-per-dept --batch "picardie=02,60,80" --overwrite output\n
+    python build_thesaurus_from_ade.py --profile --cprofile --overwrite output\n
+    python build_thesaurus_from_ade.py --max-memory 512 --overwrite output\n
+    python build_thesaurus_from_ade.py --output-format nt --compression gzip --overwrite output\n
+    python build_thesaurus_from_ade.py --columnar --filter-shp-path my_filter.shp --overwrite output\n
+    python build_thesaurus_from_ade.py --filter-shp-path my_filters.gpkg --filter-layer zone --overwrite output\n
+    python build_thesaurus_from_ade.py --delta output\n
+    python build_thesaurus_from_ade.py --threads 2 --filter-shp-path my_filter.shp --profile --overwrite output\n
     """
 
+    try:
+        batches = parse_batches(batch)
+    except ValueError as e:
+        raise click.BadParameter(u"{}".format(e), param_hint="--batch")
+    try:
+        check_compression(compression)
+    except ValueError as e:
+        raise click.BadParameter(u"{}".format(e), param_hint="--compression")
+    if columnar:
+        try:
+            check_columnar()
+        except ValueError as e:
+            raise click.BadParameter(u"{}".format(e), param_hint="--columnar")
+    if delta and output_format != 'rdf':
+        raise click.BadParameter(u"requires --output-format rdf", param_hint="--delta")
+    if filter_layer and not filter_shp_path:
+        raise click.BadParameter(u"requires --filter-shp-path", param_hint="--filter-layer")
+    if filter_shp_path:
+        filter_shp_path = get_layer_source(filter_shp_path, filter_layer)
+
     thesauri_builder = AdeThesauriBuilder(
         verbose=verbose,
         overwrite=overwrite,
@@ -72,14 +198,34 @@ def create_thesauri(
         output_dir=output_dir,
         dept_filter=dept_filter,
         filter_shp_path=filter_shp_path,
-        cfg_path=cfg_path)
+        filter_tolerance=filter_tolerance,
+        cfg_path=cfg_path,
+        reprojection=reprojection,
+        bbox_tolerance=bbox_tolerance,
+        release_layers=release_layers,
+        jobs=jobs,
+        chunk_size=chunk_size,
+        threads=threads,
+        incremental=incremental,
+        cache_dir=cache_dir,
+        batches=batches,
+        batch_per_dept=batch_per_dept,
+        profile=profile,
+        cprofile=cprofile,
+        max_memory=max_memory,
+        output_format=output_format,
+        compression=compression,
+        columnar=columnar,
+        delta=delta)
 
     thesauri_builder.create_thesauri()
 
     click.echo(u"Done. Goodbye")
 
 
-class AdeThesauriBuilder(object):
+class AdeThesauriBuilder(ThesauriBuilder):
+
+    thesaurus_kind = u"type"
 
     def __init__(self,
                  verbose,
@@ -89,43 +235,74 @@ class AdeThesauriBuilder(object):
                  output_dir,
                  cfg_path,
                  dept_filter=None,
-                 filter_shp_path=None):
+                 filter_shp_path=None,
+                 filter_tolerance=0,
+                 reprojection='hull',
+                 bbox_tolerance=1e-6,
+                 release_layers=True,
+                 jobs=1,
+                 chunk_size=2000,
+                 threads=0,
+                 incremental=False,
+                 cache_dir=None,
+                 batches=None,
+                 batch_per_dept=False,
+                 profile=False,
+                 cprofile=False,
+                 max_memory=None,
+                 output_format='rdf',
+                 compression=None,
+                 columnar=False,
+                 delta=False):
+
+        # Arguments of the builders of the worker processes
+        self.builder_args = dict(
+            verbose=verbose, overwrite=overwrite, compact=compact, thesaurus=thesaurus, output_dir=output_dir,
+            cfg_path=cfg_path, dept_filter=dept_filter, filter_shp_path=filter_shp_path,
+            filter_tolerance=filter_tolerance, reprojection=reprojection, bbox_tolerance=bbox_tolerance,
+            release_layers=release_layers, jobs=jobs, chunk_size=chunk_size, threads=threads, incremental=incremental,
+            cache_dir=cache_dir, batches=batches, batch_per_dept=batch_per_dept,
+            profile=profile, cprofile=cprofile, max_memory=max_memory, output_format=output_format,
+            compression=compression, columnar=columnar, delta=delta)
+
+        super(AdeThesauriBuilder, self).__init__(
+            verbose, overwrite, compact, output_dir, cfg_path, reprojection=reprojection,
+            bbox_tolerance=bbox_tolerance, release_layers=release_layers, jobs=jobs, chunk_size=chunk_size,
+            threads=threads, incremental=incremental, cache_dir=cache_dir, profile=profile, cprofile=cprofile,
+            max_memory=max_memory, output_format=output_format, compression=compression, columnar=columnar,
+            delta=delta)
 
-        self.verbose = verbose
-        self.overwrite = overwrite
-        self.compact = compact
         self.thesaurus = thesaurus
-        self.output_dir = output_dir
         self.filter_shp_path = filter_shp_path
+        self.filter_tolerance = filter_tolerance
+        self.batch_per_dept = batch_per_dept
 
-        with open(cfg_path, 'r') as yaml_file:
-            self.cfg = yaml.load(yaml_file)
-
-        # Configure the templates dir variables
-        templates_dir_path = os.path.join(os.path.dirname(__file__), self.cfg['template_dir_name'])
-        template_loader = jinja2.FileSystemLoader(searchpath=templates_dir_path)
-        self.template_env = jinja2.Environment(
-            loader=template_loader,
-            trim_blocks=True,
-            lstrip_blocks=True)
-
-        # Get the geometry of the spatial filter
+        # The geometry of the spatial filter is read on first use
         if verbose:
             click.echo(u"Shapefile filter: {}".format(filter_shp_path))
-        self.spatial_filter_geom = None
-        try:
-            if filter_shp_path is not None:
-                self.spatial_filter_geom = get_geometry_from_file(filter_shp_path)
-        except Exception as e:
-            click.echo(u"The shapefile specified for spatial filtering could not be  opened. "
-                       u"No spatial filter will be applied.")
+        self._spatial_filter = None
 
         # Create the list of departements
         self.dept_list = None
         if dept_filter is not None:
-            self.dept_list = [dept.strip().lower() for dept in dept_filter.split(",")]
+            self.dept_list = parse_dept_filter(dept_filter)
+        self.dept_set = set(self.dept_list) if self.dept_list else None
+
+        # The hierarchy of the departements and regions is indexed on first use
+        self._hierarchy = None
         if verbose:
-            click.echo(u"Departements filter: {}".format('|'.join(self.dept_list)))
+            click.echo(u"Departements filter: {}".format('|'.join(self.dept_list or [])))
+
+        # Departements filters of the batch outputs by name, from the config file and the command line
+        self.batches = dict(self.cfg.get('batches') or {})
+        for name in self.batches:
+            try:
+                check_batch_name(u"{}".format(name))
+            except ValueError as e:
+                raise click.ClickException(u"batches section of {}: {}".format(cfg_path, e))
+        self.batches.update(batches or {})
+        if self.batches and self.dept_list and not batch_per_dept:
+            click.echo(u"Departements filter ignored by the batch outputs.")
 
         if not self.thesaurus:
             self.thesaurus = ("commune", "departement", "region", "epci")
@@ -133,173 +310,533 @@ class AdeThesauriBuilder(object):
         click.echo(u"Thesauri to be produced: {}".format(", ".join(self.thesaurus)))
 
     def create_thesauri(self):
-        for thesaurus_type in self.thesaurus:
-            self.create_thesaurus(thesaurus_type)
-
-    def create_thesaurus(self, thesaurus_type):
+        self.profiler.start()
 
-        click.echo(u"Thesaurus creation: {}".format(thesaurus_type))
-
-        thesaurus_cfg = self.cfg.get(thesaurus_type, None)
-        if not thesaurus_cfg:
-            click.echo(u"  Unknown thesaurus type: {}.".format(thesaurus_type))
-            return
-
-        # Output file name and path
-        rdf_file_name = thesaurus_cfg.get('out')
-        if rdf_file_name:
-            rdf_file_path = os.path.join(self.output_dir, rdf_file_name)
+        if self.batches or self.batch_per_dept:
+            self.create_batch_thesauri()
+        elif self.jobs > 1:
+            create_thesauri_in_parallel(self, self.thesaurus, self.jobs, self.chunk_size)
         else:
-            click.echo(u"  Output rdf file name not found. Stop here")
-            return
-
-        if self.verbose:
-            click.echo(u"  Output file path: {}".format(rdf_file_path))
-
-        # Test if the rdf file already exists when --no-overwrite
-        if not self.overwrite and os.path.isfile(rdf_file_path):
-            click.echo(u"  Output file {} already exists. Won't be overwritten.".format(rdf_file_path))
-            click.echo(u"  Add option --overwrite to overwrite it.")
-            return
-
-        # Read the template file using the environment object
-        if self.verbose:
-            click.echo(u"  Loading template {}".format(thesaurus_cfg['template']))
-
-        try:
-            template = self.template_env.get_template(thesaurus_cfg['template'])
-        except Exception as e:
-            click.echo(u"  Template {} not found. Stop here.".format(thesaurus_cfg['template']))
-            return
-
-        # Create the list of territories
-        terr_list = []
-        depts = []
-        depts_geom = None
-        check_ade = True
-        ade_shp_path = os.path.join(self.cfg['ade_dir_name'], thesaurus_cfg['shp'])
+            # Build plan: the layers read by each thesaurus are loaded only once
+            self.layer_cache.plan({t: self.get_layer_paths(t) for t in self.thesaurus})
+
+            for thesaurus_type in self.thesaurus:
+                try:
+                    self.create_thesaurus(thesaurus_type)
+                finally:
+                    self.layer_cache.release(self.get_layer_paths(thesaurus_type))
+
+            if self.verbose:
+                for path, reads, hits, derived in self.layer_cache.report():
+                    click.echo(u"Shapefile {}: read {} time(s) from file, {} time(s) from memory, "
+                               u"{} derived value(s) computed".format(path, reads, hits, derived))
+
+        profile_path = self.profiler.write()
+        if profile_path is not None:
+            click.echo(u"Profile report written to {}".format(profile_path))
+
+    def get_batches(self):
+        """
+        :return:    the list of the Batch outputs, the batch per departement ones first
+        """
+        batches = []
+        if self.batch_per_dept:
+            dept_shp_file_path = self.get_layer_path('departement')
+            depts = self.layer_cache.get_derived(dept_shp_file_path, 'depts', self.read_depts)
+            for dept in sorted(depts, key=lambda d: d["dept_code"]):
+                if not self.dept_set or dept["dept_name"].lower() in self.dept_set or \
+                        dept["dept_code"] in self.dept_set:
+                    batches.append(Batch(dept["dept_code"], [dept["dept_code"]], self.output_dir))
+        for name in sorted(self.batches):
+            batches.append(Batch(name, parse_dept_filter(self.batches[name]), self.output_dir))
+        return batches
+
+    def use_batch(self, batch):
+        """
+        Direct the departements filter, the output files and the build manifest to those of a batch output.
+        """
+        self.dept_list = batch.dept_list
+        self.dept_set = set(batch.dept_list) if batch.dept_list else None
+        self.output_dir = batch.output_dir
+        self.manifest = batch.manifest
+
+    def create_batch_thesauri(self):
+        """
+        Create the thesauri of all the batch outputs. The territories of each thesaurus are read once, indexed by
+        departement and then selected and written for every batch.
+        """
+        self.layer_cache.plan({t: self.get_layer_paths(t) for t in self.thesaurus})
+        if self.batch_per_dept:
+            self.layer_cache.plan({'batches': [self.get_layer_path('departement')]})
+
+        batches = self.get_batches()
+        if self.batch_per_dept:
+            self.layer_cache.release([self.get_layer_path('departement')])
+        click.echo(u"Batch outputs: {}".format(", ".join(batch.name for batch in batches)))
 
+        for thesaurus_type in self.thesaurus:
+            try:
+                prepared = []
+                for batch in batches:
+                    self.use_batch(batch)
+                    click.echo(u"Batch {}".format(batch.name))
+                    prepared_thesaurus = self.prepare_thesaurus(thesaurus_type)
+                    if prepared_thesaurus is not None:
+                        prepared.append((batch, prepared_thesaurus))
+                if not prepared:
+                    continue
+
+                terr_list = self.read_territories(thesaurus_type, partition=True)
+                if terr_list is None:
+                    continue
+                with self.profiler.stage(thesaurus_type, 'sort'):
+                    terr_list.sort()
+                with self.profiler.stage(thesaurus_type, 'partition'):
+                    index = PartitionIndex(terr_list)
+
+                for batch, prepared_thesaurus in prepared:
+                    self.use_batch(batch)
+                    rdf_dir_path = os.path.dirname(prepared_thesaurus[1])
+                    if not os.path.isdir(rdf_dir_path):
+                        os.makedirs(rdf_dir_path)
+                    with self.profiler.stage(thesaurus_type, 'partition'):
+                        batch_terr_list = index.select(batch.dept_list)
+                    self.write_thesaurus(thesaurus_type, prepared_thesaurus, batch_terr_list)
+            finally:
+                self.layer_cache.release(self.get_layer_paths(thesaurus_type))
+
+    @property
+    def spatial_filter(self):
+        """
+        The FilterGeometry of the spatial filter, None if no spatial filter is applied
+        """
+        if self._spatial_filter is None and self.filter_shp_path is not None:
+            try:
+                self._spatial_filter = load_filter_geometry(self.filter_shp_path, cache_dir=self.cache_dir,
+                                                            tolerance=self.filter_tolerance)
+            except Exception as e:
+                click.echo(u"The shapefile specified for spatial filtering could not be  opened. "
+                           u"No spatial filter will be applied.")
+                self.filter_shp_path = None
+        return self._spatial_filter
+
+    def get_build_inputs(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                the (input files, settings) tuple recorded in the build manifest
+        """
+        sources = self.get_layer_paths(thesaurus_type)
+        config = {thesaurus_type: self.cfg[thesaurus_type]}
+        if thesaurus_type in ("region", "epci"):
+            config['departement'] = self.cfg['departement']
+        if self.has_commune_links(thesaurus_type):
+            # The narrower links of the departements are read from the communes layer
+            sources.append(self.get_layer_path('commune'))
+            config['commune'] = self.cfg['commune']
+        if self.filter_shp_path is not None:
+            sources.append(self.filter_shp_path)
+        input_files, layers = get_layers_inputs(sources)
+
+        settings = {
+            "config": config,
+            "template": template_digest(self.templates_dir_path, self.cfg[thesaurus_type]['template']),
+            "dept_filter": self.dept_list,
+            "reprojection": [self.reprojection, self.bbox_tolerance],
+            "compact": self.compact,
+        }
+        if layers:
+            settings["layers"] = layers
+        return input_files, settings
+
+    def get_thesaurus_cfg(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                its section of the config, None if unknown
+        """
+        return self.cfg.get(thesaurus_type)
+
+    def get_layer_path(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                the source of its layer: the path of its file (shp key of the config), followed by the
+                                name of the layer (layer key) for a file having several layers (see get_layer_source)
+        """
+        thesaurus_cfg = self.cfg[thesaurus_type]
+        return get_layer_source(os.path.join(self.cfg['ade_dir_name'], thesaurus_cfg['shp']),
+                                thesaurus_cfg.get('layer'))
+
+    def get_layer_paths(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                the paths of the shapefiles read to create the thesaurus
+        """
+        if not self.cfg.get(thesaurus_type):
+            return []
+        paths = [self.get_layer_path(thesaurus_type)]
+        if thesaurus_type in ("region", "epci"):
+            paths.append(self.get_layer_path('departement'))
+        return paths
+
+    def read_depts(self, dept_layer):
+        """
+        :param dept_layer:  the Layer of the departements
+        :return:            the list of the departements with their region code and geometry
+        """
+        fields = self.cfg['departement']['fields']
+        return [{
+            "dept_name": d_props[fields['nom']].strip(),
+            "dept_code": d_props[fields['code']].strip(),
+            "reg_code": d_props[fields['codereg']].strip(),
+            "geometry": d_geom,
+        } for d_props, d_geom in dept_layer]
+
+    def get_hierarchy(self, communes=False):
+        """
+        :param communes:    True to index the communes of the departements
+        :return:            the HierarchyIndex of the departements and regions
+        """
+        if self._hierarchy is None:
+            depts = self.layer_cache.get_derived(self.get_layer_path('departement'), 'depts', self.read_depts)
+            self._hierarchy = HierarchyIndex(depts)
+        if communes and not self._hierarchy.has_communes():
+            self._hierarchy.add_communes(self.read_communes())
+        return self._hierarchy
+
+    def has_commune_links(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                True if the concepts of the thesaurus are linked to the communes: the departements,
+                                when the communes layer is configured and found
+        """
+        return thesaurus_type == 'departement' and bool(self.cfg.get('commune')) and \
+            os.path.isfile(split_layer_source(self.get_layer_path('commune'))[0])
+
+    def read_communes(self):
+        """
+        :return:    the list of the (commune code, departement number) tuples of the communes layer, in its order, only
+                    their attributes being read
+        """
+        fields = self.cfg['commune']['fields']
+        commune_shp_file_path = self.get_layer_path('commune')
         if self.verbose:
-            click.echo(u"  Read shapefile {}".format(ade_shp_path))
+            self.echo_layer_read(commune_shp_file_path)
+        layer = self.layer_cache.layers.get(commune_shp_file_path) or Layer(commune_shp_file_path)
+        return [(props[fields['code']].strip(), props[fields['codedept']].strip())
+                for props in layer.read_properties([fields['code'], fields['codedept']])]
+
+    def create_depts_filter(self, dept_layer):
+        """
+        :param dept_layer:  the Layer of the departements
+        :return:            the SpatialPredicate testing the overlap with the departements of the filter
+        """
+        depts = self.layer_cache.get_derived(dept_layer.path, 'depts', self.read_depts)
+        depts_geoms = [dept['geometry'] for dept in depts
+                       if dept["dept_name"].lower() in self.dept_set or dept["dept_code"] in self.dept_set]
+        return SpatialPredicate(shapely_ops.unary_union(depts_geoms), INTERIORS_OVERLAP)
+
+    def create_depts_partition(self, dept_layer):
+        """
+        :param dept_layer:  the Layer of the departements
+        :return:            the SpatialPartition giving the numbers and names of the departements overlapped
+        """
+        depts = self.layer_cache.get_derived(dept_layer.path, 'depts', self.read_depts)
+        return SpatialPartition([(dept['geometry'], set([dept['dept_code'], dept['dept_name'].lower()]))
+                                 for dept in depts], INTERIORS_OVERLAP)
+
+    def get_attributes_filter(self, thesaurus_type, layer, hierarchy=None):
+        """
+        Get the departements filter of a thesaurus as a test of the attributes of the features, read before their
+        geometries.
+
+        :param thesaurus_type:  the type of thesaurus
+        :param layer:           the Layer of the thesaurus
+        :param hierarchy:       the HierarchyIndex, for the region thesaurus
+        :return:                the function testing the properties of a feature, None if the thesaurus is not
+                                filtered on attributes
+        """
+        fields = self.cfg[thesaurus_type]['fields']
+        dept_set = self.dept_set
+        # A missing field is reported when the features are read
+        if not dept_set or any(field not in layer.fields for field in fields.values()):
+            return None
+
+        if thesaurus_type == 'commune':
+            return lambda props: props[fields['nomdept']].strip().lower() in dept_set or \
+                props[fields['codedept']].strip() in dept_set
+        elif thesaurus_type == 'departement':
+            return lambda props: props[fields['nom']].strip().replace("&", "&amp;").lower() in dept_set or \
+                props[fields['code']].strip() in dept_set
+        elif thesaurus_type == 'region' and hierarchy is not None:
+            return lambda props: not dept_set.isdisjoint(hierarchy.get_region_dept_keys(props[fields['code']].strip()))
+        return None
+
+    def get_read_filters(self, thesaurus_type, partition=False):
+        """
+        Get the filters of the geometries of the features of a thesaurus, loading the departements needed to read them.
+
+        :param thesaurus_type:  the type of thesaurus
+        :param partition:       True if the territories are given their departements instead of being filtered
+        :return:                the departements SpatialPredicate (depts_filter), departements SpatialPartition
+                                (depts_partition) and SpatialPredicate of the spatial filter (spatial_filter) by name,
+                                each one being None when not needed, or None if the departements shapefile is missing
+        """
+        depts_filter = None
+        depts_partition = None
 
         if thesaurus_type in ("region", "epci"):
 
             # Reading departement shapefile to get departements list for each region
-            dept_shp_file_name = self.cfg['departement']['shp']
-            dept_shp_file_path = os.path.join(self.cfg['ade_dir_name'], dept_shp_file_name)
+            dept_shp_file_path = self.get_layer_path('departement')
 
-            if os.path.isfile(dept_shp_file_path):
+            if os.path.isfile(split_layer_source(dept_shp_file_path)[0]):
                 if self.verbose:
-                    click.echo(u"  Read shapefile {}".format(dept_shp_file_path))
+                    self.echo_layer_read(dept_shp_file_path)
             else:
                 click.echo(u"  Shapefile {} not found. Mandatory to list departements in regions. Stop here.".format(
                     dept_shp_file_path))
                 return
 
-            with fiona.open(dept_shp_file_path, 'r') as dept_shp:
-                for d in dept_shp:
-                    dept = {
-                        "dept_name": d['properties'][self.cfg['departement']['fields']['nom']].strip(),
-                        "dept_code": d['properties'][self.cfg['departement']['fields']['code']].strip(),
-                        "reg_code": d['properties'][self.cfg['departement']['fields']['codereg']].strip(),
-                        "geometry": d['geometry'],
-                    }
-                    depts.append(dept)
-
-                if self.dept_list:
-                    depts_geoms = [shape(dept['geometry']) for dept in depts
-                                   if dept["dept_name"].lower() in self.dept_list or
-                                   dept["dept_code"] in self.dept_list]
-                    depts_geom = unary_union(depts_geoms)
-
-        with fiona.open(ade_shp_path, 'r') as shp:
-            # func to reproject geom
-            project = partial(
-                pyproj.transform,
-                pyproj.Proj(shp.crs),
-                pyproj.Proj(init='EPSG:4326'))
-
-            for feat in shp:
-                f_props = feat['properties']
-                f_geom = shape(feat['geometry'])
-                f_geom_wgs84 = transform(project, f_geom)
-                lon_min, lat_min, lon_max, lat_max = f_geom_wgs84.bounds
-
-                # On first item only, check ADE fields
-                fields = thesaurus_cfg['fields']
-                if check_ade:
-                    for f in fields:
-                        if not fields[f] in f_props:
-                            click.echo(u"  Fatal error: field {} not found in shapefile.".format(fields[f]))
-                            return
-                    check_ade = False
-
-                name = f_props[fields['nom']].strip().replace("&", "&amp;")
-                code = f_props[fields['code']].strip()
-
-                dept_name = ''
-                dept_code = ''
-                reg_code = ''
-                reg_dept_codes = None
-
-                # If municipalities, get dept infos for filter
+            if partition:
+                if thesaurus_type == 'epci':
+                    depts_partition = self.layer_cache.get_derived(dept_shp_file_path, 'depts_partition',
+                                                                   self.create_depts_partition)
+            elif self.dept_set:
+                depts_filter = self.layer_cache.get_derived(dept_shp_file_path, 'depts_filter',
+                                                            self.create_depts_filter)
+
+        return {
+            'depts_filter': depts_filter,
+            'depts_partition': depts_partition,
+            'spatial_filter': self.spatial_filter.create_predicate() if self.spatial_filter is not None else None,
+        }
+
+    def can_use_bbox_cache(self, thesaurus_type, partition=False):
+        """
+        :return:    True if the cached attributes and bboxes can be read instead of the shapefile of the thesaurus, no
+                    geometry being needed to filter its features
+        """
+        return self.bbox_cache is not None and self.filter_shp_path is None and \
+            not (thesaurus_type == 'epci' and (self.dept_set or partition))
+
+    def get_pushdown(self, thesaurus_type, layer, filters, partition=False):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :param layer:           the Layer of the thesaurus
+        :param filters:         the filters returned by get_read_filters
+        :param partition:       True if the territories are given their departements instead of being filtered
+        :return:                the bbox of the spatial filter or of the departements filter and, unless partitioned,
+                                the departements filter on the attributes (see Layer.read)
+        """
+        pushdown = {}
+        filter_geoms = [f.geom for f in (filters['spatial_filter'], filters['depts_filter'])
+                        if f is not None and not f.geom.is_empty]
+        if filter_geoms:
+            # The smallest bbox of the filters
+            pushdown['bbox'] = min((g.bounds for g in filter_geoms), key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+        if not partition:
+            hierarchy = self.get_region_hierarchy(thesaurus_type)
+            pushdown['accept'] = self.get_attributes_filter(thesaurus_type, layer, hierarchy)
+        return pushdown
+
+    def get_template_data(self, thesaurus_type, thesaurus_cfg, terr_list):
+        """
+        :return:    the data passed to the template, with the HierarchyIndex giving the communes of the departements
+        """
+        data = super(AdeThesauriBuilder, self).get_template_data(thesaurus_type, thesaurus_cfg, terr_list)
+        if self.has_commune_links(thesaurus_type):
+            with self.profiler.stage(thesaurus_type, 'hierarchy'):
+                data["hierarchy"] = self.get_hierarchy(communes=True)
+        return data
+
+    def get_region_hierarchy(self, thesaurus_type):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :return:                the HierarchyIndex for the region thesaurus, None for the others
+        """
+        return self.get_hierarchy() if thesaurus_type == 'region' else None
+
+    def create_territory_getter(self, thesaurus_type, filters, partition=False):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :param filters:         the filters returned by get_read_filters, or their copies for a thread
+        :param partition:       True if the territories are given their departements instead of being filtered
+        :return:                a function taking the properties and geometry of a feature and returning its
+                                territory (see get_territory)
+        """
+        hierarchy = self.get_region_hierarchy(thesaurus_type)
+        test_geometry = {}
+        if filters['depts_partition'] is not None:
+            test_geometry['get_dept_keys'] = self.profiler.wrap(thesaurus_type, 'filter',
+                                                                filters['depts_partition'].get_keys)
+        if filters['depts_filter'] is not None:
+            test_geometry['test_depts_filter'] = self.profiler.wrap(thesaurus_type, 'filter',
+                                                                    filters['depts_filter'].test)
+        if filters['spatial_filter'] is not None:
+            test_geometry['test_spatial_filter'] = self.profiler.wrap(thesaurus_type, 'filter',
+                                                                      filters['spatial_filter'].test)
+
+        def get_territory(f_props, f_geom=None):
+            return self.get_territory(thesaurus_type, f_props, f_geom, hierarchy, partition, **test_geometry)
+        return get_territory
+
+    def get_territory(self, thesaurus_type, f_props, f_geom=None, hierarchy=None, partition=False,
+                      get_dept_keys=None, test_depts_filter=None, test_spatial_filter=None):
+        """
+        Get the territory of a feature of a thesaurus, if kept by the filters.
+
+        :param thesaurus_type:      the type of thesaurus
+        :param f_props:             the properties of the feature
+        :param f_geom:              its geometry, None if read from the BboxCache
+        :param hierarchy:           the HierarchyIndex, for the region thesaurus
+        :param partition:           True if the territory is given its departements instead of being filtered
+        :param get_dept_keys:       the function giving the departements of a geometry, None if not needed
+        :param test_depts_filter:   the function testing a geometry against the departements filter, None if not
+                                    needed
+        :param test_spatial_filter: the function testing a geometry against the spatial filter, None if not needed
+        :return:                    the (code, name, attributes) tuple of the arguments of TerritoryList.append, None
+                                    if the feature is filtered out
+        """
+        fields = self.cfg[thesaurus_type]['fields']
+        name = f_props[fields['nom']].strip().replace("&", "&amp;")
+        code = f_props[fields['code']].strip()
+
+        dept_name = ''
+        dept_code = ''
+        reg_code = ''
+        reg_dept_codes = None
+
+        # If municipalities, get dept infos for filter
+        if thesaurus_type == 'commune':
+            dept_name = f_props[fields['nomdept']].strip()
+            dept_code = f_props[fields['codedept']].strip()
+        # If departement, get region code
+        elif thesaurus_type == 'departement':
+            reg_code = f_props[fields['codereg']].strip()
+        # If region, get departement list
+        elif thesaurus_type == 'region':
+            reg_dept_codes = hierarchy.get_region_depts(code)
+
+        attributes = {'reg': reg_code, 'dept': dept_code, 'dept_reg': reg_dept_codes}
+
+        if partition:
+            if thesaurus_type == 'commune':
+                attributes['dept_keys'] = set([dept_code, dept_name.lower()])
+            elif thesaurus_type == 'departement':
+                attributes['dept_keys'] = set([code, name.lower()])
+            elif thesaurus_type == 'region':
+                attributes['dept_keys'] = hierarchy.get_region_dept_keys(code)
+            else:
+                attributes['dept_keys'] = get_dept_keys(f_geom) if get_dept_keys is not None else set()
+            filter_dept = True
+        elif thesaurus_type == 'commune':
+            filter_dept = not self.dept_set or \
+                          dept_name.lower() in self.dept_set or dept_code in self.dept_set
+        elif thesaurus_type == 'epci':
+            filter_dept = not self.dept_set or \
+                          test_depts_filter is None or test_depts_filter(f_geom)
+        elif thesaurus_type == 'departement':
+            filter_dept = not self.dept_set or \
+                          name.lower() in self.dept_set or code in self.dept_set
+        elif thesaurus_type == 'region':
+            filter_dept = not self.dept_set or not self.dept_set.isdisjoint(hierarchy.get_region_dept_keys(code))
+        else:
+            filter_dept = not self.dept_set or \
+                          test_depts_filter is None or test_depts_filter(f_geom)
+
+        # The territory is kept if there is no spatial filter, else only if its geometry intersects the spatial filter
+        if filter_dept and (test_spatial_filter is None or test_spatial_filter(f_geom)):
+            return code, name, attributes
+        return None
+
+    def append_territory_columns(self, thesaurus_type, columns, filters, terr_list, partition=False):
+        """
+        Filter the features of a thesaurus read as columns and append the territories of the ones kept, giving the
+        same territories as get_territory.
+
+        :param thesaurus_type:  the type of thesaurus
+        :param columns:         the LayerColumns of the features having a bbox
+        :param filters:         the filters returned by get_read_filters
+        :param terr_list:       the list the territories are appended to
+        :param partition:       if True, the territories are not filtered by departement but given the set of the
+                                numbers and names of their departements as dept_keys, for a PartitionIndex
+        """
+        fields = self.cfg[thesaurus_type]['fields']
+        hierarchy = self.get_region_hierarchy(thesaurus_type)
+        depts_filter = filters['depts_filter']
+        depts_partition = filters['depts_partition']
+        spatial_filter = filters['spatial_filter']
+
+        with self.profiler.stage(thesaurus_type, 'records'):
+            names = clean_strings(columns[fields['nom']], escape=True)
+            codes = clean_strings(columns[fields['code']])
+            dept_names = None
+            dept_codes = None
+            reg_codes = None
+            reg_dept_codes = None
+
+            # If municipalities, get dept infos for filter
+            if thesaurus_type == 'commune':
+                dept_names = clean_strings(columns[fields['nomdept']])
+                dept_codes = clean_strings(columns[fields['codedept']])
+            # If departement, get region code
+            elif thesaurus_type == 'departement':
+                reg_codes = clean_strings(columns[fields['codereg']])
+            # If region, get departement list
+            elif thesaurus_type == 'region':
+                reg_dept_codes = [hierarchy.get_region_depts(code) for code in codes.tolist()]
+
+        # Departements filter, on the attributes or on the geometries
+        with self.profiler.stage(thesaurus_type, 'filter'):
+            mask = numpy.ones(len(columns), dtype=bool)
+            if self.dept_set and not partition:
+                dept_list = list(self.dept_set)
                 if thesaurus_type == 'commune':
-                    dept_name = f_props[fields['nomdept']].strip()
-                    dept_code = f_props[fields['codedept']].strip()
-                # If departement, get region code
+                    mask = numpy.isin(numpy.char.lower(dept_names), dept_list) | numpy.isin(dept_codes, dept_list)
                 elif thesaurus_type == 'departement':
-                    reg_code = f_props[fields['codereg']].strip()
-                # If region, get departement list
+                    mask = numpy.isin(numpy.char.lower(names), dept_list) | numpy.isin(codes, dept_list)
                 elif thesaurus_type == 'region':
-                    reg_dept_codes = [dept['dept_code'] for dept in depts
-                                      if dept['reg_code'] == f_props[fields['code']].strip()]
-
-                terr = Bunch(name=name,
-                             lon_min=lon_min, lat_min=lat_min, lon_max=lon_max, lat_max=lat_max,
-                             code=code, reg=reg_code, dept_reg=reg_dept_codes)
-
-                # Add the object to the list of territories if non spatial filter, else we only add it to the list
-                # if its geometry intersects the spatial filter
-                filter_geom = self.spatial_filter_geom is None or f_geom.relate(self.spatial_filter_geom)[0] != 'F'
-
+                    mask = numpy.array([not self.dept_set.isdisjoint(hierarchy.get_region_dept_keys(code))
+                                        for code in codes.tolist()], dtype=bool)
+                elif depts_filter is not None:
+                    mask = depts_filter.test_array(columns.geoms)
+
+            # The spatial filter is only tested for the features kept by the departements filter
+            if spatial_filter is not None:
+                mask[mask] = spatial_filter.test_array(columns.geoms[mask])
+
+        with self.profiler.stage(thesaurus_type, 'records'):
+            kept = numpy.flatnonzero(mask)
+            kept_codes = codes[kept].tolist()
+            kept_names = names[kept].tolist()
+            attributes = {
+                'reg': reg_codes[kept].tolist() if reg_codes is not None else [''] * len(kept),
+                'dept': dept_codes[kept].tolist() if dept_codes is not None else [''] * len(kept),
+                'dept_reg': [reg_dept_codes[i] for i in kept] if reg_dept_codes is not None else [None] * len(kept),
+            }
+
+            if partition:
                 if thesaurus_type == 'commune':
-                    filter_dept = self.dept_list is None or len(self.dept_list) == 0 or \
-                                  dept_name.lower() in self.dept_list or dept_code in self.dept_list
-                elif thesaurus_type == 'epci':
-                    filter_dept = self.dept_list is None or len(self.dept_list) == 0 or \
-                                  depts_geom is None or f_geom.relate(depts_geom)[0] == '2'
+                    attributes['dept_keys'] = [set([dept_code, dept_name.lower()]) for dept_code, dept_name in
+                                               zip(attributes['dept'], dept_names[kept].tolist())]
                 elif thesaurus_type == 'departement':
-                    filter_dept = self.dept_list is None or len(self.dept_list) == 0 or \
-                                  name.lower() in self.dept_list or code in self.dept_list
+                    attributes['dept_keys'] = [set([code, name.lower()]) for code, name in zip(kept_codes, kept_names)]
                 elif thesaurus_type == 'region':
-                    filter_dept = self.dept_list is None or len(self.dept_list) == 0 or \
-                                  len(set(self.dept_list).intersection(reg_dept_codes)) > 0
+                    attributes['dept_keys'] = [hierarchy.get_region_dept_keys(code) for code in kept_codes]
+                elif depts_partition is not None:
+                    with self.profiler.stage(thesaurus_type, 'filter'):
+                        attributes['dept_keys'] = [depts_partition.get_keys(geom) for geom in columns.geoms[kept]]
                 else:
-                    filter_dept = self.dept_list is None or len(self.dept_list) == 0 or \
-                                  depts_geom is None or f_geom.relate(depts_geom)[0] == '2'
-
-                if filter_geom and filter_dept:
-                    terr_list.append(terr)
-
-            terr_list.sort(key=lambda t: t.code)
+                    attributes['dept_keys'] = [set() for i in kept]
 
-        # data passed to the template
-        data = {
-            "title": thesaurus_cfg["title"],
-            "date": datetime.date.today().isoformat(),
-            "terr_list": terr_list,
-            "thesaurus": thesaurus_type
-        }
-
-        # Finally, process the template to produce our final text.
-        rdf_content = template.render(data)
-        rdf_content = prettify_xml(rdf_content, minify=self.compact)
-
-        if self.verbose:
-            click.echo(u"  Write output file {}".format(rdf_file_path))
+            terr_list.append_columns(kept_codes, kept_names, columns.bounds[kept].tolist(), **attributes)
 
-        with codecs.open(rdf_file_path, "w", "utf-8") as f:
-            f.write(rdf_content)
+    def echo_filters_report(self, filters):
+        if filters['depts_filter'] is not None:
+            click.echo(u"  Departements filter: {}".format(filters['depts_filter'].report()))
+        if filters['depts_partition'] is not None:
+            click.echo(u"  Departements partition: {}".format(filters['depts_partition'].report()))
+        if filters['spatial_filter'] is not None:
+            click.echo(u"  Spatial filter: {}".format(filters['spatial_filter'].report()))
 
 if __name__ == '__main__':
     create_thesauri()
@@ -1,24 +1,30 @@
 # -*- coding: utf-8 -*-
 
-# Standard imports
-import datetime
-import os
-import os.path
-import codecs
-
 # Non standard imports (see requirements.txt)
 import click
-import jinja2
-from shapely.geometry import shape
-from shapely.ops import transform
-# Fiona should be imported after shapely - see https://github.com/Toblerity/Shapely/issues/288
-import fiona
-import pyproj
-from functools import partial
-import yaml
 
-from utils import Bunch
-from utils import prettify_xml
+from reprojection import REPROJECTION_MODES
+from reprojection import get_transformer
+from reprojection import reproject_from_wgs84
+from layer_columns import check_columnar
+from layer_columns import clean_strings
+from layer_columns import read_layer_columns
+from parallel import create_thesauri_in_parallel
+from build_manifest import get_layers_inputs
+from build_manifest import template_digest
+from spatial_join import JOIN_METHODS
+from spatial_join import REPRESENTATIVE_POINT
+from spatial_join import JoinCache
+from spatial_join import SpatialJoin
+from output import COMPRESSIONS
+from output import OUTPUT_FORMATS
+from output import check_compression
+from thesauri_builder import ThesauriBuilder
+from utils import LazyModule
+from utils import get_layer_source
+
+# Imported on first use, as the modules reading the layers
+shapely_ops = LazyModule('shapely.ops')
 
 
 @click.command()
@@ -28,6 +34,52 @@ from utils import prettify_xml
               help='Allows to overwrite an existing thesaurus file')
 @click.option('--compact/--no-compact', default=False,
               help='Write compact rdf file')
+@click.option('--output-format', type=click.Choice(OUTPUT_FORMATS), default='rdf',
+              help='Format of the thesaurus files: RDF/XML (rdf, by default), N-Triples (nt) or Turtle (ttl) with '
+                   'one triple per line')
+@click.option('--compression', type=click.Choice(COMPRESSIONS), default=None,
+              help='Compress the thesaurus files with gzip (.gz) or zstd (.zst, requires the zstandard module)')
+@click.option('--reprojection', type=click.Choice(REPROJECTION_MODES), default='hull',
+              help='Part of the geometries reprojected to compute the WGS84 bounding boxes: every vertex (exact), '
+                   'the convex hull (hull) or the densified envelope (envelope)')
+@click.option('--bbox-tolerance', type=float, default=1e-6,
+              help='Maximal deviation in degrees from the exact bounding box in hull or envelope mode. '
+                   'The exact mode is used for the geometries exceeding it. Negative to disable the check.')
+@click.option('--release-layers/--keep-layers', default=True,
+              help='Release the source layers from memory once no remaining thesaurus needs them')
+@click.option('--incremental', is_flag=True, default=False,
+              help='Only create the thesauri whose input files, configuration, template or filters changed since '
+                   'the last build')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of processes reading the features of the thesauri in parallel')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=2000,
+              help='Number of features read by a process at once when --jobs is greater than 1, or handled by a '
+                   'thread at once with --threads')
+@click.option('--threads', type=click.IntRange(min=0), default=0,
+              help='Number of threads computing the bounding boxes of the features while a thread reads the next '
+                   'ones, a thread writing the thesaurus files meanwhile. 0 (by default) to handle the features in a '
+                   'single thread')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help='Directory caching the attributes and WGS84 bounding boxes of the features of the shapefiles, '
+                   'read instead of the shapefiles when they did not change')
+@click.option('--profile', is_flag=True, default=False,
+              help='Time the stages of the creation of each thesaurus, count the features read and kept, record '
+                   'the memory used and write the whole in thesaurus_profile.json in the output directory')
+@click.option('--cprofile', is_flag=True, default=False,
+              help='With --profile, also dump the cProfile statistics in thesaurus_profile.prof in the output '
+                   'directory')
+@click.option('--max-memory', type=click.IntRange(1, None), default=None,
+              help='Maximal memory in megabytes used to keep the territories of a thesaurus. Beyond it, the '
+                   'territories are sorted by chunks spilled to temporary files, then merged while writing the '
+                   'thesaurus.')
+@click.option('--columnar', is_flag=True, default=False,
+              help='Read the layers in bulk as columns (with pyogrio if installed) and compute the bounding boxes and '
+                   'clean the names with vectorized operations, instead of handling the features one by one. '
+                   'Requires shapely >= 2.0')
+@click.option('--delta', is_flag=True, default=False,
+              help='Compare each thesaurus to its existing file, only replaced if a concept was added, removed or '
+                   'modified, and write the changes in a .changeset.json file next to it. Requires --output-format '
+                   'rdf')
 @click.option('--cfg-path', type=click.Path(exists=True, dir_okay=False), default="config_simple_shp.yml",
               help='Path of a config file.')
 @click.argument('output-dir', nargs=1, type=click.Path(exists=True, dir_okay=True, file_okay=False, writable=True))
@@ -36,7 +88,22 @@ def create_thesauri(
         overwrite,
         compact,
         output_dir,
-        cfg_path):
+        cfg_path,
+        reprojection='hull',
+        bbox_tolerance=1e-6,
+        release_layers=True,
+        jobs=1,
+        chunk_size=2000,
+        threads=0,
+        incremental=False,
+        cache_dir=None,
+        profile=False,
+        cprofile=False,
+        max_memory=None,
+        output_format='rdf',
+        compression=None,
+        columnar=False,
+        delta=False):
     """
     This command creates a SKOS thesaurus for the french municipalities based on the ADMIN EXPRESS dataset from IGN
     (french mapping national agency). The created thesaurus can be used in Geonetwork.
@@ -45,160 +112,360 @@ def create_thesauri(
     python build_thesaurus_from_simple_shp.py output\n
     python build_thesaurus_from_simple_shp.py --verbose --overwrite output\n
     python build_thesaurus_from_simple_shp.py --cfg-path ./temp/config_simple_shp.yml --overwrite temp/out\n
+    python build_thesaurus_from_simple_shp.py --reprojection exact --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --cache-dir cache --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --profile --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --max-memory 512 --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --output-format ttl --compression zstd --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --columnar --overwrite output\n
+    python build_thesaurus_from_simple_shp.py --delta output\n
+    python build_thesaurus_from_simple_shp.py --threads 2 --profile --overwrite output\n
     """
 
+    try:
+        check_compression(compression)
+    except ValueError as e:
+        raise click.BadParameter(u"{}".format(e), param_hint="--compression")
+    if columnar:
+        try:
+            check_columnar()
+        except ValueError as e:
+            raise click.BadParameter(u"{}".format(e), param_hint="--columnar")
+    if delta and output_format != 'rdf':
+        raise click.BadParameter(u"requires --output-format rdf", param_hint="--delta")
+
     thesauri_builder = ShpThesauriBuilder(
         verbose=verbose,
         overwrite=overwrite,
         compact=compact,
         output_dir=output_dir,
-        cfg_path=cfg_path)
+        cfg_path=cfg_path,
+        reprojection=reprojection,
+        bbox_tolerance=bbox_tolerance,
+        release_layers=release_layers,
+        jobs=jobs,
+        chunk_size=chunk_size,
+        threads=threads,
+        incremental=incremental,
+        cache_dir=cache_dir,
+        profile=profile,
+        cprofile=cprofile,
+        max_memory=max_memory,
+        output_format=output_format,
+        compression=compression,
+        columnar=columnar,
+        delta=delta)
 
     thesauri_builder.create_thesauri()
 
     click.echo(u"Done. Goodbye")
 
 
-class ShpThesauriBuilder(object):
+class ShpThesauriBuilder(ThesauriBuilder):
 
     def __init__(self,
                  verbose,
                  overwrite,
                  compact,
                  output_dir,
-                 cfg_path):
-
-        self.verbose = verbose
-        self.overwrite = overwrite
-        self.compact = compact
-        self.output_dir = output_dir
-
-        with open(cfg_path, 'r') as yaml_file:
-            self.cfg = yaml.load(yaml_file)
-
-        # Configure the templates dir variables
-        templates_dir_path = os.path.join(os.path.dirname(__file__), self.cfg['template_dir_name'])
-        template_loader = jinja2.FileSystemLoader(searchpath=templates_dir_path)
-        self.template_env = jinja2.Environment(
-            loader=template_loader,
-            trim_blocks=True,
-            lstrip_blocks=True)
+                 cfg_path,
+                 reprojection='hull',
+                 bbox_tolerance=1e-6,
+                 release_layers=True,
+                 jobs=1,
+                 chunk_size=2000,
+                 threads=0,
+                 incremental=False,
+                 cache_dir=None,
+                 profile=False,
+                 cprofile=False,
+                 max_memory=None,
+                 output_format='rdf',
+                 compression=None,
+                 columnar=False,
+                 delta=False):
+
+        # Arguments of the builders of the worker processes
+        self.builder_args = dict(
+            verbose=verbose, overwrite=overwrite, compact=compact, output_dir=output_dir, cfg_path=cfg_path,
+            reprojection=reprojection, bbox_tolerance=bbox_tolerance, release_layers=release_layers, jobs=jobs,
+            chunk_size=chunk_size, threads=threads, incremental=incremental, cache_dir=cache_dir, profile=profile,
+            cprofile=cprofile, max_memory=max_memory, output_format=output_format, compression=compression,
+            columnar=columnar, delta=delta)
+
+        super(ShpThesauriBuilder, self).__init__(
+            verbose, overwrite, compact, output_dir, cfg_path, reprojection=reprojection,
+            bbox_tolerance=bbox_tolerance, release_layers=release_layers, jobs=jobs, chunk_size=chunk_size,
+            threads=threads, incremental=incremental, cache_dir=cache_dir, profile=profile, cprofile=cprofile,
+            max_memory=max_memory, output_format=output_format, compression=compression, columnar=columnar,
+            delta=delta)
+
+        self.join_cache = JoinCache(cache_dir) if cache_dir else None
+        # Results of the spatial joins of the build, by (child thesaurus, parent thesaurus, method)
+        self.joins = {}
 
         # Thesauri list
         self.thesauri_list = self.cfg["thesauri"].keys()
         click.echo(u"Thesauri to be produced: {}".format(", ".join(self.thesauri_list)))
 
-    def create_thesauri(self):
-
-        for thesaurus_name in self.thesauri_list:
-            self.create_thesaurus(thesaurus_name)
-
-    def create_thesaurus(self, thesaurus_name):
+        # The parents sections, checked once: the valid (parent thesaurus, join method) tuples by thesaurus
+        self.parents = dict((thesaurus_name, self.read_parents(thesaurus_name))
+                            for thesaurus_name in sorted(self.cfg["thesauri"]))
 
-        click.echo(u"Thesaurus creation: {}".format(thesaurus_name))
-
-        thesaurus_cfg = self.cfg["thesauri"].get(thesaurus_name, None)
-        if not thesaurus_cfg:
-            click.echo(u"  Unknown thesaurus name: {}.".format(thesaurus_name))
-            return
+    def create_thesauri(self):
+        self.profiler.start()
 
-        # Output file name and path
-        rdf_file_name = thesaurus_cfg.get('out')
-        if rdf_file_name:
-            rdf_file_path = os.path.join(self.output_dir, rdf_file_name)
+        if self.jobs > 1:
+            create_thesauri_in_parallel(self, self.thesauri_list, self.jobs, self.chunk_size)
         else:
-            click.echo(u"  Output rdf file name not found. Stop here")
-            return
-
-        if self.verbose:
-            click.echo(u"  Output file path: {}".format(rdf_file_path))
-
-        # Test if the rdf file already exists when --no-overwrite
-        if not self.overwrite and os.path.isfile(rdf_file_path):
-            click.echo(u"  Output file {} already exists. Won't be overwritten.".format(rdf_file_path))
-            click.echo(u"  Add option --overwrite to overwrite it.")
-            return
-
-        # Read the template file using the environment object
-        if self.verbose:
-            click.echo(u"  Loading template {}".format(thesaurus_cfg['template']))
-
-        try:
-            template = self.template_env.get_template(thesaurus_cfg['template'])
-        except Exception as e:
-            click.echo(u"  Template {} not found. Stop here.".format(thesaurus_cfg['template']))
-            return
-
-        # URI template
-        uri_scheme = thesaurus_cfg.get('uri_scheme')
-        uri_template = "{}#{}".format(uri_scheme, "{}")
-
-        # Create the list of territories
-        terr_list = []
-        # depts = []
-        # depts_geom = None
-        check_fields = True
-        shp_path = thesaurus_cfg['shp']
-
-        if self.verbose:
-            click.echo(u"  Read shapefile {}".format(shp_path))
-
-        with fiona.open(shp_path, 'r') as shp:
-            # func to reproject geom
-            project = partial(
-                pyproj.transform,
-                pyproj.Proj(shp.crs),
-                pyproj.Proj(init='EPSG:4326'))
-
-            for feat in shp:
-                f_props = feat['properties']
-                f_geom = shape(feat['geometry'])
-                f_geom_wgs84 = transform(project, f_geom)
-                lon_min, lat_min, lon_max, lat_max = f_geom_wgs84.bounds
-
-                # On first item only, check ADE fields
-                fields = thesaurus_cfg['fields']
-                if check_fields:
-                    for f in fields:
-                        if not fields[f] in f_props:
-                            click.echo(u"  Fatal error: field {} not found in shapefile.".format(fields[f]))
-                            return
-                    check_fields = False
-
-                name = f_props[fields['name']].strip().replace("&", "&amp;")
-                code = f_props[fields['code']].strip()
-                uri = None
-                if uri_template:
-                    uri = uri_template.format(code)
-
-                terr = Bunch(name=name,
-                             lon_min=lon_min, lat_min=lat_min, lon_max=lon_max, lat_max=lat_max,
-                             code=code,
-                             uri=uri)
-
-                # if filter_geom and filter_dept:
-                terr_list.append(terr)
-
-            terr_list.sort(key=lambda t: t.code)
-
-        # data passed to the template
-        data = {
-            "title": thesaurus_cfg["title"],
-            "uri_scheme": uri_scheme,
-            "date": datetime.date.today().isoformat(),
-            "terr_list": terr_list,
-            "thesaurus": thesaurus_name
+            # Build plan: a shapefile read by several thesauri is loaded only once
+            self.layer_cache.plan({t: self.get_layer_paths(t) for t in self.thesauri_list})
+
+            for thesaurus_name in self.thesauri_list:
+                try:
+                    self.create_thesaurus(thesaurus_name)
+                finally:
+                    self.layer_cache.release(self.get_layer_paths(thesaurus_name))
+
+        profile_path = self.profiler.write()
+        if profile_path is not None:
+            click.echo(u"Profile report written to {}".format(profile_path))
+
+    def get_thesaurus_cfg(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                its section of the thesauri of the config, None if unknown
+        """
+        return self.cfg["thesauri"].get(thesaurus_name)
+
+    def get_layer_path(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the source of its layer: the path of its file (shp key of the config), followed by the
+                                name of the layer (layer key) for a file having several layers (see get_layer_source)
+        """
+        thesaurus_cfg = self.cfg["thesauri"][thesaurus_name]
+        return get_layer_source(thesaurus_cfg['shp'], thesaurus_cfg.get('layer'))
+
+    def get_layer_paths(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the paths of the shapefiles read to create the thesaurus
+        """
+        thesaurus_cfg = self.cfg["thesauri"].get(thesaurus_name)
+        if not thesaurus_cfg:
+            return []
+        paths = [self.get_layer_path(thesaurus_name)]
+        # The layers of the spatial joins giving the broader and narrower concepts
+        for child_name, parent_name, method in self.get_joins(thesaurus_name):
+            other_name = parent_name if child_name == thesaurus_name else child_name
+            paths.append(self.get_layer_path(other_name))
+        return paths
+
+    def read_parents(self, thesaurus_name):
+        """
+        Read the parents section of a thesaurus, displaying its invalid entries.
+
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the list of the (parent thesaurus, join method) tuples of its valid entries
+        """
+        parents = []
+        for parent_cfg in self.cfg["thesauri"][thesaurus_name].get('parents') or []:
+            if not isinstance(parent_cfg, dict):
+                parent_cfg = {'thesaurus': parent_cfg}
+            parent_name = parent_cfg.get('thesaurus')
+            method = parent_cfg.get('method', REPRESENTATIVE_POINT)
+            if parent_name not in self.cfg["thesauri"] or parent_name == thesaurus_name:
+                click.echo(u"  Unknown parent thesaurus {} of {}. Ignored.".format(parent_name, thesaurus_name))
+            elif method not in JOIN_METHODS:
+                click.echo(u"  Unknown join method {} of the parent {} of {}. Ignored.".format(
+                    method, parent_name, thesaurus_name))
+            else:
+                parents.append((parent_name, method))
+        return parents
+
+    def get_parents(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the list of the (parent thesaurus, join method) tuples of its parents section
+        """
+        return self.parents.get(thesaurus_name, [])
+
+    def get_joins(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the list of the (child thesaurus, parent thesaurus, method) tuples of the spatial
+                                joins giving its broader concepts (as a child) and its narrower concepts (as a parent)
+        """
+        if thesaurus_name not in self.cfg["thesauri"]:
+            return []
+        joins = [(thesaurus_name, parent_name, method) for parent_name, method in self.get_parents(thesaurus_name)]
+        for child_name in sorted(self.parents):
+            if child_name != thesaurus_name:
+                joins.extend((child_name, parent_name, method) for parent_name, method in self.parents[child_name]
+                             if parent_name == thesaurus_name)
+        return joins
+
+    def read_join_features(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the (Layer, list of the (code, geometry) tuples of its features) tuple
+        """
+        thesaurus_cfg = self.cfg["thesauri"][thesaurus_name]
+        code_field = thesaurus_cfg['fields']['code']
+        layer = self.layer_cache.get_layer(self.get_layer_path(thesaurus_name))
+        if self.columnar:
+            columns = read_layer_columns(layer, [code_field])
+            return layer, list(zip(clean_strings(columns[code_field]).tolist(), columns.geoms))
+        features = [(f_props[code_field].strip(), f_geom) for f_props, f_geom in layer.slice(fields=[code_field])]
+        return layer, features
+
+    def get_join(self, child_name, parent_name, method):
+        """
+        Join the features of a thesaurus to those of its parent thesaurus, the result being cached in memory for the
+        build and in the cache directory.
+
+        :param child_name:  the name of the child thesaurus
+        :param parent_name: the name of the parent thesaurus
+        :param method:      one of JOIN_METHODS
+        :return:            the parent codes by child code
+        """
+        key = (child_name, parent_name, method)
+        if key in self.joins:
+            return self.joins[key]
+
+        child_cfg = self.cfg["thesauri"][child_name]
+        parent_cfg = self.cfg["thesauri"][parent_name]
+        settings = [child_cfg['fields']['code'], parent_cfg['fields']['code'], method]
+        links = None
+        if self.join_cache is not None:
+            links = self.join_cache.load(self.get_layer_path(child_name), self.get_layer_path(parent_name),
+                                          settings)
+            if links is not None and self.verbose:
+                click.echo(u"  Read cached spatial join {} -> {}".format(child_name, parent_name))
+
+        if links is None:
+            child_layer, children = self.read_join_features(child_name)
+            parent_layer, parents = self.read_join_features(parent_name)
+            if parent_layer.crs_wkt != child_layer.crs_wkt:
+                # The parents are reprojected to the CRS of the children
+                transformer = get_transformer(parent_layer.crs_wkt, parent_layer.crs)
+                parents = [(code, reproject_from_wgs84(shapely_ops.transform(transformer, geom),
+                                                       child_layer.crs_wkt, child_layer.crs))
+                           for code, geom in parents]
+            spatial_join = SpatialJoin(parents, method)
+            links = spatial_join.join(children)
+            if self.verbose:
+                click.echo(u"  Spatial join {} -> {} ({}): {} feature(s) joined, {} without parent".format(
+                    child_name, parent_name, method, spatial_join.stats["joined"], spatial_join.stats["orphans"]))
+            if self.join_cache is not None:
+                self.join_cache.save(self.get_layer_path(child_name), self.get_layer_path(parent_name), settings,
+                                     links)
+
+        self.joins[key] = links
+        return links
+
+    def get_links(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the (broader, narrower) tuple of the lists of the URIs of the broader and narrower
+                                concepts by code, given by the parents sections
+        """
+        broader = {}
+        narrower = {}
+        for child_name, parent_name, method in self.get_joins(thesaurus_name):
+            links = self.get_join(child_name, parent_name, method)
+            if child_name == thesaurus_name:
+                uri_template = u"{}#{}".format(self.cfg["thesauri"][parent_name].get('uri_scheme'), u"{}")
+                for code, parent_code in links.items():
+                    broader.setdefault(code, []).append(uri_template.format(parent_code))
+            else:
+                uri_template = u"{}#{}".format(self.cfg["thesauri"][child_name].get('uri_scheme'), u"{}")
+                for code, parent_code in sorted(links.items()):
+                    narrower.setdefault(parent_code, []).append(uri_template.format(code))
+        return broader, narrower
+
+    def get_build_inputs(self, thesaurus_name):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :return:                the (input files, settings) tuple recorded in the build manifest
+        """
+        thesaurus_cfg = self.cfg["thesauri"][thesaurus_name]
+        input_files, layers = get_layers_inputs(self.get_layer_paths(thesaurus_name))
+
+        settings = {
+            "config": thesaurus_cfg,
+            "template": template_digest(self.templates_dir_path, thesaurus_cfg['template']),
+            "reprojection": [self.reprojection, self.bbox_tolerance],
+            "compact": self.compact,
         }
+        joins = self.get_joins(thesaurus_name)
+        if joins:
+            settings["joins"] = [[child_name, parent_name, method, self.cfg["thesauri"][child_name]['fields']['code'],
+                                  self.cfg["thesauri"][parent_name]['fields']['code'],
+                                  self.cfg["thesauri"][child_name].get('uri_scheme'),
+                                  self.cfg["thesauri"][parent_name].get('uri_scheme')]
+                                 for child_name, parent_name, method in joins]
+        if layers:
+            settings["layers"] = layers
+        return input_files, settings
+
+    def create_territory_getter(self, thesaurus_name, filters, partition=False):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :param filters:         not used, the features are not filtered
+        :param partition:       not used
+        :return:                a function taking the properties of a feature and returning the (code, name,
+                                attributes) tuple of its territory, linked to its URI
+        """
+        thesaurus_cfg = self.cfg["thesauri"][thesaurus_name]
+        fields = thesaurus_cfg['fields']
 
-        # Finally, process the template to produce our final text.
-        rdf_content = template.render(data)
-        rdf_content = prettify_xml(rdf_content, minify=self.compact)
-
-        if self.verbose:
-            click.echo(u"  Write output file {}".format(rdf_file_path))
-
-        with codecs.open(rdf_file_path, "w", "utf-8") as f:
-            f.write(rdf_content)
+        # URI template
+        uri_template = u"{}#{}".format(thesaurus_cfg.get('uri_scheme'), u"{}")
+
+        def get_territory(f_props, f_geom=None):
+            name = f_props[fields['name']].strip().replace("&", "&amp;")
+            code = f_props[fields['code']].strip()
+            return code, name, {'uri': uri_template.format(code)}
+        return get_territory
+
+    def append_territory_columns(self, thesaurus_name, columns, filters, terr_list, partition=False):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :param columns:         the LayerColumns of the features having a bbox
+        :param filters:         not used, the features are not filtered
+        :param terr_list:       the list the territories are appended to
+        :param partition:       not used
+        """
+        thesaurus_cfg = self.cfg["thesauri"][thesaurus_name]
+        fields = thesaurus_cfg['fields']
+        uri_template = u"{}#{}".format(thesaurus_cfg.get('uri_scheme'), u"{}")
+
+        with self.profiler.stage(thesaurus_name, 'records'):
+            names = clean_strings(columns[fields['name']], escape=True).tolist()
+            codes = clean_strings(columns[fields['code']]).tolist()
+            terr_list.append_columns(codes, names, columns.bounds.tolist(),
+                                     uri=[uri_template.format(code) for code in codes])
+
+    def get_template_data(self, thesaurus_name, thesaurus_cfg, terr_list):
+        """
+        :param thesaurus_name:  the name of the thesaurus
+        :param thesaurus_cfg:   its configuration section
+        :param terr_list:       the territories sorted by code
+        :return:                the data passed to the template, with the broader and narrower concepts of the
+                                parents sections by code
+        """
+        with self.profiler.stage(thesaurus_name, 'join'):
+            broader, narrower = self.get_links(thesaurus_name)
+
+        data = super(ShpThesauriBuilder, self).get_template_data(thesaurus_name, thesaurus_cfg, terr_list)
+        data.update({
+            "uri_scheme": thesaurus_cfg.get('uri_scheme'),
+            "broader": broader,
+            "narrower": narrower
+        })
+        return data
 
 if __name__ == '__main__':
     create_thesauri()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import json
+import os
+import os.path
+import tempfile
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from output import COMPRESSION_EXTENSIONS
+from output import open_input
+from output import open_output
+from utils import replace_file
+
+
+RDF_NS = u"http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDF_ABOUT = u"{{{}}}about".format(RDF_NS)
+RDF_RESOURCE = u"{{{}}}resource".format(RDF_NS)
+
+# Properties changing at each build, not compared
+IGNORED_PROPERTIES = ("dcterms:issued", "dcterms:modified")
+
+CHANGESET_EXTENSION = ".changeset.json"
+
+
+def get_changeset_path(path):
+    """
+    :param path:    the path of a thesaurus file, e.g. out/CommunesFR.rdf.gz
+    :return:        the path of its changeset, e.g. out/CommunesFR.changeset.json
+    """
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+    return os.path.splitext(path)[0] + CHANGESET_EXTENSION
+
+
+def parse_resource(elem, prefixes):
+    """
+    :param elem:        the element of a resource of the document (skos:Concept, skos:ConceptScheme...)
+    :param prefixes:    the prefixes by namespace URI declared by the document
+    :return:            the description of the resource: its label, WGS84 bounding box, links to other resources
+                        ((property, URI) list, sorted) and other properties ((property, value) list, sorted)
+    """
+    def qname(tag):
+        namespace, separator, name = tag[1:].rpartition(u"}")
+        prefix = prefixes.get(namespace)
+        return u"{}:{}".format(prefix, name) if prefix else tag
+
+    resource = {"label": None, "bbox": None, "links": [], "properties": []}
+    corners = {}
+    for child in elem.iter():
+        # Only the leaves carry the values
+        if child is elem or len(child):
+            continue
+        tag = qname(child.tag)
+        value = (child.text or u"").strip()
+        if child.get(RDF_RESOURCE) is not None:
+            resource["links"].append([tag, child.get(RDF_RESOURCE)])
+        elif tag in IGNORED_PROPERTIES:
+            continue
+        elif tag == u"skos:prefLabel":
+            resource["label"] = value
+        elif tag in (u"gml:lowerCorner", u"gml:upperCorner"):
+            corners[tag] = [float(v) for v in value.split()]
+        else:
+            resource["properties"].append([tag, value])
+    if len(corners) == 2:
+        resource["bbox"] = corners[u"gml:lowerCorner"] + corners[u"gml:upperCorner"]
+    resource["links"].sort()
+    resource["properties"].sort()
+    return resource
+
+
+def iter_resources(input_file):
+    """
+    Stream-parse a RDF/XML thesaurus with iterparse, the elements being released once parsed, so that the memory does
+    not depend on the size of the file.
+
+    :param input_file:  the binary file object of the thesaurus
+    :return:            a generator of the (URI, description) tuples of the resources of the document (see
+                        parse_resource), in the order of the file
+    """
+    prefixes = {}
+    root = None
+    depth = 0
+    for event, elem in ElementTree.iterparse(input_file, events=("start", "end", "start-ns")):
+        if event == "start-ns":
+            prefix, namespace = elem
+            prefixes.setdefault(namespace, prefix)
+        elif event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                uri = elem.get(RDF_ABOUT)
+                if uri is not None:
+                    yield uri, parse_resource(elem, prefixes)
+                root.clear()
+
+
+def read_resources(path, compression=None):
+    """
+    :param path:            the path of a RDF/XML thesaurus
+    :param compression:     one of COMPRESSIONS, None for no compression
+    :return:                the descriptions of its resources by URI
+    """
+    with open_input(path, compression) as f:
+        return dict(iter_resources(f))
+
+
+def get_modification(uri, previous, resource):
+    """
+    :param uri:         the URI of a resource
+    :param previous:    its previous description
+    :param resource:    its new description
+    :return:            the changes of the resource: the previous and new label or bbox, the links and properties added
+                        and removed
+    """
+    modification = {"uri": uri}
+    for key, value in resource.items():
+        if previous[key] == value:
+            continue
+        if key in ("links", "properties"):
+            previous_items = set(tuple(item) for item in previous[key])
+            items = set(tuple(item) for item in value)
+            modification[key] = {
+                "added": [item for item in value if tuple(item) not in previous_items],
+                "removed": [item for item in previous[key] if tuple(item) not in items],
+            }
+        else:
+            modification[key] = [previous[key], value]
+    return modification
+
+
+class Changeset(object):
+    """
+    Differences between the previous and the new version of a thesaurus: the resources (concepts, concept scheme)
+    added, removed and modified, identified by their URI.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self.previous_count = 0
+        self.count = 0
+        self.previous_error = None
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.modified)
+
+    def compare(self, previous, resources):
+        """
+        :param previous:    the descriptions of the resources of the previous version by URI, emptied by the
+                            comparison
+        :param resources:   an iterable of the (URI, description) tuples of the resources of the new version
+        """
+        self.previous_count = len(previous)
+        for uri, resource in resources:
+            self.count += 1
+            previous_resource = previous.pop(uri, None)
+            if previous_resource is None:
+                added = {"uri": uri}
+                added.update((key, value) for key, value in resource.items() if value)
+                self.added.append(added)
+            elif previous_resource != resource:
+                self.modified.append(get_modification(uri, previous_resource, resource))
+        self.removed = sorted(previous)
+        previous.clear()
+
+    def report(self):
+        """
+        :return:    a summary of the changes
+        """
+        return u"{} added, {} removed, {} modified, {} unchanged".format(
+            len(self.added), len(self.removed), len(self.modified),
+            self.count - len(self.added) - len(self.modified))
+
+    def to_json(self, name, path, updated):
+        """
+        :param name:        the name of the thesaurus
+        :param path:        the path of the thesaurus file
+        :param updated:     True if the file was written
+        :return:            the JSON serializable changeset
+        """
+        return {
+            "thesaurus": name,
+            "output": path,
+            "updated": updated,
+            "previous_count": self.previous_count,
+            "previous_error": None if self.previous_error is None else u"{}".format(self.previous_error),
+            "count": self.count,
+            "added": self.added,
+            "removed": self.removed,
+            "modified": self.modified,
+        }
+
+
+class DeltaOutput(object):
+    """
+    Output of a thesaurus in delta mode. The new version is written to a temporary file, then compared to the previous
+    version of the file, which is only replaced if a resource changed (the build dates of the concept scheme are not
+    compared). The changes are written to the changeset file of the thesaurus (see get_changeset_path), even when
+    there is none, so that the downstream imports only handle the resources changed.
+
+    Both versions are read with iterparse: only the resources of the previous version are kept in memory, in a compact
+    description, the new version being compared as it is parsed.
+    """
+
+    def __init__(self, name, path, compression=None):
+        """
+        :param name:            the name of the thesaurus
+        :param path:            the path of the thesaurus file
+        :param compression:     one of COMPRESSIONS, None for no compression
+        """
+        self.name = name
+        self.path = path
+        self.compression = compression
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path),
+                                             suffix=".tmp")
+        os.close(fd)
+
+    def write(self, write):
+        """
+        :param write:   function writing the new version to the text file object given
+        """
+        with open_output(self.tmp_path, self.compression) as f:
+            write(f)
+
+    def apply(self, replace=False):
+        """
+        Compare the new version to the previous one, replace the file if they differ and write the changeset.
+
+        :param replace: True to replace the file even if no resource changed, e.g. when it was written with other
+                        settings (compact, template...) which change the file but not its resources
+        :return:    the (Changeset, True if the file was replaced) tuple
+        """
+        changeset = Changeset()
+        previous = {}
+        if os.path.isfile(self.path):
+            try:
+                previous = read_resources(self.path, self.compression)
+            except Exception as e:
+                # Not a thesaurus written with these settings: all the resources are considered as added
+                changeset.previous_error = e
+        with open_input(self.tmp_path, self.compression) as f:
+            changeset.compare(previous, iter_resources(f))
+
+        updated = replace or not changeset.is_empty() or changeset.previous_error is not None or \
+            not os.path.isfile(self.path)
+        if updated:
+            replace_file(self.tmp_path, self.path)
+
+        with open(get_changeset_path(self.path), 'w') as f:
+            f.write(json.dumps(changeset.to_json(self.name, self.path, updated), indent=2, sort_keys=True))
+        return changeset, updated
+
+    def close(self):
+        """
+        Remove the temporary file if it was not renamed.
+        """
+        if os.path.isfile(self.tmp_path):
+            os.remove(self.tmp_path)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import hashlib
+import os
+import os.path
+import tempfile
+
+from build_manifest import file_digest
+from build_manifest import get_shapefile_paths
+from spatial_filter import INTERIORS_INTERSECT
+from spatial_filter import SpatialPredicate
+from utils import LazyModule
+from utils import get_geometry_from_file
+from utils import get_layer_label
+from utils import split_layer_source
+
+# Non standard imports (see requirements.txt), imported on first use
+wkb = LazyModule('shapely.wkb')
+
+
+# Segments per quarter circle of the buffers of the approximations, the buffers being inscribed in the exact ones
+APPROXIMATION_QUAD_SEGS = 2
+
+
+def get_outer_approximation(geom, tolerance):
+    """
+    :param geom:        the geometry
+    :param tolerance:   the tolerance of the simplification, in the units of the CRS of the geometry
+    :return:            a simplified geometry containing geom, its boundary being away from geom
+    """
+    return geom.buffer(2 * tolerance, APPROXIMATION_QUAD_SEGS).simplify(tolerance)
+
+
+def get_inner_approximation(geom, tolerance):
+    """
+    :param geom:        the geometry
+    :param tolerance:   the tolerance of the simplification, in the units of the CRS of the geometry
+    :return:            a simplified geometry contained in the interior of geom, empty if geom is too thin
+    """
+    return geom.buffer(-2 * tolerance, APPROXIMATION_QUAD_SEGS).simplify(tolerance)
+
+
+class FilterGeometry(object):
+    """
+    The geometry of a spatial filter, with its optional simplified approximations.
+    """
+
+    def __init__(self, geom, outer=None, inner=None):
+        """
+        :param geom:    the exact geometry
+        :param outer:   a simplified geometry containing it, None if not computed
+        :param inner:   a simplified geometry contained in its interior, None if not computed or empty
+        """
+        self.geom = geom
+        self.outer = outer
+        self.inner = inner
+
+    def create_predicate(self, predicate=INTERIORS_INTERSECT):
+        """
+        :param predicate:   INTERIORS_INTERSECT or INTERIORS_OVERLAP
+        :return:            the SpatialPredicate of the geometry, testing the approximations first
+        """
+        return SpatialPredicate(self.geom, predicate, outer=self.outer, inner=self.inner)
+
+
+class FilterGeometryCache(object):
+    """
+    On-disk cache of the geometries of the spatial filter shapefiles, so that their features are only read and
+    unioned again when they change.
+
+    The union and its approximations are saved as WKB files. Their key is the SHA-1 of the content of the files of the
+    shapefile, the approximations being also keyed by their tolerance.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_entry_path(self, path):
+        """
+        :param path:    the path of the filter shapefile, or the source of a layer of another file
+        :return:        the path of its cache entry, without extension
+        """
+        sha1 = hashlib.sha1()
+        for p in get_shapefile_paths(path):
+            sha1.update(u"{} {}\n".format(os.path.basename(p), file_digest(p)).encode("utf-8"))
+        layer_name = split_layer_source(path)[1]
+        if layer_name:
+            sha1.update(u"layer {}\n".format(layer_name).encode("utf-8"))
+        return os.path.join(self.cache_dir, u"{}-{}".format(get_layer_label(path), sha1.hexdigest()[:16]))
+
+    def read(self, path):
+        """
+        :param path:    the path of a WKB file of the cache
+        :return:        the geometry, None if not cached
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return wkb.loads(f.read())
+
+    def write(self, path, geom):
+        """
+        :param path:    the path of a WKB file of the cache
+        :param geom:    the geometry saved
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Written in a temporary file renamed at the end, so that a file is always complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(wkb.dumps(geom))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, path, compute, *args):
+        """
+        :param path:    the path of a WKB file of the cache
+        :param compute: the function computing the geometry if not cached
+        :param args:    its arguments
+        :return:        the geometry
+        """
+        geom = self.read(path)
+        if geom is None:
+            geom = compute(*args)
+            self.write(path, geom)
+        return geom
+
+
+def load_filter_geometry(path, cache_dir=None, tolerance=None):
+    """
+    Get the union of the geometries of a filter shapefile, and its simplified approximations if a tolerance is given.
+
+    :param path:        the path of the filter shapefile
+    :param cache_dir:   the directory caching the geometries, None for no cache
+    :param tolerance:   the tolerance of the approximations in the units of the CRS of the shapefile, None or 0 for
+                        no approximation
+    :return:            the FilterGeometry
+    """
+    if cache_dir is None:
+        geom = get_geometry_from_file(path)
+        if not tolerance or geom.is_empty:
+            return FilterGeometry(geom)
+        outer = get_outer_approximation(geom, tolerance)
+        inner = get_inner_approximation(geom, tolerance)
+    else:
+        cache = FilterGeometryCache(cache_dir)
+        entry_path = cache.get_entry_path(path)
+        geom = cache.get(entry_path + u".wkb", get_geometry_from_file, path)
+        if not tolerance or geom.is_empty:
+            return FilterGeometry(geom)
+        approximations_path = u"{}-{!r}".format(entry_path, float(tolerance))
+        outer = cache.get(approximations_path + u".outer.wkb", get_outer_approximation, geom, tolerance)
+        inner = cache.get(approximations_path + u".inner.wkb", get_inner_approximation, geom, tolerance)
+    return FilterGeometry(geom, outer, inner if not inner.is_empty else None)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+
+class HierarchyIndex(object):
+    """
+    Hash indexes of the administrative hierarchy, built once per build from the departements layer and, for the
+    narrower links of the departements, from the attributes of the communes layer:
+    - departement number or lower-cased name -> departement
+    - region code -> numbers of its departements, in the order of the layer
+    - departement number -> codes of its communes, sorted as the concepts of the thesauri
+    """
+
+    def __init__(self, depts):
+        """
+        :param depts:   the departements, as dicts with their dept_name, dept_code and reg_code
+        """
+        self.depts = {}
+        self.region_depts = {}
+        for dept in depts:
+            # The geometries are not kept once the layer is released
+            dept = dict((key, dept[key]) for key in ('dept_name', 'dept_code', 'reg_code'))
+            self.depts[dept['dept_code']] = dept
+            self.depts[dept['dept_name'].lower()] = dept
+            self.region_depts.setdefault(dept['reg_code'], []).append(dept['dept_code'])
+        self.dept_communes = None
+
+    def add_communes(self, communes):
+        """
+        :param communes:    iterable of the (commune code, departement number) tuples of the communes
+        """
+        self.dept_communes = {}
+        for code, dept_code in communes:
+            self.dept_communes.setdefault(dept_code, []).append(code)
+        for codes in self.dept_communes.values():
+            codes.sort()
+
+    def has_communes(self):
+        return self.dept_communes is not None
+
+    def get_dept(self, key):
+        """
+        :param key:     the number or the lower-cased name of a departement
+        :return:        the departement, None if unknown
+        """
+        return self.depts.get(key)
+
+    def get_region_depts(self, reg_code):
+        """
+        :param reg_code:    the code of a region
+        :return:            the list of the numbers of its departements
+        """
+        return list(self.region_depts.get(reg_code, ()))
+
+    def get_region_dept_keys(self, reg_code):
+        """
+        :param reg_code:    the code of a region
+        :return:            the set of the numbers and lower-cased names of its departements, as the keys of a
+                            departements filter
+        """
+        keys = set()
+        for dept_code in self.region_depts.get(reg_code, ()):
+            keys.add(dept_code)
+            keys.add(self.depts[dept_code]['dept_name'].lower())
+        return keys
+
+    def get_dept_communes(self, dept_code):
+        """
+        :param dept_code:   the number of a departement
+        :return:            the list of the codes of its communes, empty if the communes were not added
+        """
+        if self.dept_communes is None:
+            return []
+        return list(self.dept_communes.get(dept_code, ()))
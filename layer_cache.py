@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+from utils import LazyModule
+from utils import split_layer_source
+
+# Non standard imports (see requirements.txt), imported on first use
+shapely_geometry = LazyModule('shapely.geometry')
+# Fiona should be imported after shapely - see https://github.com/Toblerity/Shapely/issues/288
+fiona = LazyModule('fiona', after=('shapely.geometry',))
+
+
+def shape(geometry):
+    """
+    :param geometry:    a GeoJSON like geometry mapping, as read by fiona
+    :return:            the shapely geometry
+    """
+    return shapely_geometry.shape(geometry)
+
+
+class Layer(object):
+    """
+    Source layer whose features are either loaded in memory or read from the file each time they are iterated.
+    The features are (properties, shapely geometry) tuples.
+
+    The layer is a shapefile or a layer of any file read by fiona, e.g. a GeoPackage or a FlatGeobuf file, whose spatial
+    index is used by the reads filtered by bbox.
+    """
+
+    # Function building the shapely geometries, replaced on an instance to time it
+    shape = staticmethod(shape)
+
+    def __init__(self, path):
+        """
+        :param path:    the source of the layer: the path of the file, followed by |layername=NAME for a layer of a
+                        file having several layers (see utils.get_layer_source)
+        """
+        self.path = path
+        self.file_path, self.layer_name = split_layer_source(path)
+        self.features = None
+        self.reads = 0
+        self.hits = 0
+        with fiona.open(self.file_path, 'r', layer=self.layer_name) as shp:
+            self.crs_wkt = shp.crs_wkt
+            self.crs = shp.crs
+            self.size = len(shp)
+            self.fields = list(shp.schema['properties'])
+
+    def get_open_options(self, fields=None):
+        """
+        :param fields:  names of the fields to read, all the fields if None
+        :return:        the options of fiona.open reading the layer and only these fields
+        """
+        options = {'layer': self.layer_name}
+        ignore_fields = [field for field in self.fields if fields is not None and field not in fields]
+        if ignore_fields:
+            options['ignore_fields'] = ignore_fields
+        return options
+
+    def read(self, start=None, stop=None, bbox=None, fields=None, accept=None):
+        """
+        Read features from the file, the filters being pushed down to the reader.
+
+        :param start:   index of the first feature, the first feature of the layer if None
+        :param stop:    index of the feature to stop at, the end of the layer if None
+        :param bbox:    (min x, min y, max x, max y) tuple in the CRS of the layer: only the features whose envelope
+                        intersects it are read, through the spatial index of the file if it has one (GeoPackage,
+                        FlatGeobuf, shapefile with a .qix). Not used with start or stop, which would then count the
+                        features of the bbox only.
+        :param fields:  names of the fields to read, all the fields if None
+        :param accept:  function testing the properties of a feature. The attributes are read first and the geometries
+                        are only read and built for the features accepted.
+        :return:        an iterator over the features
+        """
+        self.reads += 1
+        options = self.get_open_options(fields)
+        with fiona.open(self.file_path, 'r', **options) as shp:
+            if accept is not None:
+                with fiona.open(self.file_path, 'r', ignore_geometry=True, **options) as attributes:
+                    fids = [int(feat['id']) for feat in attributes.filter(start or 0, stop)
+                            if accept(feat['properties'])]
+                features = (shp[fid] for fid in fids)
+            elif start is not None or stop is not None:
+                features = shp.filter(start or 0, stop)
+            elif bbox is not None:
+                features = shp.filter(bbox=bbox)
+            else:
+                features = shp
+            for feat in features:
+                yield feat['properties'], self.shape(feat['geometry'])
+
+    def read_properties(self, fields=None):
+        """
+        :param fields:  names of the fields to read, all the fields if None
+        :return:        an iterator over the properties of the features, without reading their geometries unless
+                        the layer is loaded in memory
+        """
+        if self.features is not None:
+            self.hits += 1
+            return (props for props, geom in self.features)
+        return self._read_properties(fields)
+
+    def _read_properties(self, fields):
+        self.reads += 1
+        options = self.get_open_options(fields)
+        with fiona.open(self.file_path, 'r', ignore_geometry=True, **options) as shp:
+            for feat in shp:
+                yield feat['properties']
+
+    def load(self):
+        if self.features is None:
+            self.features = list(self.read())
+        return self.features
+
+    def slice(self, start=None, stop=None, **pushdown):
+        """
+        :param start:       index of the first feature, the first feature of the layer if None
+        :param stop:        index of the feature to stop at, the end of the layer if None
+        :param pushdown:    the bbox, fields and accept filters of read, only used when the features are read from the
+                            file: all the features of the range are returned when they are loaded in memory
+        :return:            an iterator over the features of the range
+        """
+        if self.features is None:
+            return self.read(start, stop, **pushdown)
+        self.hits += 1
+        return iter(self.features[start:stop])
+
+    def __iter__(self):
+        return self.slice()
+
+    def __len__(self):
+        return self.size
+
+
+class LayerCache(object):
+    """
+    Source layers shared by the thesauri of one build, with the values derived from them (departements list, union
+    of geometries...).
+
+    The build plan gives, for each thesaurus, the paths of the layers it reads. A layer is loaded in memory when a
+    thesaurus still to be built needs it after the current one, otherwise its features are read from the file as they
+    are iterated. When release_layers is True, a layer and its derived values are dropped as soon as no remaining
+    thesaurus needs them.
+    """
+
+    def __init__(self, release_layers=True):
+        self.release_layers = release_layers
+        self.layers = {}
+        self.derived = {}
+        self.uses = {}
+        self.stats = {}
+
+    def plan(self, layers_by_thesaurus):
+        """
+        :param layers_by_thesaurus:     dict giving the list of the layer paths read by each thesaurus to build
+        """
+        for paths in layers_by_thesaurus.values():
+            for path in set(paths):
+                self.uses[path] = self.uses.get(path, 0) + 1
+
+    def is_loaded(self, path):
+        return path in self.layers and self.layers[path].features is not None
+
+    def get_layer(self, path):
+        """
+        :param path:    the path of the layer
+        :return:        the Layer, loaded in memory if needed by another thesaurus of the plan
+        """
+        layer = self.layers.get(path)
+        if layer is None:
+            layer = Layer(path)
+            self.layers[path] = layer
+            self.stats.setdefault(path, {"reads": 0, "hits": 0, "derived": 0})
+        if not self.release_layers or self.uses.get(path, 0) > 1:
+            layer.load()
+        return layer
+
+    def get_derived(self, path, key, func):
+        """
+        Get a value derived from a layer, computing it only once.
+
+        :param path:    the path of the layer the value is derived from
+        :param key:     the key of the value for this layer
+        :param func:    function computing the value from the Layer
+        :return:        the value
+        """
+        if (path, key) not in self.derived:
+            layer = self.get_layer(path)
+            self.derived[(path, key)] = func(layer)
+            self.stats[path]["derived"] += 1
+        return self.derived[(path, key)]
+
+    def release(self, paths):
+        """
+        Declare that a thesaurus of the plan is built.
+
+        :param paths:   the paths of the layers read by the thesaurus
+        """
+        for path in set(paths):
+            self.uses[path] = self.uses.get(path, 0) - 1
+            if self.uses[path] <= 0 and self.release_layers:
+                self._drop(path)
+
+    def _drop(self, path):
+        layer = self.layers.pop(path, None)
+        if layer is not None:
+            self.stats[path]["reads"] += layer.reads
+            self.stats[path]["hits"] += layer.hits
+        for key in [key for key in self.derived if key[0] == path]:
+            del self.derived[key]
+
+    def report(self):
+        """
+        :return:    the list of the (path, file reads, reads from memory, derived values computed) tuples
+        """
+        report = []
+        for path in sorted(self.stats):
+            stats = dict(self.stats[path])
+            layer = self.layers.get(path)
+            if layer is not None:
+                stats["reads"] += layer.reads
+                stats["hits"] += layer.hits
+            report.append((path, stats["reads"], stats["hits"], stats["derived"]))
+        return report
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import importlib
+
+from utils import LazyModule
+
+# Non standard imports (see requirements.txt), imported on first use
+numpy = LazyModule('numpy')
+shapely = LazyModule('shapely')
+# Optional (see README.md): reads the layers in bulk, without building a Python dict per feature
+pyogrio_raw = LazyModule('pyogrio.raw')
+
+
+def check_columnar():
+    """
+    :raise ValueError:  if the columnar read is not available
+    """
+    if not hasattr(importlib.import_module('shapely'), 'from_wkb'):
+        raise ValueError(u"the columnar read requires shapely >= 2.0")
+
+
+def has_pyogrio():
+    """
+    :return:    True if pyogrio is installed
+    """
+    try:
+        importlib.import_module('pyogrio')
+    except ImportError:
+        return False
+    return True
+
+
+def to_object_array(values):
+    """
+    :param values:  a list of values, e.g. geometries
+    :return:        a 1 dimension numpy array of objects, numpy not unpacking the values
+    """
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def clean_strings(values, escape=False):
+    """
+    Strip the values of a column and, if escape is True, escape their ampersands, as a whole.
+
+    :param values:  a numpy array of strings, None for a missing value
+    :param escape:  True to escape the ampersands for the XML of the templates
+    :return:        a numpy array of str
+    """
+    values = numpy.asarray(values)
+    if values.dtype == object:
+        values = numpy.where(numpy.equal(values, None), u"", values).astype(str)
+    values = numpy.char.strip(values.astype(str))
+    if escape:
+        values = numpy.char.replace(values, u"&", u"&amp;")
+    return values
+
+
+class LayerColumns(object):
+    """
+    Features of a layer stored in columns: the values of the fields in numpy arrays, keyed by field name as the
+    properties of the features read with fiona, the shapely geometries in a numpy array (None when only the attributes
+    and bounds are known, e.g. read from the BboxCache), and the WGS84 bounding boxes in a (n, 4) array once computed.
+    """
+
+    def __init__(self, columns, geoms=None, bounds=None, size=None):
+        """
+        :param columns: the arrays of the values by field name
+        :param geoms:   the array of the geometries, None if not read
+        :param bounds:  the (n, 4) array of the (lon_min, lat_min, lon_max, lat_max) of the features, None if not
+                        computed
+        :param size:    the number of features, given when there is no column
+        """
+        self.columns = columns
+        self.geoms = geoms
+        self.bounds = bounds
+        if size is None:
+            size = len(next(iter(columns.values()))) if columns else len(geoms) if geoms is not None else 0
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def select(self, mask):
+        """
+        :param mask:    a boolean array, or an array of the positions of the features selected
+        :return:        the LayerColumns of the features selected
+        """
+        positions = numpy.flatnonzero(mask) if numpy.asarray(mask).dtype == bool else numpy.asarray(mask)
+        return LayerColumns(dict((field, values[positions]) for field, values in self.columns.items()),
+                            self.geoms[positions] if self.geoms is not None else None,
+                            self.bounds[positions] if self.bounds is not None else None,
+                            len(positions))
+
+
+def read_layer_columns(layer, fields, start=None, stop=None, bbox=None):
+    """
+    Read the features of a layer as columns. A layer loaded in memory is converted, otherwise it is read with pyogrio
+    if installed, or with fiona.
+
+    :param layer:   the Layer
+    :param fields:  the names of the fields to read
+    :param start:   index of the first feature, the first feature of the layer if None
+    :param stop:    index of the feature to stop at, the end of the layer if None
+    :param bbox:    (min x, min y, max x, max y) tuple in the CRS of the layer: only the features whose envelope
+                    intersects it are read, through the spatial index of the file if it has one. Not used with start
+                    or stop, as by Layer.read.
+    :return:        the LayerColumns, without bounds
+    """
+    if layer.features is None and has_pyogrio():
+        layer.reads += 1
+        options = {}
+        if start is not None or stop is not None:
+            start, stop, step = slice(start, stop).indices(len(layer))
+            if stop <= start:
+                # pyogrio reads every feature for max_features=0
+                return LayerColumns(dict((field, to_object_array([])) for field in fields), to_object_array([]),
+                                    size=0)
+            options = {'skip_features': start, 'max_features': stop - start}
+        elif bbox is not None:
+            options = {'bbox': tuple(bbox)}
+        meta, fids, geometry, field_data = pyogrio_raw.read(layer.file_path, layer=layer.layer_name,
+                                                            columns=list(fields), **options)
+        columns = dict(zip(meta['fields'], field_data))
+        return LayerColumns(dict((field, columns[field]) for field in fields), shapely.from_wkb(geometry),
+                            size=len(geometry))
+
+    features = list(layer.slice(start, stop, bbox=bbox, fields=list(fields)))
+    columns = dict((field, to_object_array([f_props.get(field) for f_props, f_geom in features])) for field in fields)
+    return LayerColumns(columns, to_object_array([f_geom for f_props, f_geom in features]), size=len(features))
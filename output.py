@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import codecs
+import contextlib
+import gzip
+import os.path
+
+# Optional (see README.md)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from rdf_writer import RdfWriter
+from triples_writer import TriplesWriter
+
+
+# rdf: RDF/XML with the formatting of the templates, nt: N-Triples, ttl: Turtle
+OUTPUT_FORMATS = ('rdf', 'nt', 'ttl')
+COMPRESSIONS = ('gzip', 'zstd')
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def check_compression(compression):
+    """
+    :param compression:     one of COMPRESSIONS, None for no compression
+    :raise ValueError:      if the compression is not available
+    """
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError(u"zstd compression requires the zstandard module (pip install zstandard)")
+
+
+def get_output_path(path, output_format='rdf', compression=None):
+    """
+    :param path:            the path of the output file configured, e.g. out/CommunesFR.rdf
+    :param output_format:   one of OUTPUT_FORMATS
+    :param compression:     one of COMPRESSIONS, None for no compression
+    :return:                the path with the extension of the format and of the compression, e.g.
+                            out/CommunesFR.nt.gz
+    """
+    if output_format != 'rdf':
+        path = os.path.splitext(path)[0] + '.' + output_format
+    return path + COMPRESSION_EXTENSIONS.get(compression, '')
+
+
+@contextlib.contextmanager
+def open_output(path, compression=None):
+    """
+    Context manager opening an output file for writing text encoded in UTF-8, compressed as it is written.
+
+    :param path:            the path of the output file
+    :param compression:     one of COMPRESSIONS, None for no compression
+    """
+    if compression is None:
+        with codecs.open(path, "w", "utf-8") as f:
+            yield f
+        return
+
+    check_compression(compression)
+    with open(path, 'wb') as raw:
+        if compression == 'gzip':
+            # No file name nor time in the header, so that the same thesaurus gives the same file
+            compressed = gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0)
+        else:
+            compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+        try:
+            yield codecs.getwriter("utf-8")(compressed)
+        finally:
+            compressed.close()
+
+
+@contextlib.contextmanager
+def open_input(path, compression=None):
+    """
+    Context manager opening an output file written by open_output for reading its bytes, decompressed as they are read.
+
+    :param path:            the path of the file
+    :param compression:     one of COMPRESSIONS, None for no compression
+    """
+    if compression is None:
+        with open(path, 'rb') as f:
+            yield f
+        return
+
+    check_compression(compression)
+    with open(path, 'rb') as raw:
+        if compression == 'gzip':
+            decompressed = gzip.GzipFile(filename='', mode='rb', fileobj=raw)
+        else:
+            decompressed = zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+        try:
+            yield decompressed
+        finally:
+            decompressed.close()
+
+
+def create_writer(template_env, template_name, output_format='rdf', minify=False):
+    """
+    :param template_env:    the Jinja environment
+    :param template_name:   the name of the thesaurus template
+    :param output_format:   one of OUTPUT_FORMATS
+    :param minify:          True for a compact RDF/XML file
+    :return:                the RdfWriter or TriplesWriter of the format
+    """
+    if output_format == 'rdf':
+        return RdfWriter(template_env, template_name, minify=minify)
+    return TriplesWriter(template_env, template_name, syntax=output_format)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import multiprocessing
+import os
+import sys
+
+# Non standard imports (see requirements.txt)
+import click
+
+from layer_cache import Layer
+
+
+# Builder of the current worker process
+_worker_builder = None
+
+
+def _init_worker(builder_class, builder_args):
+    global _worker_builder
+    # The builder messages were already displayed by the main process
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            _worker_builder = builder_class(**dict(builder_args, verbose=False, jobs=1, threads=0, profile=False,
+                                                   cprofile=False, max_memory=None))
+        finally:
+            sys.stdout = stdout
+
+
+def _read_chunk(task):
+    thesaurus, start, stop = task
+    return _worker_builder.read_territories(thesaurus, start, stop)
+
+
+def split_tasks(layer_sizes, chunk_size):
+    """
+    Split the features of the layers of the thesauri in chunks.
+
+    :param layer_sizes:     list of (thesaurus, number of features of its layer) tuples
+    :param chunk_size:      maximal number of features of a chunk
+    :return:                list of (thesaurus, start, stop) tuples
+    """
+    tasks = []
+    for thesaurus, size in layer_sizes:
+        for start in range(0, max(size, 1), chunk_size):
+            tasks.append((thesaurus, start, min(start + chunk_size, size)))
+    return tasks
+
+
+def create_thesauri_in_parallel(builder, thesauri, jobs, chunk_size):
+    """
+    Create thesauri with a pool of worker processes.
+
+    The features of the layer of each thesaurus are split in chunks. The chunks of all the thesauri are read,
+    reprojected and filtered by the workers, each one holding its own builder. The territories of each thesaurus are
+    then merged in the order of the chunks, sorted by code and written by the main process, giving the same file as a
+    serial build. The chunks are merged as they are read, in the lists of territories of the builder, so that their
+    memory is bounded by --max-memory if given.
+
+    :param builder:     the builder, providing builder_args, profiler, get_layer_paths, prepare_thesaurus,
+                        create_territory_list, read_territories and write_thesaurus
+    :param thesauri:    the names of the thesauri to create
+    :param jobs:        the number of worker processes
+    :param chunk_size:  the maximal number of features of a chunk
+    """
+    prepared = {}
+    for thesaurus in thesauri:
+        prepared_thesaurus = builder.prepare_thesaurus(thesaurus)
+        if prepared_thesaurus is not None:
+            prepared[thesaurus] = prepared_thesaurus
+    thesauri = [thesaurus for thesaurus in thesauri if thesaurus in prepared]
+
+    tasks = split_tasks([(thesaurus, len(Layer(builder.get_layer_paths(thesaurus)[0])))
+                         for thesaurus in thesauri], chunk_size)
+    click.echo(u"Reading {} chunks of features with {} processes".format(len(tasks), jobs))
+
+    territories = dict((thesaurus, builder.create_territory_list()) for thesaurus in thesauri)
+    try:
+        with builder.profiler.stage(None, 'parallel_read'):
+            pool = multiprocessing.Pool(jobs, _init_worker, (type(builder), builder.builder_args))
+            try:
+                # The chunks are returned in the order of the tasks
+                for (thesaurus, start, stop), terr_list in zip(tasks, pool.imap(_read_chunk, tasks, 1)):
+                    if territories[thesaurus] is None:
+                        continue
+                    if terr_list is None:
+                        territories[thesaurus].close()
+                        territories[thesaurus] = None
+                    else:
+                        territories[thesaurus].extend(terr_list)
+            finally:
+                pool.close()
+                pool.join()
+
+        for thesaurus in thesauri:
+            if territories[thesaurus] is None:
+                click.echo(u"Thesaurus {} not created.".format(thesaurus))
+                continue
+            with builder.profiler.stage(thesaurus, 'sort'):
+                territories[thesaurus].sort()
+            builder.write_thesaurus(thesaurus, prepared[thesaurus], territories[thesaurus])
+            territories[thesaurus].close()
+    finally:
+        for terr_list in territories.values():
+            if terr_list is not None:
+                terr_list.close()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import sys
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Number of items (chunks of features, blocks of text) of a queue between two stages
+QUEUE_SIZE = 4
+
+# Seconds between two checks of the stop of the pipeline by a thread waiting on a queue
+POLL_INTERVAL = 0.1
+
+# Size of the blocks of text written by the writer thread of a QueuedWriter
+WRITE_BLOCK_SIZE = 1 << 16
+
+
+class PipelineStopped(Exception):
+    """
+    Raised in the threads of a pipeline stopped by its consumer.
+    """
+
+
+class StageQueue(object):
+    """
+    Bounded queue between two stages of a pipeline: a stage putting an item waits while the queue is full, so that a
+    fast stage does not run ahead of a slow one (backpressure) and the memory is bounded by the size of the queue.
+
+    The depth of the queue at each put and the time the stages wait on it are recorded: a queue often full (time
+    waited by the put) shows a slow consumer stage, a queue often empty (time waited by the get) a slow producer stage.
+    """
+
+    def __init__(self, name, maxsize, stop=None):
+        """
+        :param name:    the name of the queue in the report
+        :param maxsize: the maximal number of items in the queue
+        :param stop:    the threading.Event set when the pipeline is stopped, None if it can not be
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize)
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item):
+        """
+        :raise PipelineStopped: if the pipeline is stopped while waiting for a free place
+        """
+        start = _clock()
+        while True:
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                if self.stop is not None and self.stop.is_set():
+                    raise PipelineStopped()
+        if item is None:
+            # The end markers are not counted
+            return
+        waited = _clock() - start
+        depth = self.queue.qsize()
+        with self.lock:
+            self.puts += 1
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+            self.put_wait += waited
+
+    def get(self):
+        """
+        :raise PipelineStopped: if the pipeline is stopped while waiting for an item
+        """
+        start = _clock()
+        while True:
+            try:
+                item = self.queue.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self.stop is not None and self.stop.is_set():
+                    raise PipelineStopped()
+        with self.lock:
+            self.get_wait += _clock() - start
+        return item
+
+    def summary(self):
+        """
+        :return:    a summary of the metrics of the queue
+        """
+        report = self.report()
+        return u"{}: {} items, mean depth {:.1f}/{}, {:.2f}s waited by the producer, {:.2f}s by the consumer".format(
+            self.name, report["items"], report["mean_depth"], self.maxsize, report["put_wait_seconds"],
+            report["get_wait_seconds"])
+
+    def report(self):
+        """
+        :return:    the JSON serializable metrics of the queue
+        """
+        return {
+            "size": self.maxsize,
+            "items": self.puts,
+            "mean_depth": float(self.depth_sum) / self.puts if self.puts else 0.,
+            "max_depth": self.max_depth,
+            "put_wait_seconds": self.put_wait,
+            "get_wait_seconds": self.get_wait,
+        }
+
+
+class _Task(object):
+    """
+    Item of an ordered_map, processed by a worker and awaited by the consumer.
+    """
+    __slots__ = ('item', 'result', 'error', 'done')
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def iter_chunks(iterable, size):
+    """
+    :param iterable:    an iterable
+    :param size:        the maximal number of items of a chunk
+    :return:            a generator of the lists of the successive items of the iterable
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ordered_map(items, create_worker, workers=1, queue_size=QUEUE_SIZE, queues=None):
+    """
+    Pipeline applying a function to items in a pool of worker threads: the items are iterated by a reader thread, e.g.
+    decoding the features of a layer, then processed by the workers while the next ones are read, and the results are
+    yielded to the calling thread in the order of the items.
+
+    The items go through two bounded queues: read (the items waiting for a worker) and collect (the items in process
+    or processed, in order, waiting for the calling thread), so that at most about queue_size items are in memory at
+    once, the reader waiting for the slowest stage. Each worker calls create_worker once to get its own function, so
+    that the objects which must not be shared between threads (GEOS prepared geometries, counters) are not.
+
+    An exception raised by the reader or a worker is raised again in the calling thread. Closing the generator stops
+    the threads.
+
+    :param items:           the iterable of the items, iterated in the reader thread
+    :param create_worker:   function called in each worker thread, returning the function applied to the items
+    :param workers:         the number of worker threads
+    :param queue_size:      the maximal number of items of each queue
+    :param queues:          a list the StageQueue of the pipeline are appended to, for their metrics
+    :return:                a generator of the results
+    """
+    stop = threading.Event()
+    read_queue = StageQueue('read', queue_size, stop)
+    collect_queue = StageQueue('collect', queue_size, stop)
+    if queues is not None:
+        queues.extend((read_queue, collect_queue))
+    reader_errors = []
+
+    def read():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                task = _Task(item)
+                # Queued for the calling thread first, so that the collect queue bounds the items in process
+                collect_queue.put(task)
+                read_queue.put(task)
+        except PipelineStopped:
+            return
+        except Exception:
+            reader_errors.append(sys.exc_info()[1])
+        finally:
+            # Release the file read by a generator stopped before its end
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        try:
+            for i in range(workers):
+                read_queue.put(None)
+            collect_queue.put(None)
+        except PipelineStopped:
+            pass
+
+    def work():
+        func = None
+        try:
+            while True:
+                task = read_queue.get()
+                if task is None:
+                    return
+                try:
+                    if func is None:
+                        func = create_worker()
+                    task.result = func(task.item)
+                except Exception:
+                    task.error = sys.exc_info()[1]
+                # The item is released once processed
+                task.item = None
+                task.done.set()
+        except PipelineStopped:
+            return
+
+    threads = [threading.Thread(target=read, name='pipeline-read')]
+    threads.extend(threading.Thread(target=work, name='pipeline-work-{}'.format(i)) for i in range(workers))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            task = collect_queue.get()
+            if task is None:
+                break
+            while not task.done.wait(POLL_INTERVAL):
+                if not any(thread.is_alive() for thread in threads[1:]):
+                    raise RuntimeError(u"The workers of the pipeline stopped before processing every item")
+            if task.error is not None:
+                raise task.error
+            yield task.result
+        if reader_errors:
+            raise reader_errors[0]
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def chunked_map(items, create_worker, workers=1, chunk_size=2000, queue_size=QUEUE_SIZE, queues=None):
+    """
+    ordered_map over chunks of items, so that the cost of the queues is shared by the items of a chunk.
+
+    :param items:           the iterable of the items, iterated in the reader thread
+    :param create_worker:   function called in each worker thread, returning the function applied to each item
+    :param workers:         the number of worker threads
+    :param chunk_size:      the number of items of a chunk
+    :param queue_size:      the maximal number of chunks of each queue
+    :param queues:          a list the StageQueue of the pipeline are appended to, for their metrics
+    :return:                a generator of the results, in the order of the items
+    """
+    def create_chunk_worker():
+        func = create_worker()
+        return lambda chunk: [func(item) for item in chunk]
+
+    for results in ordered_map(iter_chunks(items, chunk_size), create_chunk_worker, workers, queue_size, queues):
+        for result in results:
+            yield result
+
+
+class QueuedWriter(object):
+    """
+    File object whose text is written to another file object by a writer thread, through a bounded queue of blocks of
+    text, so that the rendering of the thesaurus goes on while the previous blocks are compressed and written.
+    """
+
+    def __init__(self, output_file, queue_size=QUEUE_SIZE, block_size=WRITE_BLOCK_SIZE, queues=None):
+        """
+        :param output_file: the file object the text is written to
+        :param queue_size:  the maximal number of blocks waiting to be written
+        :param block_size:  the number of characters of text gathered in a block
+        :param queues:      a list the StageQueue of the writer is appended to, for its metrics
+        """
+        self.output_file = output_file
+        self.block_size = block_size
+        self.buffer = []
+        self.buffered = 0
+        self.stop = threading.Event()
+        self.queue = StageQueue('write', queue_size, self.stop)
+        if queues is not None:
+            queues.append(self.queue)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_blocks, name='pipeline-write')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write_blocks(self):
+        try:
+            while True:
+                block = self.queue.get()
+                if block is None:
+                    return
+                self.output_file.write(block)
+        except PipelineStopped:
+            return
+        except Exception:
+            self.error = sys.exc_info()[1]
+            # The blocks put afterwards are not written
+            self.stop.set()
+
+    def _put(self, block):
+        try:
+            self.queue.put(block)
+        except PipelineStopped:
+            raise self.error or PipelineStopped()
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.block_size:
+            self._put(u"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        """
+        Write the remaining text and wait for the writer thread.
+
+        :raise:     the exception raised by the writer thread, if any
+        """
+        try:
+            if self.buffer:
+                self._put(u"".join(self.buffer))
+                self.buffer = []
+            self._put(None)
+        finally:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        """
+        Stop the writer thread without writing the remaining text.
+        """
+        self.stop.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
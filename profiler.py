@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import contextlib
+import datetime
+import json
+import os.path
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4
+    tracemalloc = None
+import cProfile
+
+
+PROFILE_FILE_NAME = "thesaurus_profile.json"
+CPROFILE_FILE_NAME = "thesaurus_profile.prof"
+
+# Number of allocation sites kept in the report for each memory snapshot
+TOP_ALLOCATIONS = 10
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def get_peak_rss():
+    """
+    :return:    the peak resident set size of the process in kilobytes, None if unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class BuildProfiler(object):
+    """
+    Time the stages of the creation of each thesaurus, count its features and record the memory used, then write the
+    whole as a JSON report in the output directory.
+
+    When disabled, the functions and iterators are returned unwrapped and the other methods do nothing, so that the
+    builders call the profiler the same way whether --profile is given or not.
+    """
+
+    def __init__(self, output_dir, enabled=False, cprofile=False):
+        """
+        :param output_dir:  the directory the report is written to
+        :param enabled:     True to profile the build
+        :param cprofile:    True to also dump the cProfile statistics of the build
+        """
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.thesauri = {}
+        self.build = {"stages": {}, "counters": {}, "memory": {}}
+        self.started = None
+        self.start_time = None
+        self.cprofile = cProfile.Profile() if enabled and cprofile else None
+        # The stages of the pipeline (see pipeline.py) add their times and counts from their threads
+        self.lock = threading.Lock()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.started = datetime.datetime.now().isoformat()
+        self.start_time = _clock()
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def get_thesaurus(self, thesaurus):
+        """
+        :param thesaurus:   the name of a thesaurus, None for the stages of the whole build
+        :return:            the stages, counters and memory records of the thesaurus
+        """
+        if thesaurus is None:
+            return self.build
+        return self.thesauri.setdefault(thesaurus, {"stages": {}, "counters": {}, "memory": {}})
+
+    def add_time(self, thesaurus, stage, seconds, calls=1):
+        with self.lock:
+            stages = self.get_thesaurus(thesaurus)["stages"]
+            timing = stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            timing["seconds"] += seconds
+            timing["calls"] += calls
+
+    @contextlib.contextmanager
+    def stage(self, thesaurus, stage):
+        """
+        Context manager timing a stage of a thesaurus.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.add_time(thesaurus, stage, _clock() - start)
+
+    def wrap(self, thesaurus, stage, func):
+        """
+        :return:    the function func, timed as a stage of the thesaurus
+        """
+        if not self.enabled:
+            return func
+
+        def timed(*args, **kwargs):
+            start = _clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(thesaurus, stage, _clock() - start)
+        return timed
+
+    def wrap_iter(self, thesaurus, stage, iterable):
+        """
+        :return:    an iterator over iterable, the time spent getting each item being timed as a stage of the
+                    thesaurus
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(thesaurus, stage, iterable)
+
+    def _timed_iter(self, thesaurus, stage, iterable):
+        iterator = iter(iterable)
+        seconds = 0.0
+        calls = 0
+        try:
+            while True:
+                start = _clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += _clock() - start
+                    return
+                seconds += _clock() - start
+                calls += 1
+                yield item
+        finally:
+            self.add_time(thesaurus, stage, seconds, calls)
+
+    def wrap_file(self, thesaurus, stage, output_file):
+        """
+        :return:    a file object whose write method is timed as a stage of the thesaurus
+        """
+        if not self.enabled:
+            return output_file
+        return _TimedFile(self.wrap(thesaurus, stage, output_file.write))
+
+    def count(self, thesaurus, counter, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            counters = self.get_thesaurus(thesaurus)["counters"]
+            counters[counter] = counters.get(counter, 0) + n
+
+    def add_queues(self, thesaurus, queues):
+        """
+        Record the metrics of the queues of a pipeline of a thesaurus: depth and time waited by the stages.
+
+        :param queues:  the StageQueue of the pipeline
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            reports = self.get_thesaurus(thesaurus).setdefault("queues", {})
+            for stage_queue in queues:
+                report = stage_queue.report()
+                previous = reports.get(stage_queue.name)
+                if previous is not None:
+                    # Queue of several pipelines of the thesaurus, e.g. one per chunk of features
+                    report["max_depth"] = max(report["max_depth"], previous["max_depth"])
+                    items = report["items"] + previous["items"]
+                    report["mean_depth"] = ((report["mean_depth"] * report["items"] +
+                                             previous["mean_depth"] * previous["items"]) / items if items else 0.)
+                    report["items"] = items
+                    report["put_wait_seconds"] += previous["put_wait_seconds"]
+                    report["get_wait_seconds"] += previous["get_wait_seconds"]
+                reports[stage_queue.name] = report
+
+    @contextlib.contextmanager
+    def memory(self, thesaurus, stage):
+        """
+        Context manager recording the memory allocated by a stage of a thesaurus, with the sites allocating the most.
+        """
+        if not self.enabled or tracemalloc is None:
+            yield
+            return
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            self.get_thesaurus(thesaurus)["memory"][stage] = {
+                "traced_current_bytes": current,
+                "traced_peak_bytes": peak,
+                "peak_rss_kb": get_peak_rss(),
+                "top_allocations": [u"{}".format(diff)
+                                    for diff in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]],
+            }
+
+    def write(self):
+        """
+        Write the report, and the cProfile statistics if requested.
+
+        :return:    the path of the report, None if the profiler is disabled
+        """
+        if not self.enabled:
+            return None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(self.output_dir, CPROFILE_FILE_NAME))
+
+        report = {
+            "started": self.started,
+            "total_seconds": _clock() - self.start_time if self.start_time is not None else None,
+            "peak_rss_kb": get_peak_rss(),
+            "python": sys.version.split()[0],
+            "build": self.build,
+            "thesauri": self.thesauri,
+        }
+        path = os.path.join(self.output_dir, PROFILE_FILE_NAME)
+        with open(path, 'w') as f:
+            f.write(json.dumps(report, indent=2, sort_keys=True))
+        return path
+
+
+class _TimedFile(object):
+
+    def __init__(self, write):
+        self.write = write
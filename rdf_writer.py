@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+import re
+
+from utils import LazyModule
+from utils import prettify_xml
+
+# Non standard imports (see requirements.txt), imported on first use
+jinja2 = LazyModule('jinja2')
+
+
+# Comment standing for the concepts in the document skeleton
+CONCEPTS_MARKER = u"<!--thesaurus_builder:concepts-->"
+
+# Directory of the compiled templates, in the cache directory of the build or of the user
+TEMPLATES_CACHE_DIR_NAME = "thesaurus_templates_cache"
+
+# Directory of the thesaurus builder in the cache directory of the user
+USER_CACHE_DIR_NAME = "thesaurus_builder"
+
+_JINJA_LOOP_TAG_RE = re.compile(r"\{%-?\s*(for|endfor)\b(.*?)-?%\}", re.DOTALL)
+_TERR_LOOP_RE = re.compile(r"^\s*(\w+)\s+in\s+terr_list\s*$")
+_XML_TAG_RE = re.compile(r"<(/?)[^>]*?(/?)>")
+
+
+def split_template(source):
+    """
+    Split a thesaurus template around its last top-level loop over terr_list.
+
+    :param source:  the source of the Jinja template
+    :return:        the (header, fragment, footer, loop variable name) tuple, where fragment is the loop body
+    """
+    depth = 0
+    loop = None
+    loop_start = None
+    for match in _JINJA_LOOP_TAG_RE.finditer(source):
+        if match.group(1) == 'for':
+            if depth == 0:
+                loop_start = match
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                terr_loop = _TERR_LOOP_RE.match(loop_start.group(2))
+                if terr_loop:
+                    loop = (loop_start, match, terr_loop.group(1))
+
+    if loop is None:
+        raise ValueError(u"No loop over terr_list found in the template")
+
+    start, end, var_name = loop
+    return source[:start.start()], source[start.end():end.start()], source[end.end():], var_name
+
+
+def get_templates_cache_dir(cache_dir=None):
+    """
+    :param cache_dir:   the cache directory of the build (--cache-dir), None if not given
+    :return:            the directory of the compiled templates: in the cache directory of the build, else in the
+                        cache directory of the user ($XDG_CACHE_HOME, %LOCALAPPDATA% or ~/.cache), so that it is never
+                        written next to the thesauri
+    """
+    if cache_dir:
+        return os.path.join(cache_dir, TEMPLATES_CACHE_DIR_NAME)
+    user_cache_dir = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(user_cache_dir, USER_CACHE_DIR_NAME, TEMPLATES_CACHE_DIR_NAME)
+
+
+def create_template_env(templates_dir_path, bytecode_cache_dir=None):
+    """
+    :param templates_dir_path:  the directory of the templates
+    :param bytecode_cache_dir:  the directory keeping the compiled templates from one run to the next, None for no
+                                cache. The templates are compiled at each run if it can not be created
+    :return:                    the Jinja environment of the thesaurus templates
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        try:
+            if not os.path.isdir(bytecode_cache_dir):
+                os.makedirs(bytecode_cache_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+        except OSError:
+            pass
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=templates_dir_path),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        bytecode_cache=bytecode_cache)
+
+
+def compile_template(template_env, source, name):
+    """
+    Compile a template from its source as Environment.from_string, but through the bytecode cache of the environment,
+    the compiled code being then reused as long as the source does not change.
+
+    :param template_env:    the Jinja environment
+    :param source:          the source of the template
+    :param name:            the name of the template in the cache
+    :return:                the Template
+    """
+    bytecode_cache = template_env.bytecode_cache
+    if bytecode_cache is None:
+        return template_env.from_string(source)
+    bucket = bytecode_cache.get_bucket(template_env, name, None, source)
+    if bucket.code is None:
+        bucket.code = template_env.compile(source, name)
+        bytecode_cache.set_bucket(bucket)
+    return template_env.template_class.from_code(template_env, bucket.code, template_env.make_globals(None), None)
+
+
+def format_fragment(xml, depth, minify=False, indent="  ", newl=os.linesep):
+    """
+    Indent or minify an XML fragment written with one tag per line, as prettify_xml would do.
+
+    :param xml:     the XML fragment
+    :param depth:   the depth of the fragment root elements in the document
+    :param minify:  True for minification and False for prettification
+    :param indent:  String used for indentation
+    :param newl:    String used for new lines
+    :return:        the formatted XML fragment
+    """
+    lines = [line.strip() for line in xml.splitlines()]
+    lines = [line for line in lines if line]
+    if minify:
+        return u"".join(lines)
+
+    formatted = []
+    for line in lines:
+        opened = 0
+        closed = 0
+        for tag in _XML_TAG_RE.finditer(line):
+            if tag.group(1):
+                closed += 1
+            elif not tag.group(2) and line[tag.start() + 1] not in "?!":
+                opened += 1
+        line_depth = depth - 1 if line.startswith(u"</") else depth
+        formatted.append(indent * line_depth + line + newl)
+        depth += opened - closed
+    return u"".join(formatted)
+
+
+class RdfWriter(object):
+    """
+    Write a thesaurus file one concept at a time.
+
+    The template is split around its last top-level loop over terr_list. The parts before and after the loop are
+    the document skeleton, rendered and formatted once with prettify_xml. The loop body is rendered and formatted for
+    each territory and streamed to the output file between the two parts of the skeleton. Other loops over terr_list
+    (the narrower links of the root concepts for example) are rendered in the skeleton.
+    """
+
+    def __init__(self, template_env, template_name, minify=False, indent="  ", newl=os.linesep):
+        """
+        :param template_env:    the Jinja environment
+        :param template_name:   the name of the thesaurus template
+        :param minify:          True for a compact file
+        :param indent:          String used for indentation
+        :param newl:            String used for new lines
+        """
+        source = template_env.loader.get_source(template_env, template_name)[0]
+        header, fragment, footer, self.var_name = split_template(source)
+        self.skeleton_template = compile_template(template_env, header + CONCEPTS_MARKER + footer,
+                                                  template_name + u"#skeleton")
+        self.fragment_template = compile_template(template_env, fragment, template_name + u"#fragment")
+        self.minify = minify
+        self.indent = indent
+        self.newl = newl
+
+    def render_skeleton(self, data):
+        """
+        :param data:    the data passed to the template
+        :return:        the formatted (header, footer, concepts depth) tuple
+        """
+        skeleton = prettify_xml(self.skeleton_template.render(data),
+                                minify=self.minify, indent=self.indent, newl=self.newl)
+        marker_start = skeleton.index(CONCEPTS_MARKER)
+        marker_end = marker_start + len(CONCEPTS_MARKER)
+        if self.minify:
+            return skeleton[:marker_start], skeleton[marker_end:], 0
+
+        line_start = skeleton.rfind(self.newl, 0, marker_start) + len(self.newl)
+        depth = (marker_start - line_start) // len(self.indent) if self.indent else 0
+        return skeleton[:line_start], skeleton[marker_end + len(self.newl):], depth
+
+    def render_concept(self, data, terr, depth):
+        """
+        :param data:    the data passed to the template
+        :param terr:    the territory
+        :param depth:   the depth of the concepts in the document
+        :return:        the formatted concept
+        """
+        fragment = self.fragment_template.render(data, **{self.var_name: terr})
+        return format_fragment(fragment, depth, minify=self.minify, indent=self.indent, newl=self.newl)
+
+    def write(self, output_file, data):
+        """
+        :param output_file:     the file object the thesaurus is written to
+        :param data:            the data passed to the template, with the territories in terr_list
+        """
+        header, footer, depth = self.render_skeleton(data)
+        output_file.write(header)
+        for terr in data["terr_list"]:
+            output_file.write(self.render_concept(data, terr, depth))
+        output_file.write(footer)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+from functools import partial
+
+from utils import LazyModule
+
+# Non standard imports (see requirements.txt), imported on first use
+numpy = LazyModule('numpy')
+pyproj = LazyModule('pyproj')
+shapely = LazyModule('shapely')
+shapely_ops = LazyModule('shapely.ops')
+
+
+WGS84 = 'EPSG:4326'
+REPROJECTION_MODES = ('exact', 'hull', 'envelope')
+
+# Transformers already built, by source CRS
+_transformers = {}
+# Transformers from WGS84 already built, by target CRS
+_inverse_transformers = {}
+
+
+def get_transformer(crs_wkt, crs=None, shared=True):
+    """
+    Get the function reprojecting coordinates arrays to WGS84. The function is built only once per source CRS.
+
+    :param crs_wkt:     the WKT of the source CRS, used as the cache key
+    :param crs:         the source CRS as a mapping, only used with pyproj < 2.1 which does not read WKT
+    :param shared:      False to build a new function, not cached, e.g. for another thread: a pyproj Transformer must
+                        not be used by several threads
+    :return:            a function taking arrays of x and y and returning arrays of longitudes and latitudes
+    """
+    transformer = _transformers.get(crs_wkt) if shared else None
+    if transformer is None:
+        if hasattr(pyproj, 'Transformer'):
+            transformer = pyproj.Transformer.from_crs(crs_wkt, WGS84, always_xy=True).transform
+        else:
+            transformer = partial(
+                pyproj.transform,
+                pyproj.Proj(crs if crs is not None else crs_wkt),
+                pyproj.Proj(init=WGS84))
+        if shared:
+            _transformers[crs_wkt] = transformer
+    return transformer
+
+
+def get_inverse_transformer(crs_wkt, crs=None):
+    """
+    Get the function reprojecting WGS84 coordinates arrays to a CRS. The function is built only once per target CRS.
+
+    :param crs_wkt:     the WKT of the target CRS, used as the cache key
+    :param crs:         the target CRS as a mapping, only used with pyproj < 2.1 which does not read WKT
+    :return:            a function taking arrays of longitudes and latitudes and returning arrays of x and y
+    """
+    transformer = _inverse_transformers.get(crs_wkt)
+    if transformer is None:
+        if hasattr(pyproj, 'Transformer'):
+            transformer = pyproj.Transformer.from_crs(WGS84, crs_wkt, always_xy=True).transform
+        else:
+            transformer = partial(
+                pyproj.transform,
+                pyproj.Proj(init=WGS84),
+                pyproj.Proj(crs if crs is not None else crs_wkt))
+        _inverse_transformers[crs_wkt] = transformer
+    return transformer
+
+
+def reproject_from_wgs84(geom, crs_wkt, crs=None):
+    """
+    :param geom:        a shapely geometry in WGS84 (longitude, latitude)
+    :param crs_wkt:     the WKT of the target CRS
+    :param crs:         the target CRS as a mapping (see get_inverse_transformer)
+    :return:            the geometry reprojected in the target CRS
+    """
+    return shapely_ops.transform(get_inverse_transformer(crs_wkt, crs), geom)
+
+
+def get_coordinates_array(geom):
+    """
+    Get the coordinates of all the vertices of a geometry.
+
+    :param geom:    a shapely geometry
+    :return:        a (n, 2) numpy array
+    """
+    # Shapely < 2.0 has no get_coordinates
+    get_coordinates = getattr(shapely, 'get_coordinates', None)
+    if get_coordinates is not None:
+        return get_coordinates(geom)
+
+    def iter_coords(g):
+        if hasattr(g, 'geoms'):
+            for part in g.geoms:
+                for c in iter_coords(part):
+                    yield c
+        elif g.geom_type == 'Polygon':
+            for ring in [g.exterior] + list(g.interiors):
+                for c in ring.coords:
+                    yield c[:2]
+        else:
+            for c in g.coords:
+                yield c[:2]
+
+    return numpy.array(list(iter_coords(geom)), dtype=float).reshape(-1, 2)
+
+
+def densify(xs, ys, points_per_segment):
+    """
+    Insert regularly spaced points on each segment of a line.
+
+    :param xs:                  array of the x of the line vertices
+    :param ys:                  array of the y of the line vertices
+    :param points_per_segment:  number of points replacing each segment (its first vertex included)
+    :return:                    the arrays of the x and y of the densified line
+    """
+    if len(xs) < 2 or points_per_segment < 2:
+        return xs, ys
+    t = numpy.linspace(0., 1., points_per_segment, endpoint=False)
+    dense_xs = (xs[:-1, None] + (xs[1:] - xs[:-1])[:, None] * t).ravel()
+    dense_ys = (ys[:-1, None] + (ys[1:] - ys[:-1])[:, None] * t).ravel()
+    return numpy.append(dense_xs, xs[-1]), numpy.append(dense_ys, ys[-1])
+
+
+def densify_groups(xs, ys, groups, points_per_segment):
+    """
+    Insert regularly spaced points on each segment of several lines, as densify does for one line.
+
+    :param xs:                  array of the x of the vertices of the lines, one line after the other
+    :param ys:                  array of the y of the vertices
+    :param groups:              array of the position of the line of each vertex
+    :param points_per_segment:  number of points replacing each segment (its first vertex included)
+    :return:                    the arrays of the x, y and line positions of the vertices and of the points inserted
+    """
+    if points_per_segment < 2:
+        return xs, ys, groups
+    segments = groups[1:] == groups[:-1]
+    t = numpy.linspace(0., 1., points_per_segment, endpoint=False)[1:]
+    dense_xs = (xs[:-1][segments, None] + (xs[1:] - xs[:-1])[segments, None] * t).ravel()
+    dense_ys = (ys[:-1][segments, None] + (ys[1:] - ys[:-1])[segments, None] * t).ravel()
+    dense_groups = numpy.repeat(groups[:-1][segments], len(t))
+    return numpy.concatenate((xs, dense_xs)), numpy.concatenate((ys, dense_ys)), \
+        numpy.concatenate((groups, dense_groups))
+
+
+def grouped_bounds(lons, lats, groups, size):
+    """
+    :param lons:    array of longitudes
+    :param lats:    array of latitudes
+    :param groups:  array of the position of the group of each point
+    :param size:    number of groups
+    :return:        the (size, 4) array of the (lon_min, lat_min, lon_max, lat_max) of the points of each group, NaN
+                    for the groups without point
+    """
+    bounds = numpy.empty((size, 4))
+    bounds[:, :2] = numpy.inf
+    bounds[:, 2:] = -numpy.inf
+    numpy.minimum.at(bounds[:, 0], groups, lons)
+    numpy.minimum.at(bounds[:, 1], groups, lats)
+    numpy.maximum.at(bounds[:, 2], groups, lons)
+    numpy.maximum.at(bounds[:, 3], groups, lats)
+    bounds[numpy.isinf(bounds[:, 0])] = numpy.nan
+    return bounds
+
+
+def _bounds(lons, lats):
+    return float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())
+
+
+def _deviation(bounds_a, bounds_b):
+    return max(abs(a - b) for a, b in zip(bounds_a, bounds_b))
+
+
+class Reprojector(object):
+    """
+    Compute the WGS84 bounding box of geometries of one source CRS.
+
+    The exact mode reprojects every vertex, as a single array call per geometry. The hull and envelope modes only
+    reproject the convex hull or a densified envelope of the geometry. With a tolerance, the approximate bounding box
+    is checked against a bound computed on the other side of the exact one (the densified hull, or the vertices
+    defining the envelope) and the exact mode is used for the geometries where they differ by more than the tolerance.
+    """
+
+    def __init__(self, crs_wkt, crs=None, mode='hull', tolerance=None, densify_points=8):
+        """
+        :param crs_wkt:         the WKT of the source CRS
+        :param crs:             the source CRS as a mapping (see get_transformer)
+        :param mode:            one of REPROJECTION_MODES
+        :param tolerance:       maximal deviation in degrees from the exact bounding box, None to disable the check
+        :param densify_points:  number of points per segment of the densified hull or envelope
+        """
+        if mode not in REPROJECTION_MODES:
+            raise ValueError(u"Unknown reprojection mode: {}".format(mode))
+        self.crs_wkt = crs_wkt
+        self.crs = crs
+        self.transform = get_transformer(crs_wkt, crs)
+        self.mode = mode
+        self.tolerance = tolerance
+        self.densify_points = densify_points
+        self.count = 0
+        self.exact_count = 0
+
+    def copy(self):
+        """
+        :return:    a Reprojector with the same settings, its own transformer and counts, for another thread
+        """
+        reprojector = Reprojector(self.crs_wkt, crs=self.crs, mode=self.mode, tolerance=self.tolerance,
+                                  densify_points=self.densify_points)
+        reprojector.transform = get_transformer(self.crs_wkt, self.crs, shared=False)
+        return reprojector
+
+    def add_counts(self, other):
+        """
+        :param other:   a copy of the Reprojector, whose counts are added to the counts of this one
+        """
+        self.count += other.count
+        self.exact_count += other.exact_count
+
+    def bounds(self, geom):
+        """
+        :param geom:    a shapely geometry in the source CRS
+        :return:        the (lon_min, lat_min, lon_max, lat_max) tuple, None for an empty geometry, which has no bbox
+        """
+        if geom.is_empty:
+            return None
+        self.count += 1
+        if self.mode == 'exact':
+            return self.exact_bounds(geom)
+
+        if self.mode == 'hull':
+            coords = get_coordinates_array(geom.convex_hull)
+            lons, lats = self.transform(coords[:, 0], coords[:, 1])
+            bounds = _bounds(lons, lats)
+            if self.tolerance is None:
+                return bounds
+            lons, lats = self.transform(*densify(coords[:, 0], coords[:, 1], self.densify_points))
+            other_bounds = _bounds(lons, lats)
+        else:
+            x_min, y_min, x_max, y_max = geom.bounds
+            xs, ys = densify(numpy.array([x_min, x_max, x_max, x_min, x_min]),
+                             numpy.array([y_min, y_min, y_max, y_max, y_min]),
+                             self.densify_points)
+            lons, lats = self.transform(xs, ys)
+            bounds = _bounds(lons, lats)
+            if self.tolerance is None:
+                return bounds
+            # Vertices touching the envelope
+            coords = get_coordinates_array(geom)
+            extremes = coords[[coords[:, 0].argmin(), coords[:, 1].argmin(),
+                               coords[:, 0].argmax(), coords[:, 1].argmax()]]
+            lons, lats = self.transform(extremes[:, 0], extremes[:, 1])
+            other_bounds = _bounds(lons, lats)
+
+        if _deviation(bounds, other_bounds) > self.tolerance:
+            return self.exact_bounds(geom)
+        return bounds
+
+    def exact_bounds(self, geom):
+        if geom.is_empty:
+            return None
+        self.exact_count += 1
+        coords = get_coordinates_array(geom)
+        lons, lats = self.transform(coords[:, 0], coords[:, 1])
+        return _bounds(lons, lats)
+
+    def bounds_array(self, geoms):
+        """
+        Compute the bounding boxes of an array of geometries at once, with the same result as bounds for each one:
+        the vertices of all the geometries are reprojected by a single call. Requires shapely >= 2.0.
+
+        :param geoms:   a numpy array of shapely geometries in the source CRS
+        :return:        the (n, 4) array of the (lon_min, lat_min, lon_max, lat_max) of the geometries, NaN for the
+                        empty geometries
+        """
+        self.count += len(geoms)
+        if self.mode == 'exact':
+            return self.exact_bounds_array(geoms)
+
+        if self.mode == 'hull':
+            coords, groups = shapely.get_coordinates(shapely.convex_hull(geoms), return_index=True)
+            lons, lats = self.transform(coords[:, 0], coords[:, 1])
+            bounds = grouped_bounds(lons, lats, groups, len(geoms))
+            if self.tolerance is None:
+                return bounds
+            xs, ys, groups = densify_groups(coords[:, 0], coords[:, 1], groups, self.densify_points)
+            lons, lats = self.transform(xs, ys)
+            other_bounds = grouped_bounds(lons, lats, groups, len(geoms))
+        else:
+            envelopes = shapely.bounds(geoms)
+            xs = envelopes[:, [0, 2, 2, 0, 0]].ravel()
+            ys = envelopes[:, [1, 1, 3, 3, 1]].ravel()
+            xs, ys, groups = densify_groups(xs, ys, numpy.repeat(numpy.arange(len(geoms)), 5), self.densify_points)
+            lons, lats = self.transform(xs, ys)
+            bounds = grouped_bounds(lons, lats, groups, len(geoms))
+            if self.tolerance is None:
+                return bounds
+            # Vertices touching the envelope, the first one of each geometry on a tie as with argmin and argmax
+            coords, groups = shapely.get_coordinates(geoms, return_index=True)
+            extremes = []
+            for values in (coords[:, 0], coords[:, 1], -coords[:, 0], -coords[:, 1]):
+                order = numpy.lexsort((values, groups))
+                firsts = numpy.flatnonzero(numpy.r_[True, groups[order][1:] != groups[order][:-1]])
+                extremes.append(order[firsts])
+            extremes = numpy.concatenate(extremes)
+            lons, lats = self.transform(coords[extremes, 0], coords[extremes, 1])
+            other_bounds = grouped_bounds(lons, lats, groups[extremes], len(geoms))
+
+        exact = numpy.flatnonzero(numpy.abs(bounds - other_bounds).max(axis=1) > self.tolerance)
+        if len(exact):
+            bounds[exact] = self.exact_bounds_array(geoms[exact])
+        return bounds
+
+    def exact_bounds_array(self, geoms):
+        self.exact_count += len(geoms)
+        coords, groups = shapely.get_coordinates(geoms, return_index=True)
+        lons, lats = self.transform(coords[:, 0], coords[:, 1])
+        return grouped_bounds(lons, lats, groups, len(geoms))
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+from utils import LazyModule
+
+# Non standard imports (see requirements.txt), imported on first use
+numpy = LazyModule('numpy')
+shapely = LazyModule('shapely')
+shapely_prepared = LazyModule('shapely.prepared')
+shapely_strtree = LazyModule('shapely.strtree')
+shapely_wkb = LazyModule('shapely.wkb')
+
+
+# geom.relate(filter_geom)[0] != 'F'
+INTERIORS_INTERSECT = 'interiors-intersect'
+# geom.relate(filter_geom)[0] == '2'
+INTERIORS_OVERLAP = 'interiors-overlap'
+
+AREAL_TYPES = ('Polygon', 'MultiPolygon')
+
+# Counters of the stages of a SpatialPredicate
+STATS_NAMES = ("tested", "bbox_rejected", "outer_rejected", "inner_accepted", "prepared_rejected",
+               "interior_point_accepted", "relate_evaluated", "kept")
+
+def copy_geometry(geom):
+    """
+    :param geom:    a shapely geometry
+    :return:        a new geometry equal to geom, sharing no GEOS object with it: a prepared geometry is prepared in
+                    place, so a geometry prepared by a thread must not be used by another
+    """
+    return shapely_wkb.loads(geom.wkb)
+
+
+REPORT_FORMAT = u"{tested} tested, {bbox_rejected} rejected on bbox, {outer_rejected} rejected by the outer " \
+                u"approximation, {inner_accepted} accepted by the inner approximation, {prepared_rejected} rejected " \
+                u"by the prepared geometry, {interior_point_accepted} accepted by interior point, {relate_evaluated} " \
+                u"evaluated with relate, {kept} kept"
+
+
+class SpatialPredicate(object):
+    """
+    Test the interior of geometries against the interior of a filter geometry, with the same result as the first
+    character (interior/interior) of the DE-9IM matrix computed by relate:
+    - INTERIORS_INTERSECT: geom.relate(filter_geom)[0] != 'F'
+    - INTERIORS_OVERLAP: geom.relate(filter_geom)[0] == '2'
+
+    The filter geometry is prepared once and its parts are indexed in a STRtree. Each geometry then goes through the
+    following stages, the first conclusive one giving the result:
+    - bbox: no part of the filter has an envelope intersecting the envelope of the geometry
+    - outer approximation: the geometry does not intersect a simplified geometry containing the filter
+    - inner approximation: the geometry intersects a simplified geometry contained in the interior of the filter, the
+      geometry being areal for INTERIORS_OVERLAP
+    - prepared: the geometry does not intersect the prepared filter geometry
+    - interior point: for areal geometries and filter, the interior point of the geometry is in the interior of the
+      filter
+    - relate: the DE-9IM matrix is computed against the parts of the filter whose envelope intersects the geometry
+    """
+
+    def __init__(self, geom, predicate=INTERIORS_INTERSECT, outer=None, inner=None):
+        """
+        :param geom:        the filter geometry, usually the union of the filter shapefile geometries
+        :param predicate:   INTERIORS_INTERSECT or INTERIORS_OVERLAP
+        :param outer:       a simplified geometry containing the filter geometry, None for no outer approximation
+        :param inner:       a simplified geometry contained in the interior of the filter geometry, None for no inner
+                            approximation
+        """
+        if predicate not in (INTERIORS_INTERSECT, INTERIORS_OVERLAP):
+            raise ValueError(u"Unknown spatial predicate: {}".format(predicate))
+        self.geom = geom
+        self.predicate = predicate
+        self.parts = list(geom.geoms) if hasattr(geom, 'geoms') else [geom]
+        self.areal = all(part.geom_type in AREAL_TYPES for part in self.parts)
+        self.tree = shapely_strtree.STRtree(self.parts) if self.parts else None
+        self.prepared = shapely_prepared.prep(geom)
+        # The approximations tested before the exact geometry, far fewer vertices making them faster
+        self.outer = shapely_prepared.prep(outer) if outer is not None else None
+        self.inner = shapely_prepared.prep(inner) if inner is not None and not inner.is_empty else None
+        self.stats = dict((name, 0) for name in STATS_NAMES)
+
+    def copy(self):
+        """
+        :return:    a SpatialPredicate with copies of the geometries and its own statistics, for another thread
+        """
+        return SpatialPredicate(copy_geometry(self.geom), self.predicate,
+                                outer=copy_geometry(self.outer.context) if self.outer is not None else None,
+                                inner=copy_geometry(self.inner.context) if self.inner is not None else None)
+
+    def add_stats(self, other):
+        """
+        :param other:   a copy of the SpatialPredicate, whose statistics are added to the statistics of this one
+        """
+        for name in STATS_NAMES:
+            self.stats[name] += other.stats[name]
+
+    def candidates(self, geom):
+        """
+        :param geom:    a geometry
+        :return:        the parts of the filter geometry whose envelope intersects the envelope of geom
+        """
+        if self.tree is None:
+            return []
+        result = self.tree.query(geom)
+        # Shapely >= 2.0 returns indices, older versions return the geometries
+        return [self.parts[i] if not hasattr(i, 'geom_type') else i for i in result]
+
+    def test(self, geom):
+        """
+        :param geom:    the geometry to test
+        :return:        True if the interior of geom intersects (or overlaps) the interior of the filter geometry
+        """
+        self.stats["tested"] += 1
+
+        candidates = self.candidates(geom)
+        if not candidates:
+            self.stats["bbox_rejected"] += 1
+            return False
+
+        # Only the geometries near the boundary of the filter go through the following stages
+        if self.outer is not None and not self.outer.intersects(geom):
+            self.stats["outer_rejected"] += 1
+            return False
+
+        if self.inner is not None and (self.predicate == INTERIORS_INTERSECT or geom.geom_type in AREAL_TYPES) and \
+                self.inner.intersects(geom):
+            self.stats["inner_accepted"] += 1
+            self.stats["kept"] += 1
+            return True
+
+        if not self.prepared.intersects(geom):
+            self.stats["prepared_rejected"] += 1
+            return False
+
+        if self.areal and geom.geom_type in AREAL_TYPES and \
+                self.prepared.contains_properly(geom.representative_point()):
+            self.stats["interior_point_accepted"] += 1
+            self.stats["kept"] += 1
+            return True
+
+        return self.test_relate(geom, candidates)
+
+    def test_relate(self, geom, candidates):
+        """
+        :param geom:        the geometry to test
+        :param candidates:  the parts of the filter geometry whose envelope intersects the envelope of geom
+        :return:            True if the interior of geom intersects (or overlaps) the interior of one of the parts
+        """
+        # The interior of the filter geometry is the union of the interiors of its parts
+        self.stats["relate_evaluated"] += 1
+        for part in candidates:
+            interiors = part.relate(geom)[0]
+            if interiors == '2' or (interiors != 'F' and self.predicate == INTERIORS_INTERSECT):
+                self.stats["kept"] += 1
+                return True
+        return False
+
+    def test_array(self, geoms):
+        """
+        Test an array of geometries at once, with the same result and statistics as test for each one: each stage is
+        computed by a single vectorized call for the geometries it still has to decide. Requires shapely >= 2.0.
+
+        :param geoms:   a numpy array of geometries
+        :return:        the boolean array of the results
+        """
+        self.stats["tested"] += len(geoms)
+        result = numpy.zeros(len(geoms), dtype=bool)
+        if self.tree is None:
+            self.stats["bbox_rejected"] += len(geoms)
+            return result
+
+        pairs = self.tree.query(geoms)
+        pending = numpy.zeros(len(geoms), dtype=bool)
+        pending[pairs[0]] = True
+        self.stats["bbox_rejected"] += len(geoms) - int(pending.sum())
+
+        def decide(mask, value, stat):
+            """
+            Decide the pending geometries of mask (a boolean array of the pending geometries).
+            """
+            positions = numpy.flatnonzero(pending)[mask]
+            result[positions] = value
+            pending[positions] = False
+            self.stats[stat] += len(positions)
+            if value:
+                self.stats["kept"] += len(positions)
+
+        areal_ids = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+        if self.outer is not None:
+            decide(~shapely.intersects(self.outer.context, geoms[pending]), False, "outer_rejected")
+        if self.inner is not None:
+            tested = geoms[pending]
+            mask = shapely.intersects(self.inner.context, tested)
+            if self.predicate != INTERIORS_INTERSECT:
+                mask &= numpy.isin(shapely.get_type_id(tested), areal_ids)
+            decide(mask, True, "inner_accepted")
+        decide(~shapely.intersects(self.geom, geoms[pending]), False, "prepared_rejected")
+        if self.areal:
+            tested = geoms[pending]
+            areal = numpy.isin(shapely.get_type_id(tested), areal_ids)
+            mask = numpy.zeros(len(tested), dtype=bool)
+            mask[areal] = shapely.contains_properly(self.geom, shapely.point_on_surface(tested[areal]))
+            decide(mask, True, "interior_point_accepted")
+
+        # The candidates of each remaining geometry, as those of test
+        pairs = pairs[:, numpy.argsort(pairs[0], kind='stable')]
+        starts = numpy.searchsorted(pairs[0], numpy.arange(len(geoms) + 1))
+        for i in numpy.flatnonzero(pending):
+            result[i] = self.test_relate(geoms[i], [self.parts[j] for j in pairs[1][starts[i]:starts[i + 1]]])
+        return result
+
+    def report(self):
+        """
+        :return:    a summary of the number of features pruned or kept by each stage
+        """
+        return REPORT_FORMAT.format(**self.stats)
+
+
+class SpatialPartition(object):
+    """
+    Find the zones (departements...) whose interior intersects (or overlaps) the interior of geometries, giving the
+    same result as a SpatialPredicate per zone.
+
+    The zones are indexed in a STRtree, so that a geometry is only tested against the SpatialPredicate of the zones
+    whose envelope intersects its envelope.
+    """
+
+    def __init__(self, zones, predicate=INTERIORS_INTERSECT):
+        """
+        :param zones:       list of (geometry, keys) tuples, the keys of a zone being a set
+        :param predicate:   INTERIORS_INTERSECT or INTERIORS_OVERLAP
+        """
+        self.geoms = [geom for geom, keys in zones]
+        self.keys = [keys for geom, keys in zones]
+        self.predicate = predicate
+        self.predicates = [SpatialPredicate(geom, predicate) for geom in self.geoms]
+        self.tree = shapely_strtree.STRtree(self.geoms) if self.geoms else None
+        self.positions = dict((id(geom), i) for i, geom in enumerate(self.geoms))
+
+    def copy(self):
+        """
+        :return:    a SpatialPartition with copies of the geometries and its own statistics, for another thread
+        """
+        return SpatialPartition([(copy_geometry(geom), keys) for geom, keys in zip(self.geoms, self.keys)],
+                                self.predicate)
+
+    def add_stats(self, other):
+        """
+        :param other:   a copy of the SpatialPartition, whose statistics are added to the statistics of this one
+        """
+        for predicate, other_predicate in zip(self.predicates, other.predicates):
+            predicate.add_stats(other_predicate)
+
+    def get_keys(self, geom):
+        """
+        :param geom:    the geometry to test
+        :return:        the union of the keys of the zones whose interior intersects (or overlaps) the interior of geom
+        """
+        keys = set()
+        if self.tree is None:
+            return keys
+        for i in self.tree.query(geom):
+            # Shapely >= 2.0 returns indices, older versions return the geometries
+            if hasattr(i, 'geom_type'):
+                i = self.positions[id(i)]
+            if self.predicates[i].test(geom):
+                keys.update(self.keys[i])
+        return keys
+
+    def report(self):
+        """
+        :return:    a summary of the number of features pruned or kept by each stage, for all the zones
+        """
+        stats = dict((name, 0) for name in STATS_NAMES)
+        for predicate in self.predicates:
+            for name in STATS_NAMES:
+                stats[name] += predicate.stats[name]
+        return REPORT_FORMAT.format(**stats)
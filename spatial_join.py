@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+
+from build_manifest import get_shapefile_paths
+from utils import LAYER_NAME_SEPARATOR
+from utils import LazyModule
+from utils import get_layer_label
+
+# Non standard imports (see requirements.txt), imported on first use
+shapely_prepared = LazyModule('shapely.prepared')
+shapely_strtree = LazyModule('shapely.strtree')
+
+
+# The parent of a feature is the parent feature containing its representative point (representative-point), or the
+# one its geometry overlaps the most (largest-overlap)
+REPRESENTATIVE_POINT = 'representative-point'
+LARGEST_OVERLAP = 'largest-overlap'
+JOIN_METHODS = (REPRESENTATIVE_POINT, LARGEST_OVERLAP)
+
+AREAL_TYPES = ('Polygon', 'MultiPolygon')
+
+
+class SpatialJoin(object):
+    """
+    Find the parent of geometries among the features of a parent layer, as the first step of a bulk join: the parents
+    are indexed once in a STRtree, so that each geometry is only tested against the parents whose envelope intersects
+    its envelope (or the one of its representative point). Joining n geometries to m parents costs O((n + m) log m)
+    instead of the O(n * m) of pairwise tests.
+
+    The parents are prepared on first use. Ties (a representative point on the boundary of two parents, two equal
+    overlaps) are resolved by taking the parent with the smallest code.
+    """
+
+    def __init__(self, parents, method=REPRESENTATIVE_POINT):
+        """
+        :param parents:     list of the (code, geometry) tuples of the parents
+        :param method:      one of JOIN_METHODS. Non areal geometries are always joined by representative point.
+        """
+        if method not in JOIN_METHODS:
+            raise ValueError(u"Unknown spatial join method: {}".format(method))
+        self.method = method
+        parents = sorted((p for p in parents if p[1] is not None and not p[1].is_empty), key=lambda p: p[0])
+        self.codes = [code for code, geom in parents]
+        self.geoms = [geom for code, geom in parents]
+        self.prepared = [None] * len(self.geoms)
+        self.tree = shapely_strtree.STRtree(self.geoms) if self.geoms else None
+        self.positions = dict((id(geom), i) for i, geom in enumerate(self.geoms))
+        self.stats = {"joined": 0, "orphans": 0}
+
+    def candidates(self, geom):
+        """
+        :param geom:    a geometry
+        :return:        the sorted positions of the parents whose envelope intersects the envelope of geom
+        """
+        if self.tree is None:
+            return []
+        # Shapely >= 2.0 returns indices, older versions return the geometries
+        return sorted(self.positions[id(i)] if hasattr(i, 'geom_type') else int(i) for i in self.tree.query(geom))
+
+    def get_prepared(self, i):
+        if self.prepared[i] is None:
+            self.prepared[i] = shapely_prepared.prep(self.geoms[i])
+        return self.prepared[i]
+
+    def get_parent(self, geom):
+        """
+        :param geom:    the geometry of a feature
+        :return:        the code of its parent, None if it has none
+        """
+        if geom is None or geom.is_empty:
+            return None
+        if self.method == LARGEST_OVERLAP and geom.geom_type in AREAL_TYPES:
+            return self.get_largest_overlap_parent(geom)
+
+        point = geom.representative_point()
+        for i in self.candidates(point):
+            if self.get_prepared(i).intersects(point):
+                return self.codes[i]
+        return None
+
+    def get_largest_overlap_parent(self, geom):
+        """
+        :param geom:    an areal geometry
+        :return:        the code of the parent overlapping it the most, None if none overlaps it
+        """
+        parent = None
+        parent_area = 0.
+        for i in self.candidates(geom):
+            prepared = self.get_prepared(i)
+            if not prepared.intersects(geom):
+                continue
+            # A parent containing the geometry has the largest possible overlap
+            if prepared.contains(geom):
+                return self.codes[i]
+            area = self.geoms[i].intersection(geom).area
+            if area > parent_area:
+                parent = self.codes[i]
+                parent_area = area
+        return parent
+
+    def join(self, children):
+        """
+        :param children:    iterable of the (code, geometry) tuples of the features to join
+        :return:            the parent codes by child code, for the features having a parent
+        """
+        links = {}
+        for code, geom in children:
+            parent = self.get_parent(geom)
+            if parent is None:
+                self.stats["orphans"] += 1
+            else:
+                self.stats["joined"] += 1
+                links[code] = parent
+        return links
+
+
+class JoinCache(object):
+    """
+    On-disk cache of the results of the spatial joins, so that they are only computed again when a layer changes.
+
+    An entry is a JSON file of the parent codes by child code. Its key is computed from the size and mtime of the files
+    of the two shapefiles, as for the BboxCache, and from the settings of the join (code fields, method).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_entry_path(self, child_path, parent_path, settings):
+        """
+        :param child_path:  the path of the layer of the children
+        :param parent_path: the path of the layer of the parents
+        :param settings:    the JSON serializable settings of the join
+        :return:            the path of the cache entry
+        """
+        state = {
+            "files": [[(p, os.path.getsize(p), os.path.getmtime(p)) for p in get_shapefile_paths(path)]
+                      for path in (child_path, parent_path)],
+            "settings": settings,
+        }
+        if LAYER_NAME_SEPARATOR in child_path or LAYER_NAME_SEPARATOR in parent_path:
+            # Two layers of a single file have the same files state
+            state["layers"] = [child_path, parent_path]
+        key = hashlib.sha1(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+        names = [get_layer_label(path) for path in (child_path, parent_path)]
+        return os.path.join(self.cache_dir, u"join-{}-{}-{}.json".format(names[0], names[1], key[:16]))
+
+    def load(self, child_path, parent_path, settings):
+        """
+        :return:    the cached parent codes by child code, None if not cached
+        """
+        path = self.get_entry_path(child_path, parent_path, settings)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save(self, child_path, parent_path, settings, links):
+        """
+        :param links:   the parent codes by child code
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Written in a temporary file renamed at the end, so that an entry is always complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(links, f, sort_keys=True)
+            os.rename(tmp_path, self.get_entry_path(child_path, parent_path, settings))
+        except Exception:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+from array import array
+import heapq
+import os
+import os.path
+import pickle
+import shutil
+import sys
+import tempfile
+
+try:
+    intern = sys.intern
+except AttributeError:
+    # Python 2
+    intern = intern
+
+# Position of each coordinate in the 4 doubles of a bounding box
+BOUNDS_OFFSETS = {'lon_min': 0, 'lat_min': 1, 'lon_max': 2, 'lat_max': 3}
+
+# Estimated memory used by a territory of a TerritoryList, besides its strings: the references of its code, name and
+# attributes, its bounds and its position in the sort order
+TERRITORY_SIZE = 80
+
+# Maximal number of runs merged at once by a SpillingTerritoryList
+MAX_MERGED_RUNS = 64
+
+
+class Territory(object):
+    """
+    View on a territory of a TerritoryList, giving its values as attributes (terr.code, terr.lon_min...) to the
+    templates.
+    """
+
+    __slots__ = ('territories', 'position')
+
+    def __init__(self, territories, position):
+        self.territories = territories
+        self.position = position
+
+    def __getattr__(self, name):
+        return self.territories.get_value(self.position, name)
+
+
+class TerritoryList(object):
+    """
+    Territories stored in columns: the codes and names in lists, the codes being interned, the WGS84 bounding boxes in
+    an array of doubles, and the other attributes (region code, departement codes...) in lists created on first use.
+
+    The territories are iterated in the order they were added, or in the order of their codes once sorted. Sorting
+    only computes the order of the positions, the columns are not copied. The items are Territory views created on
+    the fly.
+    """
+
+    def __init__(self):
+        self.codes = []
+        self.names = []
+        self.bounds = array('d')
+        self.columns = {}
+        self.order = None
+
+    def append(self, code, name, lon_min, lat_min, lon_max, lat_max, **attributes):
+        """
+        Add a territory.
+
+        :param code:        the code of the territory
+        :param name:        its name
+        :param attributes:  its other attributes, None when missing
+        """
+        size = len(self.codes)
+        self.codes.append(intern(code) if isinstance(code, str) else code)
+        self.names.append(name)
+        self.bounds.extend((lon_min, lat_min, lon_max, lat_max))
+        for key, value in attributes.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [None] * size
+            column.append(intern(value) if isinstance(value, str) else value)
+        for column in self.columns.values():
+            if len(column) == size:
+                column.append(None)
+        self.order = None
+
+    def append_columns(self, codes, names, bounds, **attributes):
+        """
+        Add territories given as columns.
+
+        :param codes:       the list of the codes of the territories
+        :param names:       the list of their names
+        :param bounds:      the list of their (lon_min, lat_min, lon_max, lat_max) tuples
+        :param attributes:  the lists of the values of their other attributes
+        """
+        size = len(self.codes)
+        self.codes.extend(intern(code) if isinstance(code, str) else code for code in codes)
+        self.names.extend(names)
+        for box in bounds:
+            self.bounds.extend(box)
+        for key, values in attributes.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [None] * size
+            column.extend(intern(value) if isinstance(value, str) else value for value in values)
+        for column in self.columns.values():
+            if len(column) == size:
+                column.extend([None] * len(codes))
+        self.order = None
+
+    def extend(self, territories):
+        """
+        Add the territories of another TerritoryList, in the order they were added to it.
+        """
+        size = len(self.codes)
+        self.codes.extend(territories.codes)
+        self.names.extend(territories.names)
+        self.bounds.extend(territories.bounds)
+        for key in set(self.columns) | set(territories.columns):
+            column = self.columns.setdefault(key, [None] * size)
+            column.extend(territories.columns.get(key) or [None] * len(territories.codes))
+        self.order = None
+
+    def sort(self):
+        """
+        Sort the territories by code, keeping the order they were added for equal codes.
+        """
+        self.order = array('l', sorted(range(len(self.codes)), key=self.codes.__getitem__))
+
+    def records(self):
+        """
+        :return:    an iterator over the (code, name, lon_min, lat_min, lon_max, lat_max, attributes) tuples of the
+                    territories, in the order they are iterated
+        """
+        positions = self.order if self.order is not None else range(len(self.codes))
+        for position in positions:
+            attributes = dict((key, column[position]) for key, column in self.columns.items())
+            yield (self.codes[position], self.names[position]) + \
+                tuple(self.bounds[4 * position:4 * position + 4]) + (attributes,)
+
+    def close(self):
+        """
+        Nothing to release, the territories being in memory.
+        """
+
+    def get_value(self, position, name):
+        """
+        :param position:    the position of a territory in the columns
+        :param name:        the name of an attribute
+        :return:            the value of the attribute of the territory
+        """
+        if name == 'code':
+            return self.codes[position]
+        if name == 'name':
+            return self.names[position]
+        offset = BOUNDS_OFFSETS.get(name)
+        if offset is not None:
+            return self.bounds[4 * position + offset]
+        column = self.columns.get(name)
+        if column is None:
+            raise AttributeError(name)
+        return column[position]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.codes)
+        if not 0 <= index < len(self.codes):
+            raise IndexError(index)
+        return Territory(self, self.order[index] if self.order is not None else index)
+
+    def __iter__(self):
+        positions = self.order if self.order is not None else range(len(self.codes))
+        for position in positions:
+            yield Territory(self, position)
+
+
+class TerritoryRecord(object):
+    """
+    Territory read back from a run of a SpillingTerritoryList, giving its values as attributes to the templates.
+    """
+
+    __slots__ = ('code', 'name', 'lon_min', 'lat_min', 'lon_max', 'lat_max', 'attributes')
+
+    def __init__(self, code, name, lon_min, lat_min, lon_max, lat_max, attributes):
+        self.code = code
+        self.name = name
+        self.lon_min = lon_min
+        self.lat_min = lat_min
+        self.lon_max = lon_max
+        self.lat_max = lat_max
+        self.attributes = attributes
+
+    def __getattr__(self, name):
+        try:
+            return self.attributes[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class SpillingTerritoryList(object):
+    """
+    TerritoryList whose memory is bounded: once the estimated size of the territories in memory exceeds max_memory,
+    they are sorted by code and written as a run to a temporary file. When sorted, the last territories are spilled too
+    and the territories are iterated by merging the runs by code, each iteration reading the runs again. The
+    territories with equal codes are iterated in the order they were added, as with TerritoryList.
+
+    Without any run spilled, the territories are sorted and iterated in memory. close() removes the temporary files.
+    """
+
+    def __init__(self, max_memory, tmp_dir=None):
+        """
+        :param max_memory:  the maximal size in bytes of the territories kept in memory
+        :param tmp_dir:     the directory the temporary directory of the runs is created in, the default temporary
+                            directory of the system if None
+        """
+        self.max_memory = max_memory
+        self.tmp_dir = tmp_dir
+        self.runs_dir = None
+        self.runs = []
+        self.spilled_count = 0
+        self.territories = TerritoryList()
+        self.size = 0
+
+    def append(self, code, name, lon_min, lat_min, lon_max, lat_max, **attributes):
+        """
+        Add a territory, spilling the territories in memory if they exceed max_memory.
+        """
+        self.territories.append(code, name, lon_min, lat_min, lon_max, lat_max, **attributes)
+        self.size += TERRITORY_SIZE + sys.getsizeof(code) + sys.getsizeof(name) + \
+            sum(sys.getsizeof(value) for value in attributes.values())
+        if self.size > self.max_memory:
+            self.spill()
+
+    def append_columns(self, codes, names, bounds, **attributes):
+        """
+        Add territories given as columns, spilling the territories in memory if they exceed max_memory.
+        """
+        for i, code in enumerate(codes):
+            self.append(code, names[i], *bounds[i], **dict((key, values[i]) for key, values in attributes.items()))
+
+    def extend(self, territories):
+        """
+        Add the territories of a TerritoryList, in the order they were added to it.
+        """
+        for code, name, lon_min, lat_min, lon_max, lat_max, attributes in territories.records():
+            self.append(code, name, lon_min, lat_min, lon_max, lat_max, **attributes)
+
+    def spill(self):
+        """
+        Sort the territories in memory and write them as a run.
+        """
+        if not len(self.territories):
+            return
+        self.territories.sort()
+        self.runs.append(self.write_run(self.territories.records()))
+        self.spilled_count += len(self.territories)
+        self.territories = TerritoryList()
+        self.size = 0
+        if len(self.runs) >= MAX_MERGED_RUNS:
+            # Merge the runs into one to bound the number of files open at once
+            runs = self.runs
+            self.runs = [self.write_run(self.merge(runs))]
+            for run in runs:
+                os.remove(run)
+
+    def write_run(self, records):
+        """
+        :param records:     the records to write, sorted by code
+        :return:            the path of the run
+        """
+        if self.runs_dir is None:
+            self.runs_dir = tempfile.mkdtemp(prefix='thesaurus_runs_', dir=self.tmp_dir)
+        fd, path = tempfile.mkstemp(suffix='.run', dir=self.runs_dir)
+        with os.fdopen(fd, 'wb') as f:
+            for record in records:
+                # One pickle per record, so that the pickler does not keep a reference to every record written
+                f.write(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        return path
+
+    @staticmethod
+    def read_run(path, i):
+        """
+        :param path:    the path of a run
+        :param i:       the position of the run
+        :return:        an iterator over the (code, i, record) tuples of the records of the run
+        """
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    return
+                yield record[0], i, record
+
+    def merge(self, runs):
+        """
+        :param runs:    the paths of the runs, in the order they were written
+        :return:        an iterator over the records of the runs, by code
+        """
+        # The records with equal codes are taken from the first runs first
+        decorated = [self.read_run(path, i) for i, path in enumerate(runs)]
+        return (record for code, i, record in heapq.merge(*decorated))
+
+    def sort(self):
+        """
+        Sort the territories by code, spilling the last territories in memory if some runs were already written.
+        """
+        if self.runs:
+            self.spill()
+        else:
+            self.territories.sort()
+
+    def close(self):
+        """
+        Remove the runs.
+        """
+        if self.runs_dir is not None:
+            shutil.rmtree(self.runs_dir, ignore_errors=True)
+            self.runs_dir = None
+        self.runs = []
+
+    def __len__(self):
+        return self.spilled_count + len(self.territories)
+
+    def __iter__(self):
+        if not self.runs:
+            return iter(self.territories)
+        return (TerritoryRecord(*record) for record in self.merge(self.runs))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os.path
+import sys
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+# The modules of the builders are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LAMBERT_93 = "EPSG:2154"
+
+
+@pytest.fixture
+def write_shapefile(tmp_path):
+    """
+    :return:    a function writing a shapefile of polygons in the temporary directory of the test, taking its file name
+                and the list of the (properties, shapely geometry) tuples of its features (the properties being
+                strings), and returning its path
+    """
+    from shapely.geometry import mapping
+    import fiona
+
+    def write(file_name, features, crs=LAMBERT_93):
+        path = str(tmp_path / file_name)
+        schema = {'geometry': 'Polygon', 'properties': dict((field, 'str') for field in features[0][0])}
+        with fiona.open(path, 'w', driver='ESRI Shapefile', crs=crs, schema=schema) as layer:
+            for props, geom in features:
+                layer.write({'geometry': mapping(geom), 'properties': props})
+        return path
+    return write
+
+
+# A small ADMIN EXPRESS like dataset, in Lambert 93: 2 regions of 2 departements, each departement having 2 communes,
+# and 3 EPCI, the second one overlapping the departements 02 and 60
+ADE_REGIONS = [(u"11", u"Île-de-France", 600000), (u"32", u"Hauts-de-France", 700000)]
+ADE_DEPTS = [(u"75", u"Paris", u"11"), (u"77", u"Seine-et-Marne", u"11"), (u"02", u"Aisne", u"32"),
+             (u"60", u"Oise", u"32")]
+ADE_EPCI = [(u"200054781", u"Métropole du Grand Paris", 600000, 680000),
+            (u"200071991", u"Communauté de communes Aisne-Oise", 700000, 760000),
+            (u"246000871", u"Communauté d'agglomération du Beauvaisis", 760000, 800000)]
+ADE_Y_MIN = 6800000
+ADE_Y_MAX = 6900000
+
+
+@pytest.fixture
+def ade_config(tmp_path, write_shapefile):
+    """
+    :return:    the path of the config file of build_thesaurus_from_ade.py for the layers of the ADE_* dataset, written
+                in the temporary directory of the test
+    """
+    from shapely.geometry import box
+    import yaml
+
+    os.mkdir(str(tmp_path / u"ade"))
+    regions = [({'INSEE_REG': code, 'NOM_REG': name}, box(x, ADE_Y_MIN, x + 100000, ADE_Y_MAX))
+               for code, name, x in ADE_REGIONS]
+    depts = []
+    communes = []
+    for i, (code, name, reg_code) in enumerate(ADE_DEPTS):
+        x = 600000 + i * 50000
+        depts.append(({'INSEE_DEP': code, 'NOM_DEP': name, 'INSEE_REG': reg_code},
+                      box(x, ADE_Y_MIN, x + 50000, ADE_Y_MAX)))
+        for j in range(2):
+            communes.append(({'INSEE_COM': u"{}{:03d}".format(code, j + 1), 'NOM_COM': u"{} {}".format(name, j + 1),
+                              'INSEE_DEP': code, 'NOM_DEP': name},
+                             box(x + j * 25000, ADE_Y_MIN, x + (j + 1) * 25000, ADE_Y_MAX)))
+    epci = [({'CODE_EPCI': code, 'NOM_EPCI': name}, box(x_min, ADE_Y_MIN, x_max, ADE_Y_MAX))
+            for code, name, x_min, x_max in ADE_EPCI]
+    for file_name, features in ((u"REGION.shp", regions), (u"DEPARTEMENT.shp", depts), (u"COMMUNE.shp", communes),
+                                (u"EPCI.shp", epci)):
+        write_shapefile(os.path.join(u"ade", file_name), features)
+
+    cfg = {
+        'template_dir_name': 'templates',
+        'ade_dir_name': str(tmp_path / u"ade"),
+        'commune': {'shp': 'COMMUNE.shp', 'template': 'CommuneFR.xml', 'title': u"Communes", 'out': 'CommunesFR.rdf',
+                    'fields': {'nom': 'NOM_COM', 'code': 'INSEE_COM', 'nomdept': 'NOM_DEP', 'codedept': 'INSEE_DEP'}},
+        'departement': {'shp': 'DEPARTEMENT.shp', 'template': 'DepartementFR.xml', 'title': u"Départements",
+                        'out': 'DepartementFR.rdf',
+                        'fields': {'nom': 'NOM_DEP', 'code': 'INSEE_DEP', 'codereg': 'INSEE_REG'}},
+        'region': {'shp': 'REGION.shp', 'template': 'RegionFR.xml', 'title': u"Régions", 'out': 'RegionFR.rdf',
+                   'fields': {'nom': 'NOM_REG', 'code': 'INSEE_REG'}},
+        'epci': {'shp': 'EPCI.shp', 'template': 'EpciFR.xml', 'title': u"EPCI", 'out': 'EpciFR.rdf',
+                 'fields': {'nom': 'NOM_EPCI', 'code': 'CODE_EPCI'}},
+    }
+    cfg_path = str(tmp_path / u"config_ade.yml")
+    with open(cfg_path, 'w') as f:
+        yaml.safe_dump(cfg, f, allow_unicode=True)
+    return cfg_path
+
+
+def write_layer_files(tmp_path, name):
+    """
+    Write the files of a fake shapefile, whose content is only read by the caches keyed by the files of the layers.
+
+    :return:    the path of its .shp file
+    """
+    for ext in (u".shp", u".dbf", u".prj"):
+        with open(str(tmp_path / (name + ext)), 'w') as f:
+            f.write(u"{}{}".format(name, ext))
+    return str(tmp_path / (name + u".shp"))
+
+
+class CacheCase(object):
+    """
+    One of the on-disk caches keyed by the files of the layers, saving and looking up an entry for the sources of
+    layer_count layers.
+    """
+
+    def __init__(self, name, cache_dir, layer_count, save, is_cached, keyed_by_content=False):
+        """
+        :param name:                the name of the cache
+        :param cache_dir:           its directory
+        :param layer_count:         the number of layer sources of an entry
+        :param save:                function saving an entry for layer sources
+        :param is_cached:           function returning True if an entry is saved for layer sources
+        :param keyed_by_content:    True if the entries are keyed by the content of the files, False if by their size
+                                    and modification time
+        """
+        self.name = name
+        self.cache_dir = cache_dir
+        self.layer_count = layer_count
+        self.save = save
+        self.is_cached = is_cached
+        self.keyed_by_content = keyed_by_content
+
+
+@pytest.fixture(params=['bbox', 'join', 'filter_geometry'])
+def cache_case(request, tmp_path):
+    """
+    :return:    the CacheCase of each cache: the bounding boxes, spatial joins and filter geometries caches
+    """
+    cache_dir = str(tmp_path / u"cache")
+
+    if request.param == 'bbox':
+        from bbox_cache import BboxCache
+
+        cache = BboxCache(cache_dir)
+        fields = {'code': 'INSEE_COM'}
+
+        def save(source):
+            writer = cache.writer(source, fields, [None, 0.0])
+            writer.append({'INSEE_COM': u"01001"}, (4.90, 46.13, 4.96, 46.18))
+            writer.save()
+        return CacheCase(request.param, cache_dir, 1, save,
+                         lambda source: cache.load(source, fields, [None, 0.0]) is not None)
+
+    if request.param == 'join':
+        from spatial_join import REPRESENTATIVE_POINT
+        from spatial_join import JoinCache
+
+        cache = JoinCache(cache_dir)
+        settings = ["INSEE_COM", "CODE_EPCI", REPRESENTATIVE_POINT]
+        return CacheCase(request.param, cache_dir, 2,
+                         lambda child, parent: cache.save(child, parent, settings, {u"80021": u"200070993"}),
+                         lambda child, parent: cache.load(child, parent, settings) is not None)
+
+    from shapely.geometry import box
+    from filter_geometry import FilterGeometryCache
+
+    cache = FilterGeometryCache(cache_dir)
+    return CacheCase(request.param, cache_dir, 1,
+                     lambda source: cache.write(cache.get_entry_path(source) + u".wkb", box(0, 0, 1, 1)),
+                     lambda source: cache.read(cache.get_entry_path(source) + u".wkb") is not None,
+                     keyed_by_content=True)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+import re
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from batch import PartitionIndex
+from batch import check_batch_name
+from batch import parse_batches
+from batch import parse_dept_filter
+
+
+class Terr(object):
+
+    def __init__(self, code, dept_keys):
+        self.code = code
+        self.dept_keys = dept_keys
+
+
+def territories():
+    """
+    :return:    territories sorted by code: in one departement, on the two sides of the boundary of 02 and 60, and
+                in none
+    """
+    return [Terr(u"1", {u"02", u"aisne"}), Terr(u"2", {u"02", u"aisne", u"60", u"oise"}), Terr(u"3", set()),
+            Terr(u"4", {u"60", u"oise"}), Terr(u"5", {u"75", u"paris"})]
+
+
+def codes(terr_list):
+    return [terr.code for terr in terr_list]
+
+
+def test_partition_index():
+    index = PartitionIndex(territories())
+    assert index.index == {u"02": [0, 1], u"aisne": [0, 1], u"60": [1, 3], u"oise": [1, 3], u"75": [4],
+                           u"paris": [4]}
+    assert codes(index.select([u"02"])) == [u"1", u"2"]
+    assert codes(index.select([u"oise"])) == [u"2", u"4"]
+    # A territory of several departements of the filter is selected once, in the order of the codes
+    assert codes(index.select([u"75", u"oise", u"02", u"aisne"])) == [u"1", u"2", u"4", u"5"]
+    assert codes(index.select([u"80"])) == []
+    assert codes(index.select([])) == [u"1", u"2", u"3", u"4", u"5"]
+
+
+def test_parse_batches():
+    assert parse_dept_filter(u"  02,    oise, SOMME") == [u"02", u"oise", u"somme"]
+    assert parse_batches([u"picardie=02,60,80", u" idf =75"]) == {u"picardie": u"02,60,80", u"idf": u"75"}
+    for value in (u"picardie", u"=02", u"picardie=", u"../picardie=02", u"a/b=02"):
+        with pytest.raises(ValueError):
+            parse_batches([value])
+
+
+def test_check_batch_name():
+    check_batch_name(u"Hauts-de-France_2024")
+    for name in (u"..", u"a b", u"a/b", u""):
+        with pytest.raises(ValueError):
+            check_batch_name(name)
+
+
+def build(output_dir, ade_config, **options):
+    """
+    :return:    the dict of the contents of the files created in output_dir, by path relative to it
+    """
+    from build_thesaurus_from_ade import AdeThesauriBuilder
+
+    os.mkdir(output_dir)
+    AdeThesauriBuilder(verbose=False, overwrite=True, compact=False, thesaurus=(), output_dir=output_dir,
+                       cfg_path=ade_config, **options).create_thesauri()
+    contents = {}
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        for name in file_names:
+            if name.endswith(u".rdf"):
+                path = os.path.join(dir_path, name)
+                with open(path, 'rb') as f:
+                    contents[os.path.relpath(path, output_dir)] = f.read()
+    return contents
+
+
+BATCHES = {u"idf": u"75,77", u"aisne": u"02", u"oise": u"Oise"}
+
+
+def test_batches_as_departements_filters(tmp_path, ade_config):
+    batches = build(str(tmp_path / u"batches"), ade_config, batches=BATCHES)
+    assert sorted(set(os.path.dirname(path) for path in batches)) == sorted(BATCHES)
+
+    epci = dict((name, re.findall(r'rdf:about="[^"]*#EPCI_([^"]+)"', batches[os.path.join(name, u"EpciFR.rdf")]
+                                  .decode("utf-8"))) for name in BATCHES)
+    # The EPCI across the boundary of 02 and 60 is in both batches, the others in one batch
+    assert epci == {u"idf": [u"200054781"], u"aisne": [u"200071991"], u"oise": [u"200071991", u"246000871"]}
+
+    # Each batch has the files of a build with its departements filter
+    for name, dept_filter in BATCHES.items():
+        filtered = build(str(tmp_path / name), ade_config, dept_filter=dept_filter)
+        assert len(filtered) == 4
+        for path, content in filtered.items():
+            assert batches[os.path.join(name, path)] == content, path
+
+
+def test_batch_per_dept(tmp_path, ade_config):
+    batches = build(str(tmp_path / u"batches"), ade_config, batch_per_dept=True, dept_filter=u"aisne,60")
+    assert sorted(set(os.path.dirname(path) for path in batches)) == [u"02", u"60"]
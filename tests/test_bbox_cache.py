@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from bbox_cache import BboxCache
+from conftest import write_layer_files
+
+FIELDS = {'code': 'INSEE_COM', 'name': 'NOM_COM'}
+SETTINGS = [None, 0.0]
+FEATURES = [
+    ({'INSEE_COM': u"01001", 'NOM_COM': u"L'Abergement-Clémenciat"}, (4.90, 46.13, 4.96, 46.18)),
+    ({'INSEE_COM': u"01002", 'NOM_COM': u"L'Abergement-de-Varey"}, None),
+    ({'INSEE_COM': u"01004", 'NOM_COM': None}, (5.33, 45.92, 5.41, 46.00)),
+]
+
+
+def fill(cache, layer_path, fields=FIELDS, settings=SETTINGS):
+    writer = cache.writer(layer_path, fields, settings)
+    for props, bounds in FEATURES:
+        writer.append(props, bounds)
+    writer.save()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return BboxCache(str(tmp_path / u"cache"))
+
+
+def test_cached_rows(tmp_path, cache):
+    layer_path = write_layer_files(tmp_path, u"communes")
+    assert cache.load(layer_path, FIELDS, SETTINGS) is None
+    fill(cache, layer_path)
+
+    cached = cache.load(layer_path, FIELDS, SETTINGS)
+    assert len(cached) == 3
+    rows = list(cached.rows())
+    # The positions of the features are kept, an empty geometry having no bounds
+    assert [props for props, bounds in rows] == [
+        {'INSEE_COM': u"01001", 'NOM_COM': u"L'Abergement-Clémenciat"},
+        {'INSEE_COM': u"01002", 'NOM_COM': u"L'Abergement-de-Varey"},
+        {'INSEE_COM': u"01004", 'NOM_COM': u""},
+    ]
+    assert [bounds for props, bounds in rows] == [FEATURES[0][1], None, FEATURES[2][1]]
+    assert [props['INSEE_COM'] for props, bounds in cached.rows(1, 3)] == [u"01002", u"01004"]
+
+    columns = cached.select(1)
+    assert len(columns) == 2
+    assert list(columns['INSEE_COM']) == [u"01002", u"01004"]
+    assert columns.bounds.shape == (2, 4)
+
+
+def test_other_fields_or_settings(tmp_path, cache):
+    layer_path = write_layer_files(tmp_path, u"communes")
+    fill(cache, layer_path)
+    assert cache.load(layer_path, dict(FIELDS, dept='INSEE_DEP'), SETTINGS) is None
+    assert cache.load(layer_path, {'code': 'INSEE_COM', 'name': 'NOM'}, SETTINGS) is None
+    assert cache.load(layer_path, FIELDS, ["EPSG:2154", 0.0]) is None
+    assert cache.load(layer_path, FIELDS, [None, 10.0]) is None
+    assert cache.load(layer_path, FIELDS, SETTINGS) is not None
+
+
+def test_filled_entry_is_replaced(tmp_path, cache):
+    layer_path = write_layer_files(tmp_path, u"communes")
+    fill(cache, layer_path)
+    writer = cache.writer(layer_path, FIELDS, SETTINGS)
+    writer.append(FEATURES[0][0], FEATURES[0][1])
+    writer.save()
+    assert len(cache.load(layer_path, FIELDS, SETTINGS)) == 1
+    # No temporary directory left
+    assert len(os.listdir(cache.cache_dir)) == 1
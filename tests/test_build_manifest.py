@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from build_manifest import MANIFEST_FILE_NAME
+from build_manifest import BuildManifest
+from build_manifest import get_layers_inputs
+from utils import get_layer_source
+
+SETTINGS = {"config": {"shp": "communes.shp", "template": "CommuneFR.xml"}, "compact": False}
+
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def build(tmp_path):
+    """
+    :return:    the (input files, output path) tuple of a thesaurus just built and recorded in the manifest of its
+                output directory
+    """
+    input_files = [str(tmp_path / u"communes.shp"), str(tmp_path / u"communes.dbf")]
+    write_file(input_files[0], u"geometries")
+    write_file(input_files[1], u"attributes")
+    output_path = str(tmp_path / u"CommunesFR.rdf")
+    write_file(output_path, u"thesaurus")
+    BuildManifest(str(tmp_path)).record("commune", input_files, SETTINGS, output_path)
+    return input_files, output_path
+
+
+def is_up_to_date(tmp_path, input_files, output_path, settings=SETTINGS):
+    # A new manifest, as read by the next build
+    return BuildManifest(str(tmp_path)).is_up_to_date("commune", input_files, settings, output_path)
+
+
+def test_up_to_date_after_record(tmp_path, build):
+    input_files, output_path = build
+    assert os.path.isfile(str(tmp_path / MANIFEST_FILE_NAME))
+    assert is_up_to_date(tmp_path, input_files, output_path)
+
+
+def test_not_recorded(tmp_path, build):
+    input_files, output_path = build
+    assert not BuildManifest(str(tmp_path)).is_up_to_date("departement", input_files, SETTINGS, output_path)
+
+
+def test_changed_input_content(tmp_path, build):
+    input_files, output_path = build
+    # Same size: the content is hashed
+    write_file(input_files[1], u"Attributes")
+    assert not is_up_to_date(tmp_path, input_files, output_path)
+
+
+def test_touched_input(tmp_path, build):
+    input_files, output_path = build
+    stat = os.stat(input_files[0])
+    os.utime(input_files[0], (stat.st_atime + 10, stat.st_mtime + 10))
+    assert is_up_to_date(tmp_path, input_files, output_path)
+    # The new mtime is recorded, so that the file is not hashed again
+    manifest = BuildManifest(str(tmp_path))
+    assert manifest.thesauri["commune"]["files"][input_files[0]]["mtime"] == stat.st_mtime + 10
+
+
+def test_changed_settings(tmp_path, build):
+    input_files, output_path = build
+    settings = dict(SETTINGS, compact=True)
+    assert not is_up_to_date(tmp_path, input_files, output_path, settings)
+    manifest = BuildManifest(str(tmp_path))
+    assert not manifest.has_settings("commune", settings, output_path)
+    assert manifest.has_settings("commune", SETTINGS, output_path)
+
+
+def test_changed_input_files(tmp_path, build):
+    input_files, output_path = build
+    prj_path = str(tmp_path / u"communes.prj")
+    write_file(prj_path, u"projection")
+    assert not is_up_to_date(tmp_path, input_files + [prj_path], output_path)
+    os.remove(input_files[1])
+    assert not is_up_to_date(tmp_path, input_files, output_path)
+
+
+def test_removed_output(tmp_path, build):
+    input_files, output_path = build
+    os.remove(output_path)
+    assert not is_up_to_date(tmp_path, input_files, output_path)
+
+
+def test_other_output_path(tmp_path, build):
+    input_files, output_path = build
+    other_path = output_path + u".gz"
+    write_file(other_path, u"thesaurus")
+    assert not is_up_to_date(tmp_path, input_files, other_path)
+
+
+def test_invalid_manifest_is_ignored(tmp_path, build):
+    input_files, output_path = build
+    write_file(str(tmp_path / MANIFEST_FILE_NAME), u"{not json")
+    assert BuildManifest(str(tmp_path)).thesauri == {}
+    assert not is_up_to_date(tmp_path, input_files, output_path)
+
+
+def test_layers_inputs(tmp_path):
+    for ext in (u".shp", u".shx", u".dbf", u".prj"):
+        write_file(str(tmp_path / (u"communes" + ext)), u"")
+    gpkg_path = str(tmp_path / u"ade.gpkg")
+    sources = [get_layer_source(gpkg_path, u"region"), get_layer_source(gpkg_path, u"departement")]
+    files, layers = get_layers_inputs([str(tmp_path / u"communes.shp")] + sources)
+    assert files == [str(tmp_path / (u"communes" + ext)) for ext in (u".shp", u".shx", u".dbf", u".prj")] + \
+        [gpkg_path]
+    assert layers == sources
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from conftest import write_layer_files
+from utils import get_layer_source
+
+
+@pytest.fixture
+def layers(tmp_path, cache_case):
+    """
+    :return:    the paths of the layers of the entry saved in the cache
+    """
+    paths = [write_layer_files(tmp_path, name) for name in (u"communes", u"epci")[:cache_case.layer_count]]
+    cache_case.save(*paths)
+    return paths
+
+
+def test_cached_entry(cache_case, layers):
+    assert cache_case.is_cached(*layers)
+    # No temporary file left
+    assert len(os.listdir(cache_case.cache_dir)) == 1
+
+
+@pytest.mark.parametrize('ext', [u".shp", u".dbf", u".prj"])
+def test_changed_layer_file(cache_case, layers, ext):
+    for path in layers:
+        cache_case.save(*layers)
+        with open(os.path.splitext(path)[0] + ext, 'a') as f:
+            f.write(u"changed")
+        assert not cache_case.is_cached(*layers)
+
+
+def test_added_layer_file(cache_case, layers):
+    with open(os.path.splitext(layers[-1])[0] + u".cpg", 'w') as f:
+        f.write(u"UTF-8")
+    assert not cache_case.is_cached(*layers)
+
+
+def test_touched_layer_file(cache_case, layers):
+    for path in layers:
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime + 10, stat.st_mtime + 10))
+    # The entries keyed by the content of the files are still valid
+    assert cache_case.is_cached(*layers) == cache_case.keyed_by_content
+
+
+def test_layers_of_a_file(tmp_path, cache_case):
+    gpkg_path = str(tmp_path / u"ade.gpkg")
+    with open(gpkg_path, 'w') as f:
+        f.write(u"layers")
+    sources = [get_layer_source(gpkg_path, name) for name in (u"departement", u"region")[:cache_case.layer_count]]
+    cache_case.save(*sources)
+    assert cache_case.is_cached(*sources)
+    assert not cache_case.is_cached(*([get_layer_source(gpkg_path, u"commune")] + sources[1:]))
+
+
+def write_shp_config(tmp_path, thesauri):
+    """
+    :return:    the path of the config file of build_thesaurus_from_simple_shp.py for the thesauri, as a dict of the
+                (shapefile path, parent thesauri) tuples by name
+    """
+    import yaml
+
+    cfg_path = str(tmp_path / u"config.yml")
+    cfg = {'template_dir_name': 'templates', 'thesauri': {}}
+    for name, (shp_path, parents) in thesauri.items():
+        cfg['thesauri'][name] = {
+            'shp': shp_path, 'fields': {'name': 'nom', 'code': 'code'}, 'template': 'other.xml',
+            'uri_scheme': u"http://example.org/{}".format(name), 'title': name, 'out': u"{}.rdf".format(name)}
+        if parents:
+            cfg['thesauri'][name]['parents'] = [{'thesaurus': parent} for parent in parents]
+    with open(cfg_path, 'w') as f:
+        f.write(yaml.safe_dump(cfg))
+    return cfg_path
+
+
+class BuilderCase(object):
+    """
+    A build reading one of the caches: its output, the cache entries, and the change of one of its layers.
+    """
+
+    def __init__(self, build, entry_prefix, change, expected, changed):
+        """
+        :param build:           function building the thesauri and returning the content of the output checked
+        :param entry_prefix:    the prefix of the names of the cache entries
+        :param change:          function changing the layer the entries depend on
+        :param expected:        text of the output before the change
+        :param changed:         text of the output after the change
+        """
+        self.build = build
+        self.entry_prefix = entry_prefix
+        self.change = change
+        self.expected = expected
+        self.changed = changed
+
+
+@pytest.fixture(params=['bbox', 'join', 'filter_geometry'])
+def builder_case(request, tmp_path, write_shapefile):
+    from shapely.geometry import box
+
+    output_dir = str(tmp_path / u"out")
+    os.mkdir(output_dir)
+    cache_dir = str(tmp_path / u"cache")
+
+    if request.param == 'filter_geometry':
+        from build_thesaurus_from_ade import AdeThesauriBuilder
+
+        ade_config = request.getfixturevalue('ade_config')
+
+        def write_filter(x_min, x_max):
+            return write_shapefile(u"filtre.shp", [({'id': u"1"}, box(x_min, 6810000, x_max, 6890000))])
+        filter_path = write_filter(705000, 720000)
+
+        def build():
+            AdeThesauriBuilder(verbose=False, overwrite=True, compact=False, thesaurus=(u"commune",),
+                               output_dir=output_dir, cfg_path=ade_config, filter_shp_path=filter_path,
+                               cache_dir=cache_dir).create_thesauri()
+            with open(os.path.join(output_dir, u"CommunesFR.rdf"), 'rb') as f:
+                return f.read().decode("utf-8")
+        return BuilderCase(build, u"filtre-", lambda: write_filter(730000, 740000), u"#COM_02001", u"#COM_02002")
+
+    from build_thesaurus_from_simple_shp import ShpThesauriBuilder
+
+    def write_zones(codes, name):
+        return write_shapefile(u"zones.shp", [({'code': code, 'nom': u"{} {}".format(name, code)},
+                                               box(700000 + i * 10000, 6600000, 710000 + i * 10000, 6610000))
+                                              for i, code in enumerate(codes)])
+    zones_path = write_zones([u"Z1", u"Z2"], u"Zone")
+    if request.param == 'bbox':
+        cfg_path = write_shp_config(tmp_path, {'zones': (zones_path, [])})
+        output_name = u"zones.rdf"
+        entry_prefix = u"zones-"
+    else:
+        communes_path = write_shapefile(u"communes.shp", [({'code': u"C1", 'nom': u"Commune 1"},
+                                                           box(701000, 6601000, 702000, 6602000))])
+        cfg_path = write_shp_config(tmp_path, {'communes': (communes_path, ['zones']), 'zones': (zones_path, [])})
+        output_name = u"communes.rdf"
+        entry_prefix = u"join-"
+
+    def build():
+        ShpThesauriBuilder(verbose=False, overwrite=True, compact=False, output_dir=output_dir, cfg_path=cfg_path,
+                           cache_dir=cache_dir).create_thesauri()
+        with open(os.path.join(output_dir, output_name), 'rb') as f:
+            return f.read().decode("utf-8")
+    if request.param == 'bbox':
+        return BuilderCase(build, entry_prefix, lambda: write_zones([u"Z1", u"Z2"], u"Zone Un"), u"Zone Z1",
+                           u"Zone Un Z1")
+    return BuilderCase(build, entry_prefix, lambda: write_zones([u"Z3", u"Z4"], u"Zone"),
+                       u'<skos:broader rdf:resource="http://example.org/zones#Z1"/>',
+                       u'<skos:broader rdf:resource="http://example.org/zones#Z3"/>')
+
+
+def test_builder_reads_a_changed_layer_again(tmp_path, builder_case):
+    cache_dir = str(tmp_path / u"cache")
+
+    def entries():
+        return sorted(e for e in os.listdir(cache_dir) if e.startswith(builder_case.entry_prefix))
+
+    assert builder_case.expected in builder_case.build()
+    cached = entries()
+    assert len(cached) >= 1
+    # Read from the cache
+    assert builder_case.expected in builder_case.build()
+    assert entries() == cached
+
+    builder_case.change()
+    output = builder_case.build()
+    assert builder_case.changed in output
+    assert builder_case.expected not in output
+    assert len(entries()) > len(cached)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import json
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from delta import DeltaOutput
+from delta import get_changeset_path
+
+HEADER = u"""<?xml version="1.0" encoding="UTF-8"?>
+<rdf:RDF xmlns:dcterms="http://purl.org/dc/terms/" xmlns:gml="http://www.opengis.net/gml#"
+         xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:skos="http://www.w3.org/2004/02/skos/core#">
+  <skos:ConceptScheme rdf:about="http://example.org/scheme">
+    <dcterms:issued>{date}</dcterms:issued>
+  </skos:ConceptScheme>
+"""
+CONCEPT = u"""  <skos:Concept rdf:about="http://example.org/scheme#{code}">
+    <skos:prefLabel xml:lang="fr">{name}</skos:prefLabel>
+    <gml:lowerCorner>{bbox[0]} {bbox[1]}</gml:lowerCorner>
+    <gml:upperCorner>{bbox[2]} {bbox[3]}</gml:upperCorner>
+    <skos:inScheme rdf:resource="http://example.org/scheme"/>
+  </skos:Concept>
+"""
+FOOTER = u"</rdf:RDF>\n"
+
+CONCEPTS = [
+    (u"01", u"Ain", (4.7, 45.6, 6.2, 46.5)),
+    (u"02", u"Aisne", (3.1, 48.8, 4.3, 50.1)),
+    (u"03", u"Allier", (2.3, 45.9, 4.0, 46.8)),
+]
+
+
+def write_concepts(concepts, date=u"2024-01-31"):
+    def write(f):
+        f.write(HEADER.format(date=date))
+        for code, name, bbox in concepts:
+            f.write(CONCEPT.format(code=code, name=name, bbox=bbox))
+        f.write(FOOTER)
+    return write
+
+
+def build(path, concepts, replace=False, compression=None, **kwargs):
+    delta_output = DeltaOutput(u"test", path, compression)
+    try:
+        delta_output.write(write_concepts(concepts, **kwargs))
+        return delta_output.apply(replace)
+    finally:
+        delta_output.close()
+
+
+def read_changeset(path):
+    with open(get_changeset_path(path)) as f:
+        return json.load(f)
+
+
+def test_changeset_path():
+    assert get_changeset_path(os.path.join(u"out", u"CommunesFR.rdf.gz")) == \
+        os.path.join(u"out", u"CommunesFR.changeset.json")
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_same_concepts_leave_the_file_unchanged(tmp_path, compression):
+    path = str(tmp_path / u"test.rdf")
+    changeset, updated = build(path, CONCEPTS, compression=compression)
+    assert updated
+    # The concept scheme and the concepts
+    assert len(changeset.added) == 4
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    # The build date is not compared
+    changeset, updated = build(path, CONCEPTS, compression=compression, date=u"2024-02-01")
+    assert not updated
+    assert changeset.is_empty()
+    assert changeset.report() == u"0 added, 0 removed, 0 modified, 4 unchanged"
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert os.stat(path).st_mtime_ns == mtime
+    assert read_changeset(path)["updated"] is False
+    # The temporary file is removed
+    assert sorted(os.listdir(str(tmp_path))) == [u"test.changeset.json", u"test.rdf"]
+
+
+def test_changed_concepts_replace_the_file(tmp_path):
+    path = str(tmp_path / u"test.rdf")
+    build(path, CONCEPTS)
+
+    concepts = [
+        (u"01", u"Ain", (4.7, 45.6, 6.2, 46.5)),
+        (u"02", u"Aisne (02)", (3.1, 48.8, 4.3, 50.1)),
+        (u"04", u"Alpes-de-Haute-Provence", (5.5, 43.7, 7.0, 44.7)),
+    ]
+    changeset, updated = build(path, concepts)
+    assert updated
+    assert [added["uri"] for added in changeset.added] == [u"http://example.org/scheme#04"]
+    assert changeset.removed == [u"http://example.org/scheme#03"]
+    assert changeset.modified == [{"uri": u"http://example.org/scheme#02", "label": [u"Aisne", u"Aisne (02)"]}]
+    with open(path) as f:
+        assert u"Alpes-de-Haute-Provence" in f.read()
+
+    saved = read_changeset(path)
+    assert saved["updated"] is True
+    assert saved["previous_count"] == 4
+    assert saved["count"] == 4
+    assert saved["previous_error"] is None
+
+
+def test_bbox_change_is_a_modification(tmp_path):
+    path = str(tmp_path / u"test.rdf")
+    build(path, CONCEPTS)
+    concepts = CONCEPTS[:2] + [(u"03", u"Allier", (2.3, 45.9, 4.0, 46.9))]
+    changeset, updated = build(path, concepts)
+    assert updated
+    assert changeset.modified == [{"uri": u"http://example.org/scheme#03",
+                                   "bbox": [[2.3, 45.9, 4.0, 46.8], [2.3, 45.9, 4.0, 46.9]]}]
+
+
+def test_replace_rewrites_an_unchanged_file(tmp_path):
+    path = str(tmp_path / u"test.rdf")
+    build(path, CONCEPTS)
+    # E.g. written with other settings: the resources did not change but the file is replaced
+    changeset, updated = build(path, CONCEPTS, replace=True, date=u"2024-02-01")
+    assert updated
+    assert changeset.is_empty()
+    with open(path) as f:
+        assert u"2024-02-01" in f.read()
+
+
+def test_unreadable_previous_version(tmp_path):
+    path = str(tmp_path / u"test.rdf")
+    with open(path, 'w') as f:
+        f.write(u"not a thesaurus")
+    changeset, updated = build(path, CONCEPTS)
+    assert updated
+    assert len(changeset.added) == 4
+    assert read_changeset(path)["previous_error"]
+
+
+def build_thesauri(tmp_path, cfg_path, **options):
+    from build_thesaurus_from_simple_shp import ShpThesauriBuilder
+    builder = ShpThesauriBuilder(verbose=False, overwrite=False, output_dir=str(tmp_path / u"out"),
+                                 cfg_path=cfg_path, **options)
+    builder.create_thesauri()
+
+
+def test_builder_replaces_a_thesaurus_written_with_other_settings(tmp_path, write_shapefile):
+    from shapely.geometry import box
+    import yaml
+
+    shp_path = write_shapefile(u"zones.shp", [({'code': u"Z{}".format(i), 'nom': u"Zone {}".format(i)},
+                                               box(700000 + i * 1000, 6600000, 701000 + i * 1000, 6601000))
+                                              for i in range(3)])
+    cfg_path = str(tmp_path / u"config.yml")
+    with open(cfg_path, 'w') as f:
+        f.write(yaml.safe_dump({
+            'template_dir_name': 'templates',
+            'thesauri': {'zones': {'shp': shp_path, 'fields': {'name': 'nom', 'code': 'code'}, 'template': 'other.xml',
+                                   'uri_scheme': u"http://example.org/zones", 'title': u"Zones", 'out': 'zones.rdf'}},
+        }))
+    os.mkdir(str(tmp_path / u"out"))
+    rdf_path = str(tmp_path / u"out" / u"zones.rdf")
+
+    build_thesauri(tmp_path, cfg_path, compact=False, delta=True)
+    with open(rdf_path) as f:
+        assert len(f.read().splitlines()) > 1
+
+    # Same concepts, but the file must be compact
+    build_thesauri(tmp_path, cfg_path, compact=True, delta=True)
+    assert read_changeset(rdf_path)["updated"] is True
+    with open(rdf_path) as f:
+        assert len(f.read().splitlines()) == 1
+
+    build_thesauri(tmp_path, cfg_path, compact=True, delta=True)
+    assert read_changeset(rdf_path)["updated"] is False
+
+    # The manifest records the settings of the file: an incremental build without --compact rebuilds it
+    build_thesauri(tmp_path, cfg_path, compact=False, incremental=True)
+    with open(rdf_path) as f:
+        assert len(f.read().splitlines()) > 1
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+import filter_geometry
+from filter_geometry import FilterGeometryCache
+from filter_geometry import load_filter_geometry
+from utils import get_layer_source
+
+TOLERANCE = 100.0
+
+
+@pytest.fixture
+def squares(write_shapefile):
+    """
+    :return:    a function writing the filter shapefile, made of adjacent 10 km squares, and returning its path
+    """
+    from shapely.geometry import box
+
+    def write(count=2):
+        return write_shapefile(u"filtre.shp", [({'id': u"{}".format(i)}, box(i * 10000, 0, (i + 1) * 10000, 10000))
+                                               for i in range(count)])
+    return write
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    :return:    the list of the paths of the filter shapefiles read
+    """
+    paths = []
+
+    def get_geometry_from_file(path):
+        paths.append(path)
+        return read_geometry(path)
+    read_geometry = filter_geometry.get_geometry_from_file
+    monkeypatch.setattr(filter_geometry, 'get_geometry_from_file', get_geometry_from_file)
+    return paths
+
+
+def test_union_and_approximations(squares):
+    from shapely.geometry import box
+
+    filter_geom = load_filter_geometry(squares(), tolerance=TOLERANCE)
+    assert filter_geom.geom.equals(box(0, 0, 20000, 10000))
+    assert filter_geom.outer.contains(filter_geom.geom)
+    assert filter_geom.geom.contains(filter_geom.inner)
+    assert not filter_geom.inner.intersects(filter_geom.geom.boundary)
+
+    # No approximation without a tolerance
+    filter_geom = load_filter_geometry(squares())
+    assert filter_geom.outer is None and filter_geom.inner is None
+
+
+def test_thin_geometry_has_no_inner_approximation(write_shapefile):
+    from shapely.geometry import box
+
+    path = write_shapefile(u"filtre.shp", [({'id': u"0"}, box(0, 0, 10000, 2 * TOLERANCE))])
+    filter_geom = load_filter_geometry(path, tolerance=TOLERANCE)
+    assert filter_geom.outer is not None
+    assert filter_geom.inner is None
+
+
+def test_cached_geometries(tmp_path, squares, reads):
+    cache_dir = str(tmp_path / u"cache")
+    path = squares()
+    expected = load_filter_geometry(path, tolerance=TOLERANCE)
+    del reads[:]
+
+    filter_geom = load_filter_geometry(path, cache_dir, TOLERANCE)
+    assert reads == [path]
+    cached = load_filter_geometry(path, cache_dir, TOLERANCE)
+    assert reads == [path]
+    for geom in (filter_geom, cached):
+        assert geom.geom.equals(expected.geom)
+        assert geom.outer.equals(expected.outer)
+        assert geom.inner.equals(expected.inner)
+    # The union and its two approximations, without temporary file
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_changed_filter_file(tmp_path, squares, reads):
+    from shapely.geometry import box
+
+    cache_dir = str(tmp_path / u"cache")
+    path = squares(2)
+    load_filter_geometry(path, cache_dir, TOLERANCE)
+    path = squares(3)
+    filter_geom = load_filter_geometry(path, cache_dir, TOLERANCE)
+    assert reads == [path, path]
+    assert filter_geom.geom.equals(box(0, 0, 30000, 10000))
+    assert filter_geom.outer.contains(filter_geom.geom)
+
+
+def test_other_tolerance(tmp_path, squares, reads):
+    cache_dir = str(tmp_path / u"cache")
+    path = squares()
+    coarse = load_filter_geometry(path, cache_dir, TOLERANCE)
+    fine = load_filter_geometry(path, cache_dir, TOLERANCE / 10)
+    # The union is read once, the approximations computed for each tolerance
+    assert reads == [path]
+    assert len(os.listdir(cache_dir)) == 5
+    assert fine.outer.area < coarse.outer.area
+    assert fine.inner.area > coarse.inner.area
+    # No approximation without a tolerance, the union being cached
+    assert load_filter_geometry(path, cache_dir).outer is None
+    assert reads == [path]
+
+
+def test_entry_path_of_a_layer(tmp_path):
+    gpkg_path = str(tmp_path / u"filtres.gpkg")
+    with open(gpkg_path, 'w') as f:
+        f.write(u"layers")
+    cache = FilterGeometryCache(str(tmp_path / u"cache"))
+    entry_path = cache.get_entry_path(get_layer_source(gpkg_path, u"zone_a"))
+    assert os.path.basename(entry_path).startswith(u"filtres-zone_a-")
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+import re
+
+from hierarchy import HierarchyIndex
+
+DEPTS = [{'dept_code': u"02", 'dept_name': u"Aisne", 'reg_code': u"32", 'geometry': None},
+         {'dept_code': u"75", 'dept_name': u"Paris", 'reg_code': u"11", 'geometry': None},
+         {'dept_code': u"60", 'dept_name': u"Oise", 'reg_code': u"32", 'geometry': None}]
+
+
+def test_departements_and_regions():
+    hierarchy = HierarchyIndex(DEPTS)
+    assert hierarchy.get_dept(u"60") == {'dept_code': u"60", 'dept_name': u"Oise", 'reg_code': u"32"}
+    assert hierarchy.get_dept(u"oise") is hierarchy.get_dept(u"60")
+    assert hierarchy.get_dept(u"Oise") is None
+    assert hierarchy.get_region_depts(u"32") == [u"02", u"60"]
+    assert hierarchy.get_region_depts(u"84") == []
+    assert hierarchy.get_region_dept_keys(u"32") == {u"02", u"aisne", u"60", u"oise"}
+
+
+def test_communes_of_departements():
+    hierarchy = HierarchyIndex(DEPTS)
+    assert not hierarchy.has_communes()
+    assert hierarchy.get_dept_communes(u"02") == []
+
+    hierarchy.add_communes([(u"02002", u"02"), (u"75056", u"75"), (u"02001", u"02")])
+    assert hierarchy.has_communes()
+    assert hierarchy.get_dept_communes(u"02") == [u"02001", u"02002"]
+    assert hierarchy.get_dept_communes(u"60") == []
+
+
+def build(tmp_path, ade_config, thesaurus, dept_filter=None):
+    """
+    :return:    the dict of the contents of the RDF files created by build_thesaurus_from_ade.py, by file name
+    """
+    from build_thesaurus_from_ade import AdeThesauriBuilder
+
+    output_dir = str(tmp_path / u"out")
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir)
+    AdeThesauriBuilder(verbose=False, overwrite=True, compact=False, thesaurus=thesaurus, output_dir=output_dir,
+                       cfg_path=ade_config, dept_filter=dept_filter).create_thesauri()
+    contents = {}
+    for name in os.listdir(output_dir):
+        if name.endswith(u".rdf"):
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                contents[name] = f.read().decode("utf-8")
+    return contents
+
+
+def get_links(rdf, link, prefix):
+    return re.findall(r'<skos:{} rdf:resource="[^"]*#{}_([^"]+)"'.format(link, prefix), rdf)
+
+
+def test_links_of_the_departements(tmp_path, ade_config):
+    rdf = build(tmp_path, ade_config, (u"departement",))[u"DepartementFR.rdf"]
+    assert get_links(rdf, u"broader", u"REG") == [u"32", u"32", u"11", u"11"]
+    assert get_links(rdf, u"narrower", u"COM") == [u"02001", u"02002", u"60001", u"60002", u"75001", u"75002",
+                                                   u"77001", u"77002"]
+
+
+def test_regions_of_departements_by_name(tmp_path, ade_config):
+    contents = build(tmp_path, ade_config, (u"region", u"departement"), dept_filter=u"oise")
+    assert re.findall(r'rdf:about="[^"]*#REG_([^"]+)"', contents[u"RegionFR.rdf"]) == [u"32"]
+    assert get_links(contents[u"RegionFR.rdf"], u"narrower", u"DEP") == [u"02", u"60"]
+    assert get_links(contents[u"DepartementFR.rdf"], u"narrower", u"COM") == [u"60001", u"60002"]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from conftest import ADE_Y_MAX
+from conftest import ADE_Y_MIN
+
+THESAURI = (u"commune", u"departement", u"region", u"epci")
+
+
+@pytest.fixture
+def filter_shp_path(write_shapefile):
+    from shapely.geometry import box
+    # Across the communes 02001 and 02002, the edges of its part in 02002 being on the boundary of 02001
+    return write_shapefile(u"filtre.shp", [({'id': u"1"}, box(710000, ADE_Y_MIN + 10000, 740000, ADE_Y_MAX - 10000)),
+                                           ({'id': u"2"}, box(800000, ADE_Y_MIN, 900000, ADE_Y_MAX))])
+
+
+def read_records(tmp_path, ade_config, columnar, partition=False, **options):
+    """
+    :return:    the dict of the records of the territories read for each thesaurus, in the order of the layer
+    """
+    from build_thesaurus_from_ade import AdeThesauriBuilder
+
+    builder = AdeThesauriBuilder(verbose=False, overwrite=True, compact=False, thesaurus=THESAURI,
+                                 output_dir=str(tmp_path), cfg_path=ade_config, columnar=columnar, **options)
+    records = {}
+    for name in THESAURI:
+        terr_list = builder.read_territories(name, partition=partition)
+        records[name] = list(terr_list.records())
+    return records
+
+
+@pytest.mark.parametrize('options', [{}, {'dept_filter': u"oise,75"}, {'filter_tolerance': 0},
+                                     {'filter_tolerance': 1000}, {'reprojection': 'envelope'}])
+def test_same_territories_as_the_features_path(tmp_path, ade_config, filter_shp_path, options):
+    if 'filter_tolerance' in options:
+        options = dict(options, filter_shp_path=filter_shp_path)
+    expected = read_records(tmp_path, ade_config, False, **options)
+    assert all(expected.values())
+    assert read_records(tmp_path, ade_config, True, **options) == expected
+
+
+def test_same_partition_keys(tmp_path, ade_config):
+    expected = read_records(tmp_path, ade_config, False, partition=True)
+    assert expected[u"epci"][1][6]['dept_keys'] == {u"02", u"aisne", u"60", u"oise"}
+    assert read_records(tmp_path, ade_config, True, partition=True) == expected
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from parallel import split_tasks
+
+
+def test_split_tasks():
+    assert split_tasks([(u"commune", 5), (u"region", 2), (u"epci", 0)], 2) == [
+        (u"commune", 0, 2), (u"commune", 2, 4), (u"commune", 4, 5), (u"region", 0, 2), (u"epci", 0, 0)]
+
+
+def build(output_dir, ade_config, jobs, dept_filter):
+    """
+    :return:    the dict of the contents of the files created by build_thesaurus_from_ade.py, by file name
+    """
+    from build_thesaurus_from_ade import AdeThesauriBuilder
+
+    os.mkdir(output_dir)
+    # Chunks of 3 features: the layers are split between the processes
+    AdeThesauriBuilder(verbose=False, overwrite=True, compact=False, thesaurus=(), output_dir=output_dir,
+                       cfg_path=ade_config, dept_filter=dept_filter, jobs=jobs, chunk_size=3).create_thesauri()
+    contents = {}
+    for name in os.listdir(output_dir):
+        if name.endswith(u".rdf"):
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                contents[name] = f.read()
+    return contents
+
+
+@pytest.mark.parametrize('dept_filter', [None, u"oise,75"])
+def test_same_files_as_a_single_process(tmp_path, ade_config, dept_filter):
+    serial = build(str(tmp_path / u"serial"), ade_config, 1, dept_filter)
+    parallel = build(str(tmp_path / u"parallel"), ade_config, 2, dept_filter)
+    assert sorted(serial) == [u"CommunesFR.rdf", u"DepartementFR.rdf", u"EpciFR.rdf", u"RegionFR.rdf"]
+    for name in serial:
+        assert parallel[name] == serial[name], name
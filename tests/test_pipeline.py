@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import io
+import random
+import threading
+import time
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from pipeline import QueuedWriter
+from pipeline import chunked_map
+from pipeline import iter_chunks
+from pipeline import ordered_map
+
+
+def slow_square():
+    # Random delays, so that the workers finish the items out of order
+    rand = random.Random(threading.current_thread().name)
+
+    def square(item):
+        time.sleep(rand.random() * 0.002)
+        return item * item
+    return square
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks([], 3)) == []
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_ordered_map_keeps_the_order(workers):
+    assert list(ordered_map(range(200), slow_square, workers=workers, queue_size=3)) == [i * i for i in range(200)]
+
+
+def test_ordered_map_creates_one_worker_per_thread():
+    created = []
+
+    def create_worker():
+        created.append(threading.current_thread().name)
+        return slow_square()
+
+    assert list(ordered_map(range(50), create_worker, workers=3)) == [i * i for i in range(50)]
+    assert len(created) == len(set(created)) <= 3
+
+
+def test_ordered_map_raises_the_error_of_a_worker():
+    def create_worker():
+        def process(item):
+            if item == 17:
+                raise ValueError(u"bad item {}".format(item))
+            return item
+        return process
+
+    results = []
+    with pytest.raises(ValueError, match=u"bad item 17"):
+        for result in ordered_map(range(100), create_worker, workers=3):
+            results.append(result)
+    # The results before the error are yielded in order
+    assert results == list(range(17))
+    assert not pipeline_threads()
+
+
+def test_ordered_map_raises_the_error_of_the_reader():
+    def items():
+        for i in range(10):
+            yield i
+        raise IOError(u"read error")
+
+    with pytest.raises(IOError, match=u"read error"):
+        list(ordered_map(items(), slow_square, workers=2))
+    assert not pipeline_threads()
+
+
+def test_ordered_map_stops_the_threads_when_closed():
+    closed = []
+
+    def items():
+        try:
+            for i in range(10000):
+                yield i
+        finally:
+            closed.append(True)
+
+    results = ordered_map(items(), slow_square, workers=2, queue_size=2)
+    assert [next(results) for i in range(5)] == [0, 1, 4, 9, 16]
+    results.close()
+    assert not pipeline_threads()
+    # The iterator of the items is closed by the reader
+    assert closed == [True]
+
+
+def test_ordered_map_queues_metrics():
+    queues = []
+    list(ordered_map(range(20), slow_square, workers=2, queue_size=2, queues=queues))
+    assert [stage_queue.name for stage_queue in queues] == ['read', 'collect']
+    for stage_queue in queues:
+        report = stage_queue.report()
+        # The end markers are not counted
+        assert report["items"] == 20
+        assert report["max_depth"] <= 2
+
+
+def test_chunked_map():
+    queues = []
+    results = list(chunked_map(range(1001), slow_square, workers=3, chunk_size=100, queues=queues))
+    assert results == [i * i for i in range(1001)]
+    assert queues[0].report()["items"] == 11
+
+
+def test_queued_writer_writes_all_the_text_in_order():
+    output = io.StringIO()
+    with QueuedWriter(output, queue_size=2, block_size=10) as f:
+        for i in range(1000):
+            f.write(u"{},".format(i))
+    assert output.getvalue() == u"".join(u"{},".format(i) for i in range(1000))
+
+
+class FailingFile(object):
+
+    def write(self, text):
+        raise IOError(u"disk full")
+
+
+def test_queued_writer_raises_the_error_of_the_writer_thread():
+    f = QueuedWriter(FailingFile(), queue_size=1, block_size=1)
+    with pytest.raises(IOError, match=u"disk full"):
+        for i in range(100):
+            f.write(u"text")
+        f.close()
+    f.abort()
+    assert not f.thread.is_alive()
+    assert isinstance(f.error, IOError)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from conftest import LAMBERT_93
+from reprojection import Reprojector
+
+TOLERANCE = 1e-6
+
+
+@pytest.fixture
+def crs_wkt():
+    import pyproj
+    return pyproj.CRS(LAMBERT_93).to_wkt()
+
+
+def geometries():
+    """
+    :return:    geometries in Lambert 93, from a commune to half of France
+    """
+    from shapely.geometry import MultiPolygon
+    from shapely.geometry import Point
+    from shapely.geometry import Polygon
+    from shapely.geometry import box
+    import shapely
+    return [
+        box(650000, 6860000, 652000, 6862000),
+        Polygon([(600000, 6800000), (650000, 6810000), (640000, 6860000), (590000, 6850000)]),
+        Point(700000, 6600000).buffer(30000),
+        MultiPolygon([box(300000, 6700000, 320000, 6720000), box(900000, 6200000, 950000, 6260000)]),
+        # Large enough for the edges of its envelope and hull to be curved in WGS84, the vertices of its edges being
+        # inside its hull
+        shapely.segmentize(box(100000, 6100000, 1100000, 7100000), 10000),
+        Polygon([(100000, 6600000), (600000, 7100000), (1100000, 6600000), (600000, 6100000)]),
+    ]
+
+
+def deviation(bounds_a, bounds_b):
+    return max(abs(a - b) for a, b in zip(bounds_a, bounds_b))
+
+
+@pytest.mark.parametrize('mode', ['hull', 'envelope'])
+def test_bounds_within_tolerance(crs_wkt, mode):
+    import numpy
+
+    exact = Reprojector(crs_wkt, mode='exact')
+    reprojector = Reprojector(crs_wkt, mode=mode, tolerance=TOLERANCE)
+    geoms = geometries()
+    expected = [exact.bounds(geom) for geom in geoms]
+    bounds = [reprojector.bounds(geom) for geom in geoms]
+    for geom_bounds, exact_bounds in zip(bounds, expected):
+        assert deviation(geom_bounds, exact_bounds) <= TOLERANCE
+    assert reprojector.count == len(geoms)
+
+    array_reprojector = Reprojector(crs_wkt, mode=mode, tolerance=TOLERANCE)
+    assert array_reprojector.bounds_array(numpy.array(geoms, dtype=object)).tolist() == [list(b) for b in bounds]
+    assert array_reprojector.exact_count == reprojector.exact_count
+
+
+@pytest.mark.parametrize('mode', ['hull', 'envelope'])
+def test_fallback_to_exact_mode(crs_wkt, mode):
+    import numpy
+    import shapely.affinity
+
+    # The large box, and a copy in another area
+    geoms = [geometries()[-2]]
+    geoms.append(shapely.affinity.translate(geoms[0], 50000, -100000))
+    exact = [Reprojector(crs_wkt, mode='exact').bounds(geom) for geom in geoms]
+    # Without the check, the approximate bounds are beyond the tolerance
+    unchecked = Reprojector(crs_wkt, mode=mode)
+    assert all(deviation(unchecked.bounds(geom), bounds) > TOLERANCE for geom, bounds in zip(geoms, exact))
+
+    reprojector = Reprojector(crs_wkt, mode=mode, tolerance=TOLERANCE)
+    assert [reprojector.bounds(geom) for geom in geoms] == exact
+    assert reprojector.exact_count == len(geoms)
+
+    reprojector = Reprojector(crs_wkt, mode=mode, tolerance=TOLERANCE)
+    assert reprojector.bounds_array(numpy.array(geoms, dtype=object)).tolist() == [list(b) for b in exact]
+    assert reprojector.exact_count == len(geoms)
+
+
+def test_small_geometries_are_not_reprojected_exactly(crs_wkt):
+    reprojector = Reprojector(crs_wkt, mode='hull', tolerance=TOLERANCE)
+    for geom in geometries()[:4]:
+        reprojector.bounds(geom)
+    assert reprojector.exact_count == 0
+
+
+def test_empty_geometry(crs_wkt):
+    from shapely.geometry import Polygon
+    assert Reprojector(crs_wkt).bounds(Polygon()) is None
+
+
+def test_unknown_mode(crs_wkt):
+    with pytest.raises(ValueError):
+        Reprojector(crs_wkt, mode='centroid')
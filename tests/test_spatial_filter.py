@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from filter_geometry import get_inner_approximation
+from filter_geometry import get_outer_approximation
+from spatial_filter import INTERIORS_INTERSECT
+from spatial_filter import INTERIORS_OVERLAP
+from spatial_filter import SpatialPredicate
+
+TOLERANCE = 1.0
+
+
+def filters():
+    """
+    :return:    the filter geometries: a square and two disjoint squares
+    """
+    from shapely.geometry import MultiPolygon
+    from shapely.geometry import box
+    return [box(0, 0, 100, 100), MultiPolygon([box(0, 0, 100, 100), box(200, 0, 300, 100)])]
+
+
+def geometries():
+    """
+    :return:    the geometries tested against the filters, in all the positions relative to their boundary
+    """
+    from shapely.geometry import LineString
+    from shapely.geometry import MultiPolygon
+    from shapely.geometry import Point
+    from shapely.geometry import box
+    return [
+        # Touching by an edge, by a corner
+        box(100, 20, 150, 80),
+        box(100, 100, 150, 150),
+        # Overlapping
+        box(50, 50, 150, 150),
+        box(99.5, 0, 150, 100),
+        # Contained, touching the boundary from inside, containing
+        box(10, 10, 90, 90),
+        box(0, 10, 50, 90),
+        box(-10, -10, 110, 110),
+        # Disjoint, in the envelope of the second filter only, between the two squares
+        box(400, 0, 500, 100),
+        box(150, 20, 180, 80),
+        # Multipolygons: one part inside, touching parts, parts in the two squares
+        MultiPolygon([box(400, 0, 500, 100), box(40, 40, 60, 60)]),
+        MultiPolygon([box(100, 0, 150, 50), box(-50, 50, 0, 100)]),
+        MultiPolygon([box(90, 0, 110, 10), box(190, 0, 210, 10)]),
+        # Non areal geometries
+        LineString([(-10, 50), (110, 50)]),
+        LineString([(0, -10), (0, 110)]),
+        # Near the corner, its envelope touching the envelope of the filter
+        LineString([(110, 100), (100, 110)]),
+        Point(50, 50),
+        Point(100, 50),
+        Point(250, 50),
+    ]
+
+
+def relate(geom, filter_geom, predicate):
+    """
+    :return:    the result of the relate test replaced by SpatialPredicate
+    """
+    interiors = geom.relate(filter_geom)[0]
+    return interiors != 'F' if predicate == INTERIORS_INTERSECT else interiors == '2'
+
+
+@pytest.mark.parametrize('approximations', [False, True])
+@pytest.mark.parametrize('predicate', [INTERIORS_INTERSECT, INTERIORS_OVERLAP])
+@pytest.mark.parametrize('filter_index', [0, 1])
+def test_same_result_as_relate(filter_index, predicate, approximations):
+    import numpy
+
+    filter_geom = filters()[filter_index]
+    if approximations:
+        outer = get_outer_approximation(filter_geom, TOLERANCE)
+        inner = get_inner_approximation(filter_geom, TOLERANCE)
+    else:
+        outer = inner = None
+    geoms = geometries()
+    expected = [relate(geom, filter_geom, predicate) for geom in geoms]
+    # The cases are not all decided the same way
+    assert any(expected) and not all(expected)
+
+    spatial_predicate = SpatialPredicate(filter_geom, predicate, outer=outer, inner=inner)
+    assert [spatial_predicate.test(geom) for geom in geoms] == expected
+    stats = dict(spatial_predicate.stats)
+
+    spatial_predicate = SpatialPredicate(filter_geom, predicate, outer=outer, inner=inner)
+    assert spatial_predicate.test_array(numpy.array(geoms, dtype=object)).tolist() == expected
+    assert spatial_predicate.stats == stats
+    assert stats["tested"] == len(geoms)
+    assert stats["kept"] == sum(expected)
+    if approximations:
+        assert stats["outer_rejected"] > 0 and stats["inner_accepted"] > 0
+
+
+def test_overlap_of_the_interiors():
+    from shapely.geometry import LineString
+    from shapely.geometry import box
+
+    line = LineString([(-10, 50), (110, 50)])
+    assert SpatialPredicate(box(0, 0, 100, 100), INTERIORS_INTERSECT).test(line)
+    assert not SpatialPredicate(box(0, 0, 100, 100), INTERIORS_OVERLAP).test(line)
+
+
+def test_empty_filter():
+    import numpy
+    from shapely.geometry import MultiPolygon
+    from shapely.geometry import box
+
+    spatial_predicate = SpatialPredicate(MultiPolygon())
+    assert not spatial_predicate.test(box(0, 0, 1, 1))
+    assert spatial_predicate.test_array(numpy.array([box(0, 0, 1, 1)], dtype=object)).tolist() == [False]
+    assert spatial_predicate.stats["bbox_rejected"] == 2
+
+
+def test_unknown_predicate():
+    from shapely.geometry import box
+    with pytest.raises(ValueError):
+        SpatialPredicate(box(0, 0, 1, 1), 'touches')
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from conftest import write_layer_files
+from spatial_join import LARGEST_OVERLAP
+from spatial_join import REPRESENTATIVE_POINT
+from spatial_join import JoinCache
+from spatial_join import SpatialJoin
+
+SETTINGS = ["INSEE_COM", "CODE_EPCI", REPRESENTATIVE_POINT]
+LINKS = {u"80021": u"200070993", u"80829": u"248000556"}
+
+
+def parents():
+    from shapely.geometry import box
+    return [(u"B", box(10, 0, 20, 10)), (u"A", box(0, 0, 10, 10)), (u"C", None)]
+
+
+def test_join_by_representative_point():
+    from shapely.geometry import Point
+    from shapely.geometry import box
+
+    spatial_join = SpatialJoin(parents())
+    links = spatial_join.join([
+        (u"1", box(1, 1, 2, 2)),
+        # Mostly in B, its representative point being in A
+        (u"2", box(9, 4, 19, 4.5).union(box(8, 4, 9, 6))),
+        (u"3", Point(15, 5)),
+        # On the boundary of A and B: the smallest code
+        (u"4", Point(10, 5)),
+        (u"5", box(30, 30, 31, 31)),
+        (u"6", None),
+    ])
+    assert links == {u"1": u"A", u"2": u"A", u"3": u"B", u"4": u"A"}
+    assert spatial_join.stats == {"joined": 4, "orphans": 2}
+
+
+def test_join_by_largest_overlap():
+    from shapely.geometry import Point
+    from shapely.geometry import box
+
+    spatial_join = SpatialJoin(parents(), LARGEST_OVERLAP)
+    assert spatial_join.join([
+        (u"1", box(1, 1, 2, 2)),
+        (u"2", box(9, 4, 19, 4.5).union(box(8, 4, 9, 6))),
+        # Equal overlaps: the smallest code
+        (u"3", box(5, 0, 15, 10)),
+        # Non areal geometries are joined by representative point
+        (u"4", Point(15, 5)),
+    ]) == {u"1": u"A", u"2": u"B", u"3": u"A", u"4": u"B"}
+
+
+def test_join_without_parent():
+    from shapely.geometry import box
+    assert SpatialJoin([]).join([(u"1", box(0, 0, 1, 1))]) == {}
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        SpatialJoin(parents(), 'nearest')
+
+
+@pytest.fixture
+def layers(tmp_path):
+    """
+    :return:    the (JoinCache, child path, parent path) tuple, the join of the two layers being cached
+    """
+    cache = JoinCache(str(tmp_path / u"cache"))
+    child_path = write_layer_files(tmp_path, u"communes")
+    parent_path = write_layer_files(tmp_path, u"epci")
+    assert cache.load(child_path, parent_path, SETTINGS) is None
+    cache.save(child_path, parent_path, SETTINGS, LINKS)
+    return cache, child_path, parent_path
+
+
+def test_cached_join(layers):
+    cache, child_path, parent_path = layers
+    assert cache.load(child_path, parent_path, SETTINGS) == LINKS
+    # The join in the other direction is not the same
+    assert cache.load(parent_path, child_path, SETTINGS) is None
+    # No temporary file left
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+
+def test_other_settings(layers):
+    cache, child_path, parent_path = layers
+    assert cache.load(child_path, parent_path, ["INSEE_COM", "SIREN_EPCI", REPRESENTATIVE_POINT]) is None
+    assert cache.load(child_path, parent_path, ["INSEE_COM", "CODE_EPCI", LARGEST_OVERLAP]) is None
+
+
+def test_invalid_parents_are_reported_once(tmp_path, write_shapefile, capsys):
+    from shapely.geometry import box
+    import yaml
+
+    from build_thesaurus_from_simple_shp import ShpThesauriBuilder
+
+    zones_path = write_shapefile(u"zones.shp", [({'code': u"Z1", 'nom': u"Zone 1"},
+                                                 box(700000, 6600000, 710000, 6610000))])
+    cfg_path = str(tmp_path / u"config.yml")
+    with open(cfg_path, 'w') as f:
+        f.write(yaml.safe_dump({
+            'template_dir_name': 'templates',
+            'thesauri': {
+                'zones': {'shp': zones_path, 'fields': {'name': 'nom', 'code': 'code'}, 'template': 'other.xml',
+                          'uri_scheme': u"http://example.org/zones", 'title': u"Zones", 'out': 'zones.rdf',
+                          'parents': ['cantons', {'thesaurus': 'regions', 'method': 'nearest'}]},
+                'regions': {'shp': zones_path, 'fields': {'name': 'nom', 'code': 'code'}, 'template': 'other.xml',
+                            'uri_scheme': u"http://example.org/regions", 'title': u"Régions", 'out': 'regions.rdf'},
+            },
+        }))
+    os.mkdir(str(tmp_path / u"out"))
+    builder = ShpThesauriBuilder(verbose=False, overwrite=True, compact=False, output_dir=str(tmp_path / u"out"),
+                                 cfg_path=cfg_path)
+    assert builder.get_parents('zones') == []
+    builder.create_thesauri()
+
+    output = capsys.readouterr().out
+    assert output.count(u"Unknown parent thesaurus cantons of zones. Ignored.") == 1
+    assert output.count(u"Unknown join method nearest of the parent regions of zones. Ignored.") == 1
+    with open(str(tmp_path / u"out" / u"zones.rdf")) as f:
+        assert u"skos:broader" not in f.read()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import os
+import random
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+import territories
+from territories import SpillingTerritoryList
+from territories import TerritoryList
+
+# Codes appearing several times, the names giving the order they were added
+CODES = [u"{:05d}".format(i % 37) for i in range(100)]
+
+
+def add_territories(territory_list):
+    order = list(range(len(CODES)))
+    random.Random(1).shuffle(order)
+    for i in order:
+        territory_list.append(CODES[i], u"Territoire {}".format(i), i, i + 0.5, i + 1, i + 1.5,
+                              dept=u"{:02d}".format(i % 5), reg=None if i % 2 else u"32")
+    return territory_list
+
+
+def get_values(territory_list):
+    return [(t.code, t.name, t.lon_min, t.lat_min, t.lon_max, t.lat_max, t.dept, t.reg) for t in territory_list]
+
+
+@pytest.mark.parametrize('max_memory', [1, 1000, 10 ** 9])
+def test_same_territories_as_in_memory(tmp_path, max_memory):
+    expected = add_territories(TerritoryList())
+    expected.sort()
+
+    spilling = add_territories(SpillingTerritoryList(max_memory, str(tmp_path)))
+    spilling.sort()
+    assert len(spilling) == len(CODES)
+    values = get_values(spilling)
+    assert values == get_values(expected)
+    assert [code for code, name, lon_min, lat_min, lon_max, lat_max, dept, reg in values] == sorted(CODES)
+    # The territories can be iterated again
+    assert get_values(spilling) == values
+
+    if max_memory < 10 ** 9:
+        assert spilling.runs
+    spilling.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_ties_in_the_order_added(tmp_path):
+    # A run per territory
+    spilling = SpillingTerritoryList(1, str(tmp_path))
+    for name in (u"b", u"a", u"c"):
+        spilling.append(u"01", name, 0, 0, 1, 1)
+    spilling.append(u"00", u"d", 0, 0, 1, 1)
+    spilling.sort()
+    assert [(t.code, t.name) for t in spilling] == [(u"00", u"d"), (u"01", u"b"), (u"01", u"a"), (u"01", u"c")]
+    spilling.close()
+
+
+def test_merge_of_the_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(territories, 'MAX_MERGED_RUNS', 3)
+    expected = add_territories(TerritoryList())
+    expected.sort()
+
+    spilling = add_territories(SpillingTerritoryList(1, str(tmp_path)))
+    # The runs are merged every 3 runs
+    assert len(spilling.runs) < 3
+    assert len(os.listdir(spilling.runs_dir)) == len(spilling.runs)
+    spilling.sort()
+    assert get_values(spilling) == get_values(expected)
+    spilling.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_extend_and_columns(tmp_path):
+    expected = add_territories(TerritoryList())
+    spilling = SpillingTerritoryList(1000, str(tmp_path))
+    spilling.extend(expected)
+    spilling.append_columns([u"00099"], [u"Dernier"], [(0, 0, 1, 1)], dept=[u"02"], reg=[u"32"])
+    expected.append(u"00099", u"Dernier", 0, 0, 1, 1, dept=u"02", reg=u"32")
+    expected.sort()
+    spilling.sort()
+    assert get_values(spilling) == get_values(expected)
+    spilling.close()
+    assert os.listdir(str(tmp_path)) == []
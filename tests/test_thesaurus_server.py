@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import json
+import re
+import threading
+try:
+    from http.server import HTTPServer
+    from urllib.error import HTTPError
+    from urllib.parse import quote
+    from urllib.request import Request
+    from urllib.request import urlopen
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer
+    from urllib import quote
+    from urllib2 import HTTPError
+    from urllib2 import Request
+    from urllib2 import urlopen
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from conftest import LAMBERT_93
+from thesaurus_server import ThesaurusRequestHandler
+from thesaurus_server import ThesaurusService
+
+
+def get_codes(rdf, prefix):
+    return re.findall(r'rdf:about="[^"]*#{}_([^"]+)"'.format(prefix), rdf)
+
+
+def to_wgs84_geojson(geom):
+    """
+    :param geom:    a geometry in Lambert 93
+    :return:        its GeoJSON geometry in WGS84
+    """
+    from shapely.geometry import mapping
+    from shapely.ops import transform
+    import pyproj
+
+    transformer = pyproj.Transformer.from_crs(LAMBERT_93, "EPSG:4326", always_xy=True)
+    return mapping(transform(transformer.transform, geom))
+
+
+@pytest.fixture
+def service(ade_config):
+    return ThesaurusService(ade_config, cache_size=4)
+
+
+@pytest.fixture
+def commune_02001_filter():
+    from shapely.geometry import box
+    # Inside the commune 02001, away from its boundary
+    return to_wgs84_geojson(box(705000, 6820000, 720000, 6880000))
+
+
+@pytest.mark.parametrize('dept_filter, expected', [
+    (u"75", [u"200054781"]),
+    (u"02", [u"200071991"]),
+    (u"oise", [u"200071991", u"246000871"]),
+    (u"77, 02", [u"200054781", u"200071991"]),
+])
+def test_epci_of_departements(service, dept_filter, expected):
+    rdf, cached = service.get_thesaurus('epci', dept_filter=dept_filter)
+    assert not cached
+    assert get_codes(rdf, u"EPCI") == expected
+
+
+def test_departements_filter_on_attributes(service):
+    assert get_codes(service.get_thesaurus('commune', dept_filter=u"02")[0], u"COM") == [u"02001", u"02002"]
+    assert get_codes(service.get_thesaurus('departement', dept_filter=u"aisne,75")[0], u"DEP") == [u"02", u"75"]
+    assert get_codes(service.get_thesaurus('region', dept_filter=u"60")[0], u"REG") == [u"32"]
+
+
+def test_communes_of_departements(service):
+    rdf = service.get_thesaurus('departement', dept_filter=u"02")[0]
+    assert re.findall(r'<skos:narrower rdf:resource="[^"]*#COM_([^"]+)"', rdf) == [u"02001", u"02002"]
+
+
+def test_geojson_filter(service, commune_02001_filter):
+    assert get_codes(service.get_thesaurus('commune', geojson=commune_02001_filter)[0], u"COM") == [u"02001"]
+    assert get_codes(service.get_thesaurus('epci', geojson=commune_02001_filter)[0], u"EPCI") == [u"200071991"]
+    # Both filters
+    assert get_codes(service.get_thesaurus('epci', dept_filter=u"75", geojson=commune_02001_filter)[0], u"EPCI") == []
+
+    feature_collection = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {}, "geometry": commune_02001_filter}]}
+    assert get_codes(service.get_thesaurus('commune', geojson=feature_collection)[0], u"COM") == [u"02001"]
+
+    with pytest.raises(ValueError):
+        service.get_thesaurus('commune', geojson={"type": "Polygon"})
+
+
+def test_equivalent_requests_share_their_response(service):
+    rdf, cached = service.get_thesaurus('epci', dept_filter=u"02,oise")
+    assert service.get_thesaurus('epci', dept_filter=u" OISE , 02") == (rdf, True)
+    assert service.get_thesaurus('epci', dept_filter=u"02,oise", compact=True)[1] is False
+    assert service.cache.report() == {"size": 2, "max_size": 4, "hits": 1, "misses": 2}
+
+
+@pytest.fixture
+def server_url(service):
+    server = HTTPServer(('127.0.0.1', 0), ThesaurusRequestHandler)
+    server.service = service
+    server.verbose = False
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield u"http://127.0.0.1:{}".format(server.server_port)
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def request(url, body=None):
+    """
+    :return:    the (status, headers, decoded body) tuple of the response
+    """
+    try:
+        response = urlopen(Request(url, data=body))
+    except HTTPError as e:
+        return e.code, e.headers, e.read().decode("utf-8")
+    with response:
+        return response.getcode(), response.headers, response.read().decode("utf-8")
+
+
+def test_server_epci_of_a_departement(server_url):
+    status, headers, rdf = request(server_url + u"/epci?dept=02")
+    assert status == 200
+    assert headers["Content-Type"].startswith("application/rdf+xml")
+    assert headers["X-Cache"] == "MISS"
+    assert get_codes(rdf, u"EPCI") == [u"200071991"]
+    assert request(server_url + u"/epci?dept=02")[1]["X-Cache"] == "HIT"
+
+
+def test_server_geojson_filter(server_url, commune_02001_filter):
+    geojson = json.dumps(commune_02001_filter)
+    status, headers, rdf = request(server_url + u"/commune?filter=" + quote(geojson))
+    assert status == 200
+    assert get_codes(rdf, u"COM") == [u"02001"]
+
+    status, headers, rdf = request(server_url + u"/epci?dept=02", geojson.encode("utf-8"))
+    assert status == 200
+    assert get_codes(rdf, u"EPCI") == [u"200071991"]
+
+
+def test_server_errors(server_url):
+    assert request(server_url + u"/canton")[0] == 404
+    assert request(server_url + u"/commune?filter=" + quote(u"{not json"))[0] == 400
+    assert request(server_url + u"/commune?compact=maybe")[0] == 400
+
+    status, headers, report = request(server_url + u"/")
+    assert status == 200
+    assert json.loads(report)["thesauri"] == {"commune": 8, "departement": 4, "region": 2, "epci": 3}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import io
+import os.path
+
+# Non standard imports (see requirements.txt)
+import pytest
+
+from output import create_writer
+from rdf_writer import create_template_env
+from territories import TerritoryList
+
+rdflib = pytest.importorskip('rdflib')
+rdflib_compare = pytest.importorskip('rdflib.compare')
+
+TEMPLATES_DIR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+TEMPLATES = ('CommuneFR.xml', 'DepartementFR.xml', 'RegionFR.xml', 'EpciFR.xml', 'other.xml')
+
+
+def create_data(thesaurus):
+    terr_list = TerritoryList()
+    uri_scheme = u"http://example.org/thesaurus/{}".format(thesaurus)
+    # The names are escaped by the builders
+    territories = [
+        (u"02", u"Aisne", (3.08, 48.83, 4.25, 50.07), u"32", [u"02", u"60", u"80"]),
+        (u"2A", u"Corse-du-Sud", (8.53, 41.36, 9.41, 42.38), u"94", [u"2A"]),
+        (u"974", u"La Réunion", (55.21, -21.39, 55.84, -20.87), u"04", []),
+        (u"X1", u"Saint-Rémy-l'Honoré &amp; \"Les Bréviaires\"", (1.9, 48.7, 1.95, 48.75), u"11", [u"78"]),
+    ]
+    for code, name, bounds, reg, dept_reg in territories:
+        terr_list.append(code, name, *bounds, uri=u"{}#{}".format(uri_scheme, code), reg=reg, dept=code[:2],
+                         dept_reg=dept_reg)
+    terr_list.sort()
+    return {
+        "title": u"Thésaurus {} de test".format(thesaurus),
+        "date": u"2024-01-31",
+        "terr_list": terr_list,
+        "thesaurus": thesaurus,
+        "uri_scheme": uri_scheme,
+        "broader": {u"02": [u"http://example.org/thesaurus/region#32"]},
+        "narrower": {u"2A": [u"http://example.org/thesaurus/commune#2A004",
+                             u"http://example.org/thesaurus/commune#2A041"]},
+    }
+
+
+def render(template_name, output_format, minify=False):
+    template_env = create_template_env(TEMPLATES_DIR_PATH)
+    writer = create_writer(template_env, template_name, output_format, minify=minify)
+    output_file = io.StringIO()
+    writer.write(output_file, create_data(os.path.splitext(template_name)[0]))
+    return output_file.getvalue()
+
+
+def parse(text, output_format):
+    graph = rdflib.Graph()
+    graph.parse(data=text, format={'rdf': 'xml', 'nt': 'nt', 'ttl': 'turtle'}[output_format])
+    return graph
+
+
+@pytest.mark.parametrize('template_name', TEMPLATES)
+@pytest.mark.parametrize('output_format', ['nt', 'ttl'])
+def test_triples_are_those_of_the_rdf_xml(template_name, output_format):
+    expected = parse(render(template_name, 'rdf'), 'rdf')
+    triples = render(template_name, output_format)
+    graph = parse(triples, output_format)
+
+    assert len(graph) == len(expected) > 0
+    assert rdflib_compare.isomorphic(graph, expected)
+
+
+@pytest.mark.parametrize('output_format', ['nt', 'ttl'])
+def test_one_triple_per_line(output_format):
+    triples = render('RegionFR.xml', output_format)
+    lines = [line for line in triples.splitlines() if line and not line.startswith(u"@prefix")]
+    assert len(lines) == len(parse(triples, output_format))
+    assert all(line.endswith(u" .") for line in lines)
+
+
+def test_compact_rdf_xml_has_the_same_triples():
+    assert rdflib_compare.isomorphic(parse(render('CommuneFR.xml', 'rdf', minify=True), 'rdf'),
+                                     parse(render('CommuneFR.xml', 'rdf'), 'rdf'))
@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import abc
+import datetime
+import os
+import os.path
+
+# Non standard imports (see requirements.txt)
+import click
+import yaml
+
+from reprojection import Reprojector
+from layer_cache import Layer
+from layer_cache import LayerCache
+from layer_columns import read_layer_columns
+from build_manifest import BuildManifest
+from bbox_cache import BboxCache
+from profiler import BuildProfiler
+from territories import SpillingTerritoryList
+from territories import TerritoryList
+from output import create_writer
+from output import get_output_path
+from output import open_output
+from delta import DeltaOutput
+from pipeline import QueuedWriter
+from pipeline import chunked_map
+from rdf_writer import get_templates_cache_dir
+from rdf_writer import create_template_env
+from utils import LazyModule
+
+# Imported on first use, as the modules reading the layers
+numpy = LazyModule('numpy')
+
+# Base class of the classes having abstract methods, on Python 2 and 3
+ABC = abc.ABCMeta('ABC', (object,), {})
+
+
+def load_config(cfg_path):
+    """
+    :param cfg_path:    the path of the YAML configuration file of a builder
+    :return:            the configuration
+    """
+    with open(cfg_path, 'r') as yaml_file:
+        return yaml.safe_load(yaml_file)
+
+
+class ThesauriBuilder(ABC):
+    """
+    Flow shared by the builders of thesauri: check the output file and the template of a thesaurus, read the features
+    of its layer (from the layer or the BboxCache, per feature or as columns) into territories, then write the
+    thesaurus, in delta mode or not, and record it in the build manifest.
+
+    The builders define the thesauri and their layers (get_thesaurus_cfg, get_layer_path, get_layer_paths,
+    get_build_inputs), how a feature becomes a territory (create_territory_getter, append_territory_columns) and the
+    data of the templates (get_template_data). A builder filtering the features also defines get_read_filters,
+    get_pushdown and can_use_bbox_cache.
+    """
+
+    # Word naming a thesaurus in the messages
+    thesaurus_kind = u"name"
+
+    def __init__(self,
+                 verbose,
+                 overwrite,
+                 compact,
+                 output_dir,
+                 cfg_path,
+                 reprojection='hull',
+                 bbox_tolerance=1e-6,
+                 release_layers=True,
+                 jobs=1,
+                 chunk_size=2000,
+                 threads=0,
+                 incremental=False,
+                 cache_dir=None,
+                 profile=False,
+                 cprofile=False,
+                 max_memory=None,
+                 output_format='rdf',
+                 compression=None,
+                 columnar=False,
+                 delta=False):
+
+        self.verbose = verbose
+        self.overwrite = overwrite
+        self.compact = compact
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.reprojection = reprojection
+        self.bbox_tolerance = bbox_tolerance if bbox_tolerance is not None and bbox_tolerance >= 0 else None
+        self.layer_cache = LayerCache(release_layers=release_layers)
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.incremental = incremental
+        self.manifest = BuildManifest(output_dir)
+        self.bbox_cache = BboxCache(cache_dir) if cache_dir else None
+        self.profiler = BuildProfiler(output_dir, enabled=profile, cprofile=cprofile)
+        self.max_memory = max_memory
+        self.output_format = output_format
+        self.compression = compression
+        self.columnar = columnar
+        self.delta = delta
+
+        self.cfg = load_config(cfg_path)
+
+        # The templates environment is created on first use, the compiled templates being kept in the cache directory
+        # of the build or of the user, never in the output directory
+        self.templates_dir_path = os.path.join(os.path.dirname(__file__), self.cfg['template_dir_name'])
+        self.templates_cache_dir = get_templates_cache_dir(cache_dir)
+        self._template_env = None
+
+    @property
+    def template_env(self):
+        """
+        The Jinja environment of the templates
+        """
+        if self._template_env is None:
+            self._template_env = create_template_env(self.templates_dir_path, self.templates_cache_dir)
+        return self._template_env
+
+    @abc.abstractmethod
+    def get_thesaurus_cfg(self, name):
+        """
+        :param name:    the name of the thesaurus
+        :return:        its configuration section, None if unknown
+        """
+
+    @abc.abstractmethod
+    def get_layer_path(self, name):
+        """
+        :param name:    the name of the thesaurus
+        :return:        the source of its layer (see get_layer_source)
+        """
+
+    @abc.abstractmethod
+    def get_build_inputs(self, name):
+        """
+        :param name:    the name of the thesaurus
+        :return:        the (input files, settings) tuple recorded in the build manifest
+        """
+
+    def echo_layer_read(self, path):
+        if self.layer_cache.is_loaded(path):
+            click.echo(u"  Shapefile {} already loaded".format(path))
+        else:
+            click.echo(u"  Read shapefile {}".format(path))
+
+    def create_thesaurus(self, name):
+
+        prepared = self.prepare_thesaurus(name)
+        if prepared is None:
+            return
+
+        terr_list = self.read_territories(name)
+        if terr_list is None:
+            return
+        with self.profiler.stage(name, 'sort'):
+            terr_list.sort()
+
+        try:
+            self.write_thesaurus(name, prepared, terr_list)
+        finally:
+            terr_list.close()
+
+    def prepare_thesaurus(self, name):
+        """
+        Check the configuration, the output file and the template of a thesaurus.
+
+        :param name:    the name of the thesaurus
+        :return:        the (thesaurus config, output file path, RdfWriter or TriplesWriter, build inputs) tuple, None
+                        if the thesaurus can not or must not be created
+        """
+
+        click.echo(u"Thesaurus creation: {}".format(name))
+
+        thesaurus_cfg = self.get_thesaurus_cfg(name)
+        if not thesaurus_cfg:
+            click.echo(u"  Unknown thesaurus {}: {}.".format(self.thesaurus_kind, name))
+            return
+
+        # Output file name and path
+        rdf_file_name = thesaurus_cfg.get('out')
+        if rdf_file_name:
+            rdf_file_path = get_output_path(os.path.join(self.output_dir, rdf_file_name), self.output_format,
+                                            self.compression)
+        else:
+            click.echo(u"  Output rdf file name not found. Stop here")
+            return
+
+        if self.verbose:
+            click.echo(u"  Output file path: {}".format(rdf_file_path))
+
+        # Test if the rdf file already exists when --no-overwrite
+        if not self.overwrite and not self.incremental and not self.delta and os.path.isfile(rdf_file_path):
+            click.echo(u"  Output file {} already exists. Won't be overwritten.".format(rdf_file_path))
+            click.echo(u"  Add option --overwrite to overwrite it.")
+            return
+
+        # Test if the rdf file is up to date when --incremental
+        input_files, settings = self.get_build_inputs(name)
+        if self.incremental and self.manifest.is_up_to_date(name, input_files, settings, rdf_file_path):
+            click.echo(u"  Output file {} is up to date. Skipped.".format(rdf_file_path))
+            return
+
+        # Read the template file using the environment object
+        if self.verbose:
+            click.echo(u"  Loading template {}".format(thesaurus_cfg['template']))
+
+        try:
+            rdf_writer = create_writer(self.template_env, thesaurus_cfg['template'], self.output_format,
+                                       minify=self.compact)
+        except ValueError as e:
+            click.echo(u"  Template {} can not be used: {}. Stop here.".format(thesaurus_cfg['template'], e))
+            return
+        except Exception as e:
+            click.echo(u"  Template {} not found. Stop here.".format(thesaurus_cfg['template']))
+            return
+
+        # Timed when profiling: the skeleton is formatted with prettify_xml
+        rdf_writer.render_skeleton = self.profiler.wrap(name, 'prettify', rdf_writer.render_skeleton)
+        rdf_writer.render_concept = self.profiler.wrap(name, 'render', rdf_writer.render_concept)
+
+        return thesaurus_cfg, rdf_file_path, rdf_writer, (input_files, settings)
+
+    def create_territory_list(self, partition=False):
+        """
+        :param partition:   True if the territories are selected for batches, which needs them all in memory
+        :return:            an empty list of territories, bounded by --max-memory if given
+        """
+        if self.max_memory is not None and not partition:
+            return SpillingTerritoryList(self.max_memory * 1024 * 1024)
+        return TerritoryList()
+
+    def get_read_filters(self, name, partition=False):
+        """
+        :param name:        the name of the thesaurus
+        :param partition:   True if the territories are partitioned for batches instead of being filtered
+        :return:            the filters of the geometries of the features by name (SpatialPredicate, SpatialPartition,
+                            None when not needed), copied for each thread, or None if the thesaurus can not be read
+        """
+        return {}
+
+    def can_use_bbox_cache(self, name, partition=False):
+        """
+        :return:    True if the cached attributes and bboxes can be read instead of the layer of the thesaurus, no
+                    geometry being needed to filter its features
+        """
+        return self.bbox_cache is not None
+
+    def get_pushdown(self, name, layer, filters, partition=False):
+        """
+        :param name:        the name of the thesaurus
+        :param layer:       its Layer
+        :param filters:     the filters returned by get_read_filters
+        :param partition:   True if the territories are partitioned for batches instead of being filtered
+        :return:            the bbox and accept filters of Layer.read skipping the features which would be filtered out
+        """
+        return {}
+
+    @abc.abstractmethod
+    def create_territory_getter(self, name, filters, partition=False):
+        """
+        :param name:        the name of the thesaurus
+        :param filters:     the filters returned by get_read_filters, or their copies for a thread
+        :param partition:   True if the territories are partitioned for batches instead of being filtered
+        :return:            a function taking the properties and geometry (None if read from the BboxCache) of a
+                            feature and returning the (code, name, attributes) tuple of the arguments of
+                            TerritoryList.append, None if the feature is filtered out
+        """
+
+    @abc.abstractmethod
+    def append_territory_columns(self, name, columns, filters, terr_list, partition=False):
+        """
+        Append to a list the territories of the features read as columns, with vectorized operations.
+
+        :param name:        the name of the thesaurus
+        :param columns:     the LayerColumns of the features having a bbox
+        :param filters:     the filters returned by get_read_filters
+        :param terr_list:   the list of territories
+        :param partition:   True if the territories are partitioned for batches instead of being filtered
+        """
+
+    def echo_filters_report(self, filters):
+        """
+        Echo the statistics of the filters returned by get_read_filters.
+        """
+
+    def create_feature_processor(self, name, reprojector, filters, partition=False):
+        """
+        Get the function handling a feature read from the layer of a thesaurus. It only uses the objects given, so that
+        each thread handling the features can be given its own copies.
+
+        :param name:        the name of the thesaurus
+        :param reprojector: the Reprojector computing the WGS84 bbox of the geometries
+        :param filters:     the filters returned by get_read_filters, or their copies
+        :param partition:   True if the territories are partitioned for batches instead of being filtered
+        :return:            a function taking the properties and geometry of a feature and returning its (properties,
+                            WGS84 bbox, territory) tuple (see create_territory_getter), the bbox and territory being
+                            None for an empty geometry
+        """
+        get_bounds = self.profiler.wrap(name, 'reproject', reprojector.bounds)
+        get_territory = self.create_territory_getter(name, filters, partition)
+
+        def process(f_props, f_geom):
+            bounds = get_bounds(f_geom)
+            if bounds is None:
+                # An empty geometry has no bbox: the feature is skipped
+                return f_props, None, None
+            return f_props, bounds, get_territory(f_props, f_geom)
+        return process
+
+    def check_fields(self, layer, fields):
+        """
+        :param layer:   a Layer
+        :param fields:  the fields of the configuration of a thesaurus
+        :return:        True if the layer has all the fields, else False once the missing one is reported
+        """
+        for f in fields:
+            if fields[f] not in layer.fields:
+                click.echo(u"  Fatal error: field {} not found in shapefile.".format(fields[f]))
+                return False
+        return True
+
+    def read_territories(self, name, start=None, stop=None, partition=False):
+        """
+        Read the features of the layer of a thesaurus, compute their WGS84 bbox and filter them.
+
+        :param name:        the name of the thesaurus
+        :param start:       index of the first feature to read, the first feature of the layer if None
+        :param stop:        index of the feature to stop at, the end of the layer if None
+        :param partition:   if True, the territories are not filtered by departement but given the set of the
+                            numbers and names of their departements as dept_keys, for a PartitionIndex
+        :return:            the list of the territories in the order of the layer, None on error
+        """
+
+        if self.columnar:
+            return self.read_territory_columns(name, start, stop, partition)
+
+        filters = self.get_read_filters(name, partition)
+        if filters is None:
+            return
+
+        # Create the list of territories
+        terr_list = self.create_territory_list(partition)
+        features_read = 0
+        layer_path = self.get_layer_path(name)
+
+        # The cached attributes and bboxes are used when no geometry is needed to filter the features
+        fields = self.get_thesaurus_cfg(name)['fields']
+        cache_settings = [self.reprojection, self.bbox_tolerance]
+        cached = None
+        cache_writer = None
+        if self.can_use_bbox_cache(name, partition):
+            cached = self.bbox_cache.load(layer_path, fields, cache_settings)
+
+        reprojector = None
+        workers_filters = []
+        queues = []
+        if cached is not None:
+            if self.verbose:
+                click.echo(u"  Read cached bounding boxes {}".format(cached.path))
+            features = self.profiler.wrap_iter(name, 'read_cache', cached.rows(start, stop))
+            get_territory = self.create_territory_getter(name, filters, partition)
+            results = ((f_props, bounds, get_territory(f_props) if bounds is not None else None)
+                       for f_props, bounds in features)
+        else:
+            if self.verbose:
+                self.echo_layer_read(layer_path)
+
+            layer = self.layer_cache.get_layer(layer_path)
+            layer.shape = self.profiler.wrap(name, 'shape', Layer.shape)
+
+            # Check the fields before reading the features, which may be handled by other threads
+            if not self.check_fields(layer, fields):
+                return
+
+            # Computes the WGS84 bbox of the geometries
+            reprojector = Reprojector(layer.crs_wkt, crs=layer.crs, mode=self.reprojection,
+                                      tolerance=self.bbox_tolerance)
+
+            # Only a read of the whole layer fills the cache
+            if self.bbox_cache is not None and start is None and stop is None:
+                cache_writer = self.bbox_cache.writer(layer_path, fields, cache_settings)
+
+            # Only the configured fields are read and, unless every feature is needed to fill the cache, the
+            # features which would be filtered out are skipped by the reader. The filters are applied to the features
+            # read anyway.
+            pushdown = {'fields': list(fields.values())}
+            if cache_writer is None:
+                pushdown.update(self.get_pushdown(name, layer, filters, partition))
+
+            features = self.profiler.wrap_iter(name, 'read', layer.slice(start, stop, **pushdown))
+
+            def create_processor(reprojector=reprojector, filters=filters):
+                process = self.create_feature_processor(name, reprojector, filters, partition)
+                return lambda feature: process(*feature)
+
+            def create_worker():
+                # Each thread has its own copy of the transformer and of the prepared geometries
+                copies = (reprojector.copy(), dict((key, f.copy() if f is not None else None)
+                                                   for key, f in filters.items()))
+                workers_filters.append(copies)
+                return create_processor(*copies)
+
+            if self.threads:
+                # The features are read by a thread, their bboxes computed and filtered by the others
+                results = chunked_map(features, create_worker, self.threads, self.chunk_size, queues=queues)
+            else:
+                process = create_processor()
+                results = (process(feature) for feature in features)
+
+        for f_props, bounds, territory in results:
+            features_read += 1
+
+            if cache_writer is not None:
+                cache_writer.append(f_props, bounds)
+
+            # Add the object to the list of territories if kept by the filters
+            if territory is not None:
+                code, terr_name, attributes = territory
+                lon_min, lat_min, lon_max, lat_max = bounds
+                terr_list.append(code, terr_name, lon_min, lat_min, lon_max, lat_max, **attributes)
+
+        if cache_writer is not None:
+            cache_writer.save()
+
+        self.profiler.count(name, "features_read", features_read)
+        self.profiler.count(name, "features_kept", len(terr_list))
+        self.profiler.count(name, "features_filtered", features_read - len(terr_list))
+
+        # The statistics of the copies of the threads are reported with the ones of the filters
+        for worker_reprojector, worker_filters in workers_filters:
+            reprojector.add_counts(worker_reprojector)
+            for key, f in filters.items():
+                if f is not None:
+                    f.add_stats(worker_filters[key])
+        self.profiler.add_queues(name, queues)
+
+        if self.verbose:
+            if reprojector is not None:
+                click.echo(u"  Bounding boxes computed for {} features, {} in exact mode".format(
+                    reprojector.count, reprojector.exact_count))
+            self.echo_filters_report(filters)
+            for stage_queue in queues:
+                click.echo(u"  Queue {}".format(stage_queue.summary()))
+
+        return terr_list
+
+    def read_territory_columns(self, name, start=None, stop=None, partition=False):
+        """
+        Read the features of the layer of a thesaurus as columns, then compute their WGS84 bbox, filter them and
+        clean their attributes with vectorized operations, giving the same territories as read_territories. Only the
+        features kept become territories.
+
+        :param name:        the name of the thesaurus
+        :param start:       index of the first feature to read, the first feature of the layer if None
+        :param stop:        index of the feature to stop at, the end of the layer if None
+        :param partition:   if True, the territories are not filtered by departement but given the set of the
+                            numbers and names of their departements as dept_keys, for a PartitionIndex
+        :return:            the list of the territories in the order of the layer, None on error
+        """
+
+        filters = self.get_read_filters(name, partition)
+        if filters is None:
+            return
+
+        terr_list = self.create_territory_list(partition)
+        layer_path = self.get_layer_path(name)
+
+        # The cached attributes and bboxes are used when no geometry is needed to filter the features
+        fields = self.get_thesaurus_cfg(name)['fields']
+        cache_settings = [self.reprojection, self.bbox_tolerance]
+        cached = None
+        if self.can_use_bbox_cache(name, partition):
+            cached = self.bbox_cache.load(layer_path, fields, cache_settings)
+
+        reprojector = None
+        if cached is not None:
+            if self.verbose:
+                click.echo(u"  Read cached bounding boxes {}".format(cached.path))
+            with self.profiler.stage(name, 'read_cache'):
+                columns = cached.select(start, stop)
+        else:
+            if self.verbose:
+                self.echo_layer_read(layer_path)
+
+            layer = self.layer_cache.get_layer(layer_path)
+            if not self.check_fields(layer, fields):
+                return
+
+            # Only the configured fields are read and, unless every feature is needed to fill the cache, the
+            # features outside of the bbox of the filters are skipped by the reader
+            fill_cache = self.bbox_cache is not None and start is None and stop is None
+            bbox = None
+            if not fill_cache:
+                bbox = self.get_pushdown(name, layer, filters, partition).get('bbox')
+            with self.profiler.stage(name, 'read'):
+                columns = read_layer_columns(layer, list(fields.values()), start, stop, bbox=bbox)
+
+            # Computes the WGS84 bbox of all the geometries at once
+            reprojector = Reprojector(layer.crs_wkt, crs=layer.crs, mode=self.reprojection,
+                                      tolerance=self.bbox_tolerance)
+            with self.profiler.stage(name, 'reproject'):
+                columns.bounds = reprojector.bounds_array(columns.geoms)
+
+            if fill_cache:
+                cache_writer = self.bbox_cache.writer(layer_path, fields, cache_settings)
+                cache_writer.extend(columns)
+                cache_writer.save()
+
+        # The features whose geometry is empty have no bbox and are skipped
+        features_read = len(columns)
+        columns = columns.select(~numpy.isnan(columns.bounds[:, 0]))
+
+        self.append_territory_columns(name, columns, filters, terr_list, partition)
+
+        self.profiler.count(name, "features_read", features_read)
+        self.profiler.count(name, "features_kept", len(terr_list))
+        self.profiler.count(name, "features_filtered", features_read - len(terr_list))
+
+        if self.verbose:
+            if reprojector is not None:
+                click.echo(u"  Bounding boxes computed for {} features, {} in exact mode".format(
+                    reprojector.count, reprojector.exact_count))
+            self.echo_filters_report(filters)
+
+        return terr_list
+
+    def get_template_data(self, name, thesaurus_cfg, terr_list):
+        """
+        :param name:            the name of the thesaurus
+        :param thesaurus_cfg:   its configuration section
+        :param terr_list:       the territories sorted by code
+        :return:                the data passed to the template
+        """
+        return {
+            "title": thesaurus_cfg["title"],
+            "date": datetime.date.today().isoformat(),
+            "terr_list": terr_list,
+            "thesaurus": name
+        }
+
+    def write_thesaurus(self, name, prepared, terr_list):
+        """
+        Write a thesaurus, or only replace it if a concept changed in delta mode, and record it in the build manifest.
+
+        :param name:        the name of the thesaurus
+        :param prepared:    the tuple returned by prepare_thesaurus
+        :param terr_list:   the territories sorted by code
+        """
+
+        thesaurus_cfg, rdf_file_path, rdf_writer, (input_files, settings) = prepared
+
+        # data passed to the template
+        data = self.get_template_data(name, thesaurus_cfg, terr_list)
+
+        if self.verbose:
+            click.echo(u"  Write output file {}".format(rdf_file_path))
+
+        # Finally, process the template to write the concepts one by one to the output file
+        def write(f):
+            f = self.profiler.wrap_file(name, 'write', f)
+            with self.profiler.memory(name, 'render'):
+                if not self.threads:
+                    rdf_writer.write(f, data)
+                    return
+                # The concepts are rendered while a thread compresses and writes the previous ones
+                queues = []
+                with QueuedWriter(f, queues=queues) as queued_file:
+                    rdf_writer.write(queued_file, data)
+                self.profiler.add_queues(name, queues)
+
+        if not self.delta:
+            with open_output(rdf_file_path, self.compression) as f:
+                write(f)
+        else:
+            # Written to a temporary file, replacing the output file only if a concept changed or if it was written with
+            # other settings
+            replace = not self.manifest.has_settings(name, settings, rdf_file_path)
+            delta_output = DeltaOutput(name, rdf_file_path, self.compression)
+            try:
+                delta_output.write(write)
+                with self.profiler.stage(name, 'delta'):
+                    changeset, updated = delta_output.apply(replace)
+            finally:
+                delta_output.close()
+            click.echo(u"  Changes: {}{}".format(changeset.report(), u"" if updated else u". Output file unchanged"))
+
+        self.manifest.record(name, input_files, settings, rdf_file_path)
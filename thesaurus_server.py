@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+from collections import OrderedDict
+import datetime
+import io
+import json
+import os.path
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from urlparse import parse_qs
+    from urlparse import urlparse
+
+# Non standard imports (see requirements.txt)
+import click
+import yaml
+
+from batch import parse_dept_filter
+from hierarchy import HierarchyIndex
+from layer_cache import Layer
+from rdf_writer import RdfWriter
+from rdf_writer import create_template_env
+from reprojection import REPROJECTION_MODES
+from reprojection import Reprojector
+from reprojection import reproject_from_wgs84
+from spatial_filter import INTERIORS_OVERLAP
+from spatial_filter import SpatialPredicate
+from territories import TerritoryList
+from utils import LazyModule
+from utils import get_layer_source
+
+# Imported on first use, as the modules reading the layers
+shapely_geometry = LazyModule('shapely.geometry')
+shapely_ops = LazyModule('shapely.ops')
+shapely_strtree = LazyModule('shapely.strtree')
+
+
+THESAURUS_TYPES = ("commune", "departement", "region", "epci")
+
+RDF_CONTENT_TYPE = "application/rdf+xml; charset=utf-8"
+
+# Values of the compact parameter
+TRUE_VALUES = ("1", "true", "yes")
+FALSE_VALUES = ("", "0", "false", "no")
+
+
+@click.command()
+@click.option('-v', '--verbose', is_flag=True, default=False, help='Enables verbose mode')
+@click.option('--host', default='127.0.0.1', help='Address the server listens to (127.0.0.1 by default)')
+@click.option('--port', type=click.IntRange(0, 65535), default=8080, help='Port the server listens to')
+@click.option('--cache-size', type=click.IntRange(0, None), default=32,
+              help='Maximal number of rendered thesauri kept in memory (32 by default, 0 to disable the cache)')
+@click.option('--reprojection', type=click.Choice(REPROJECTION_MODES), default='hull',
+              help='Part of the geometries reprojected to compute their WGS84 bounding box (see '
+                   'build_thesaurus_from_ade.py)')
+@click.option('--bbox-tolerance', type=float, default=1e-6,
+              help='Maximal deviation in degrees from the exact bounding box in hull or envelope mode, negative to '
+                   'disable the check')
+@click.option('--cfg-path', type=click.Path(exists=True, dir_okay=False), default="config_ade.yml",
+              help='Path of a config file.')
+@click.option('--thesaurus', multiple=True, type=click.Choice(THESAURUS_TYPES),
+              help='Selection of the type of thesaurus to serve')
+def serve_thesauri(verbose, host, port, cache_size, reprojection, bbox_tolerance, cfg_path, thesaurus):
+    """
+    This command loads the ADMIN EXPRESS layers of the config file once and serves the thesauri over HTTP, filtered
+    on request:\n
+    GET /commune?dept=02,60,80&compact=1\n
+    GET /epci?filter={"type": "Polygon", "coordinates": ...}\n
+    POST /epci?dept=02 with a GeoJSON geometry, feature or feature collection in WGS84 as body\n
+    GET / lists the thesauri served and the state of the cache.
+
+    Examples:\n
+    python thesaurus_server.py\n
+    python thesaurus_server.py --port 8000 --cache-size 100 --thesaurus commune --thesaurus epci\n
+    curl "http://127.0.0.1:8080/commune?dept=02,oise"
+    """
+
+    service = ThesaurusService(cfg_path, thesaurus, reprojection=reprojection, bbox_tolerance=bbox_tolerance,
+                               cache_size=cache_size, verbose=verbose)
+
+    server = HTTPServer((host, port), ThesaurusRequestHandler)
+    server.service = service
+    server.verbose = verbose
+    click.echo(u"Serving {} on http://{}:{}/".format(", ".join(service.datasets), host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    click.echo(u"Done. Goodbye")
+
+
+class ResponseCache(object):
+    """
+    LRU cache of the rendered thesauri, by normalized request parameters.
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size:    the maximal number of responses kept, 0 to disable the cache
+        """
+        self.max_size = max_size
+        self.responses = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :param key:     the normalized parameters of a request
+        :return:        the response cached, None if not cached
+        """
+        response = self.responses.pop(key, None)
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Most recently used last
+        self.responses[key] = response
+        return response
+
+    def put(self, key, response):
+        if self.max_size <= 0:
+            return
+        self.responses.pop(key, None)
+        self.responses[key] = response
+        while len(self.responses) > self.max_size:
+            self.responses.popitem(last=False)
+
+    def report(self):
+        return {"size": len(self.responses), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class ThesaurusDataset(object):
+    """
+    Features of the layer of a thesaurus, kept in memory with their attributes, their geometry indexed in a STRtree
+    and their WGS84 bounding box.
+    """
+
+    def __init__(self, thesaurus_type, thesaurus_cfg, layer_path, reprojection='hull', bbox_tolerance=None):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :param thesaurus_cfg:   the section of the thesaurus in the config file
+        :param layer_path:      the path of the shapefile of the thesaurus, or the source of its layer (see
+                                get_layer_source)
+        :param reprojection:    one of REPROJECTION_MODES
+        :param bbox_tolerance:  maximal deviation in degrees from the exact bounding box, None to disable the check
+        """
+        self.thesaurus_type = thesaurus_type
+        self.path = layer_path
+
+        fields = thesaurus_cfg['fields']
+        layer = Layer(layer_path)
+        for field in fields.values():
+            if field not in layer.fields:
+                raise ValueError(u"Field {} not found in shapefile {}".format(field, layer_path))
+        self.crs_wkt = layer.crs_wkt
+        self.crs = layer.crs
+        reprojector = Reprojector(layer.crs_wkt, crs=layer.crs, mode=reprojection, tolerance=bbox_tolerance)
+
+        self.records = []
+        self.geoms = []
+        for f_props, f_geom in layer.read(fields=list(fields.values())):
+            bounds = reprojector.bounds(f_geom)
+            if bounds is None:
+                # An empty geometry has no bbox: the feature is skipped
+                continue
+            record = {
+                "name": f_props[fields['nom']].strip().replace("&", "&amp;"),
+                "code": f_props[fields['code']].strip(),
+                "bounds": bounds,
+            }
+            if thesaurus_type == 'commune':
+                record["dept_name"] = f_props[fields['nomdept']].strip()
+                record["dept_code"] = f_props[fields['codedept']].strip()
+            elif thesaurus_type == 'departement':
+                record["dept_name"] = f_props[fields['nom']].strip()
+                record["reg_code"] = f_props[fields['codereg']].strip()
+            self.records.append(record)
+            self.geoms.append(f_geom)
+        self.tree = shapely_strtree.STRtree(self.geoms) if self.geoms else None
+        self.positions = dict((id(geom), i) for i, geom in enumerate(self.geoms))
+
+    def query(self, geom):
+        """
+        :param geom:    a geometry in the CRS of the layer
+        :return:        the sorted positions of the features whose envelope intersects the envelope of geom
+        """
+        if self.tree is None:
+            return []
+        # Shapely >= 2.0 returns indices, older versions return the geometries
+        return sorted(self.positions[id(i)] if hasattr(i, 'geom_type') else int(i) for i in self.tree.query(geom))
+
+    def __len__(self):
+        return len(self.records)
+
+
+class ThesaurusService(object):
+    """
+    Create the thesauri from the datasets loaded once, caching the rendered documents.
+
+    The departements filter selects the same territories as build_thesaurus_from_ade.py: on attributes for the
+    communes, departements and regions, on the overlap of the departements for the EPCI. The spatial filter is a
+    GeoJSON geometry in WGS84, reprojected in the CRS of the layers, selecting the territories whose interior
+    intersects its interior as with --filter-shp-path.
+    """
+
+    def __init__(self, cfg_path, thesauri=None, reprojection='hull', bbox_tolerance=1e-6, cache_size=32,
+                 verbose=False):
+        """
+        :param cfg_path:        the path of the config file
+        :param thesauri:        the types of thesaurus to serve, all the types configured if empty
+        :param reprojection:    one of REPROJECTION_MODES
+        :param bbox_tolerance:  maximal deviation in degrees from the exact bounding box, negative to disable the check
+        :param cache_size:      the maximal number of rendered thesauri cached
+        :param verbose:         True to display the loading of the layers
+        """
+        with open(cfg_path, 'r') as yaml_file:
+            self.cfg = yaml.safe_load(yaml_file)
+
+        templates_dir_path = os.path.join(os.path.dirname(__file__), self.cfg['template_dir_name'])
+        self.template_env = create_template_env(templates_dir_path)
+        self.rdf_writers = {}
+
+        bbox_tolerance = bbox_tolerance if bbox_tolerance is not None and bbox_tolerance >= 0 else None
+        thesauri = [t for t in (thesauri or THESAURUS_TYPES) if self.cfg.get(t)]
+        # The departements are needed to filter the regions and the EPCI
+        loaded = set(thesauri)
+        if loaded & set(["region", "epci"]):
+            loaded.add("departement")
+
+        self.datasets = OrderedDict()
+        datasets = {}
+        for thesaurus_type in THESAURUS_TYPES:
+            if thesaurus_type not in loaded:
+                continue
+            layer_path = get_layer_source(os.path.join(self.cfg['ade_dir_name'], self.cfg[thesaurus_type]['shp']),
+                                          self.cfg[thesaurus_type].get('layer'))
+            if verbose:
+                click.echo(u"Read shapefile {}".format(layer_path))
+            datasets[thesaurus_type] = ThesaurusDataset(thesaurus_type, self.cfg[thesaurus_type], layer_path,
+                                                        reprojection=reprojection, bbox_tolerance=bbox_tolerance)
+            if verbose:
+                click.echo(u"  {} features loaded".format(len(datasets[thesaurus_type])))
+        for thesaurus_type in thesauri:
+            self.datasets[thesaurus_type] = datasets[thesaurus_type]
+
+        self.depts = datasets.get("departement")
+        self.hierarchy = None
+        if self.depts is not None:
+            self.hierarchy = HierarchyIndex({
+                "dept_name": record["dept_name"],
+                "dept_code": record["code"],
+                "reg_code": record["reg_code"],
+            } for record in self.depts.records)
+            if "departement" in self.datasets and self.cfg.get("commune"):
+                # The narrower links of the departements to their communes
+                self.hierarchy.add_communes(self.read_communes(datasets.get("commune")))
+
+        self.cache = ResponseCache(cache_size)
+
+    def read_communes(self, communes=None):
+        """
+        :param communes:    the dataset of the communes, None if not loaded
+        :return:            the list of the (commune code, departement number) tuples of the communes
+        """
+        if communes is not None:
+            return [(record["code"], record["dept_code"]) for record in communes.records]
+        fields = self.cfg["commune"]["fields"]
+        layer = Layer(get_layer_source(os.path.join(self.cfg['ade_dir_name'], self.cfg["commune"]['shp']),
+                                       self.cfg["commune"].get('layer')))
+        return [(props[fields['code']].strip(), props[fields['codedept']].strip())
+                for props in layer.read_properties([fields['code'], fields['codedept']])]
+
+    def get_rdf_writer(self, thesaurus_type, compact):
+        key = (thesaurus_type, compact)
+        if key not in self.rdf_writers:
+            self.rdf_writers[key] = RdfWriter(self.template_env, self.cfg[thesaurus_type]['template'],
+                                              minify=compact)
+        return self.rdf_writers[key]
+
+    def get_thesaurus(self, thesaurus_type, dept_filter=None, geojson=None, compact=False):
+        """
+        :param thesaurus_type:  the type of thesaurus, one of the datasets
+        :param dept_filter:     comma separated list of departement numbers or names, None or empty for no filter
+        :param geojson:         the spatial filter as a GeoJSON geometry, feature or feature collection in WGS84
+                                (parsed), None for no filter
+        :param compact:         True for a compact document
+        :return:                the (RDF document, True if it was cached) tuple
+        """
+        if thesaurus_type not in self.datasets:
+            raise KeyError(thesaurus_type)
+
+        dept_set = frozenset(dept for dept in parse_dept_filter(dept_filter) if dept) if dept_filter else None
+        filter_geom = get_geojson_geometry(geojson) if geojson is not None else None
+        date = datetime.date.today().isoformat()
+
+        # The parameters are normalized so that equivalent requests share their response
+        key = (thesaurus_type, tuple(sorted(dept_set)) if dept_set else None,
+               filter_geom.normalize().wkb if filter_geom is not None else None, compact, date)
+        rdf = self.cache.get(key)
+        if rdf is not None:
+            return rdf, True
+
+        terr_list = self.select_territories(thesaurus_type, dept_set, filter_geom)
+        terr_list.sort()
+        data = {
+            "title": self.cfg[thesaurus_type]["title"],
+            "date": date,
+            "terr_list": terr_list,
+            "thesaurus": thesaurus_type
+        }
+        if thesaurus_type == 'departement':
+            data["hierarchy"] = self.hierarchy
+        output = io.StringIO()
+        self.get_rdf_writer(thesaurus_type, compact).write(output, data)
+        rdf = output.getvalue()
+        self.cache.put(key, rdf)
+        return rdf, False
+
+    def select_territories(self, thesaurus_type, dept_set, filter_geom):
+        """
+        :param thesaurus_type:  the type of thesaurus
+        :param dept_set:        the set of the lower-cased departement numbers or names, None for no filter
+        :param filter_geom:     the WGS84 geometry of the spatial filter, None for no filter
+        :return:                the TerritoryList of the territories selected, in the order of the layer
+        """
+        dataset = self.datasets[thesaurus_type]
+
+        # The geometric filters, only the features whose envelope intersects their envelope being tested
+        predicates = []
+        if filter_geom is not None:
+            predicates.append(SpatialPredicate(reproject_from_wgs84(filter_geom, dataset.crs_wkt, dataset.crs)))
+        if dept_set and thesaurus_type not in ("commune", "departement", "region"):
+            depts_geoms = [self.depts.geoms[i] for i, dept in enumerate(self.depts.records)
+                           if dept["dept_name"].lower() in dept_set or dept["code"] in dept_set]
+            predicates.append(SpatialPredicate(shapely_ops.unary_union(depts_geoms), INTERIORS_OVERLAP))
+        positions = range(len(dataset))
+        for predicate in predicates:
+            candidates = set(dataset.query(predicate.geom))
+            positions = [i for i in positions if i in candidates]
+
+        terr_list = TerritoryList()
+        for i in positions:
+            record = dataset.records[i]
+            reg_dept_codes = None
+            if thesaurus_type == 'region':
+                reg_dept_codes = self.hierarchy.get_region_depts(record["code"])
+
+            if dept_set:
+                if thesaurus_type == 'commune':
+                    if record["dept_name"].lower() not in dept_set and record["dept_code"] not in dept_set:
+                        continue
+                elif thesaurus_type == 'departement':
+                    if record["name"].lower() not in dept_set and record["code"] not in dept_set:
+                        continue
+                elif thesaurus_type == 'region':
+                    if dept_set.isdisjoint(self.hierarchy.get_region_dept_keys(record["code"])):
+                        continue
+            if not all(predicate.test(dataset.geoms[i]) for predicate in predicates):
+                continue
+
+            lon_min, lat_min, lon_max, lat_max = record["bounds"]
+            terr_list.append(record["code"], record["name"], lon_min, lat_min, lon_max, lat_max,
+                             reg=record.get("reg_code", ''), dept=record.get("dept_code", ''),
+                             dept_reg=reg_dept_codes)
+        return terr_list
+
+    def report(self):
+        return {
+            "thesauri": dict((t, len(dataset)) for t, dataset in self.datasets.items()),
+            "cache": self.cache.report(),
+        }
+
+
+def get_geojson_geometry(geojson):
+    """
+    :param geojson:     a GeoJSON geometry, feature or feature collection (parsed)
+    :return:            the shapely geometry, the union of the geometries of a feature collection
+    """
+    try:
+        if geojson.get("type") == "FeatureCollection":
+            return shapely_ops.unary_union([shapely_geometry.shape(feature["geometry"])
+                                            for feature in geojson["features"]])
+        if geojson.get("type") == "Feature":
+            return shapely_geometry.shape(geojson["geometry"])
+        return shapely_geometry.shape(geojson)
+    except Exception as e:
+        raise ValueError(u"Invalid GeoJSON filter: {}".format(e))
+
+
+def parse_compact(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(u"Invalid compact value: {}".format(value))
+
+
+class ThesaurusRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /<thesaurus type>?dept=...&compact=...&filter=<GeoJSON> returns the thesaurus, POST takes the GeoJSON filter
+    as body. GET / returns the thesauri served and the state of the cache as JSON.
+    """
+
+    def do_GET(self):
+        self.handle_request(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.handle_request(self.rfile.read(length) if length else None)
+
+    def handle_request(self, body):
+        url = urlparse(self.path)
+        thesaurus_type = url.path.strip("/")
+        service = self.server.service
+
+        if not thesaurus_type:
+            self.send_content(json.dumps(service.report(), indent=2, sort_keys=True), "application/json")
+            return
+        if thesaurus_type not in service.datasets:
+            self.send_error(404, u"Unknown thesaurus type: {}".format(thesaurus_type))
+            return
+
+        try:
+            params = dict((key, values[-1]) for key, values in parse_qs(url.query, keep_blank_values=True).items())
+            geojson = body if body is not None else params.get("filter")
+            if geojson is not None:
+                try:
+                    geojson = json.loads(geojson.decode("utf-8") if isinstance(geojson, bytes) else geojson)
+                except ValueError as e:
+                    raise ValueError(u"Invalid GeoJSON filter: {}".format(e))
+            compact = parse_compact(params.get("compact", ""))
+            rdf, cached = service.get_thesaurus(thesaurus_type, dept_filter=params.get("dept"), geojson=geojson,
+                                                compact=compact)
+        except ValueError as e:
+            self.send_error(400, u"{}".format(e))
+            return
+        except Exception as e:
+            # The client gets a response instead of a closed connection
+            self.log_error("Error creating the thesaurus %s: %r", thesaurus_type, e)
+            self.send_error(500, u"Error creating the thesaurus {}".format(thesaurus_type))
+            return
+        self.send_content(rdf, RDF_CONTENT_TYPE, {"X-Cache": "HIT" if cached else "MISS"})
+
+    def send_content(self, content, content_type, headers=None):
+        content = content.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+if __name__ == '__main__':
+    serve_thesauri()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# Standard imports
+import re
+from xml.parsers import expat
+
+from rdf_writer import CONCEPTS_MARKER
+from rdf_writer import RdfWriter
+
+
+RDF_NS = u"http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XML_NS = u"http://www.w3.org/XML/1998/namespace"
+RDF_TYPE = RDF_NS + u"type"
+
+# Names of the elements and attributes as reported by expat, "namespace local"
+_RDF_ROOT = RDF_NS + u" RDF"
+_RDF_DESCRIPTION = RDF_NS + u" Description"
+_ABOUT = RDF_NS + u" about"
+_NODE_ID = RDF_NS + u" nodeID"
+_RESOURCE = RDF_NS + u" resource"
+_DATATYPE = RDF_NS + u" datatype"
+_PARSE_TYPE = RDF_NS + u" parseType"
+_LANG = XML_NS + u" lang"
+
+# Kinds of the elements being parsed
+_ROOT, _NODE, _PROPERTY = range(3)
+
+TRIPLES_SYNTAXES = ('nt', 'ttl')
+# Maximum number of formatted IRIs kept by a TriplesWriter
+MAX_CACHED_IRIS = 1024
+
+# Characters written as \uXXXX escapes in the IRIs
+_IRI_ESCAPED_RE = re.compile(u'[\x00-\x20<>"{}|^`\\\\]')
+_LITERAL_ESCAPES = {u"\\": u"\\\\", u'"': u'\\"', u"\n": u"\\n", u"\r": u"\\r", u"\t": u"\\t"}
+_LITERAL_ESCAPED_RE = re.compile(u'[\\\\"\n\r\t]')
+# Local part of a name written with a prefix in Turtle
+_LOCAL_NAME_RE = re.compile(u"^[A-Za-z_][A-Za-z0-9_-]*$")
+
+
+def format_iri(iri):
+    if _IRI_ESCAPED_RE.search(iri) is not None:
+        iri = _IRI_ESCAPED_RE.sub(lambda m: u"\\u{:04X}".format(ord(m.group(0))), iri)
+    return u"<" + iri + u">"
+
+
+def format_literal(value, lang=None, datatype=None):
+    if _LITERAL_ESCAPED_RE.search(value) is not None:
+        value = _LITERAL_ESCAPED_RE.sub(lambda m: _LITERAL_ESCAPES[m.group(0)], value)
+    if datatype is not None:
+        return u'"' + value + u'"^^' + format_iri(datatype)
+    if lang:
+        return u'"' + value + u'"@' + lang
+    return u'"' + value + u'"'
+
+
+class RdfXmlConverter(object):
+    """
+    Convert a RDF/XML document fed by pieces to triples, as the elements are closed, with an expat parser.
+
+    The striped syntax used by the templates is supported: node elements with rdf:about, rdf:nodeID or none (blank
+    nodes), typed node elements, property attributes, property elements with rdf:resource, rdf:nodeID, rdf:datatype,
+    xml:lang, a literal or a nested node element. rdf:parseType is not supported.
+
+    The triples are (subject, predicate, object) tuples of terms, each term being a ('iri', iri), ('bnode', label) or
+    ('literal', value, lang, datatype) tuple.
+    """
+
+    def __init__(self):
+        self.parser = expat.ParserCreate(namespace_separator=u" ")
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.character_data
+        self.parser.StartNamespaceDeclHandler = self.start_namespace
+        # Prefixes declared in the document, in their order of declaration
+        self.namespaces = []
+        self.frames = []
+        self.triples = []
+        self.bnode_count = 0
+
+    @staticmethod
+    def get_iri(name):
+        return name.replace(u" ", u"", 1)
+
+    def new_bnode(self):
+        self.bnode_count += 1
+        return ('bnode', u"b{}".format(self.bnode_count))
+
+    def start_namespace(self, prefix, uri):
+        if prefix and (prefix, uri) not in self.namespaces:
+            self.namespaces.append((prefix, uri))
+
+    def start_element(self, name, attrs):
+        # Frames: [kind, lang, subject, predicate, object, datatype, nested node, text]
+        frames = self.frames
+        parent = frames[-1] if frames else None
+        lang = attrs.get(_LANG, parent[1] if parent is not None else None)
+
+        if parent is None and name == _RDF_ROOT:
+            frames.append([_ROOT, lang, None, None, None, None, False, None])
+        elif parent is None or parent[0] != _NODE:
+            # Node element
+            if _ABOUT in attrs:
+                subject = ('iri', attrs[_ABOUT])
+            elif _NODE_ID in attrs:
+                subject = ('bnode', attrs[_NODE_ID])
+            else:
+                subject = self.new_bnode()
+            if parent is not None and parent[0] == _PROPERTY:
+                if parent[4] is not None:
+                    raise ValueError(u"Property element {} with a resource and a node".format(parent[3][1]))
+                parent[6] = True
+                self.triples.append((parent[2], parent[3], subject))
+            if name != _RDF_DESCRIPTION:
+                self.triples.append((subject, ('iri', RDF_TYPE), ('iri', self.get_iri(name))))
+            if attrs:
+                self.add_property_attributes(subject, attrs, lang)
+            frames.append([_NODE, lang, subject, None, None, None, False, None])
+        else:
+            # Property element
+            obj = None
+            datatype = None
+            if attrs:
+                if _PARSE_TYPE in attrs:
+                    raise ValueError(u"rdf:parseType is not supported")
+                if _RESOURCE in attrs:
+                    obj = ('iri', attrs[_RESOURCE])
+                elif _NODE_ID in attrs:
+                    obj = ('bnode', attrs[_NODE_ID])
+                datatype = attrs.get(_DATATYPE)
+                if any(self.is_property_attribute(key) for key in attrs):
+                    obj = obj if obj is not None else self.new_bnode()
+                    self.add_property_attributes(obj, attrs, lang)
+            frames.append([_PROPERTY, lang, parent[2], ('iri', self.get_iri(name)), obj, datatype, False, []])
+
+    @staticmethod
+    def is_property_attribute(name):
+        return u" " in name and not name.startswith(RDF_NS) and not name.startswith(XML_NS)
+
+    def add_property_attributes(self, subject, attrs, lang):
+        for name in sorted(attrs):
+            if self.is_property_attribute(name):
+                self.triples.append((subject, ('iri', self.get_iri(name)), ('literal', attrs[name], lang, None)))
+
+    def end_element(self, name):
+        kind, lang, subject, predicate, obj, datatype, nested, text = self.frames.pop()
+        if kind != _PROPERTY:
+            return
+        if obj is not None:
+            self.triples.append((subject, predicate, obj))
+        elif not nested:
+            self.triples.append((subject, predicate, ('literal', u"".join(text), None if datatype else lang,
+                                                      datatype)))
+
+    def character_data(self, data):
+        frame = self.frames[-1] if self.frames else None
+        if frame is not None and frame[0] == _PROPERTY:
+            frame[7].append(data)
+
+    def feed(self, xml, final=False):
+        """
+        :param xml:     the next piece of the document
+        :param final:   True for the last piece
+        :return:        the triples of the elements closed by the piece
+        """
+        self.parser.Parse(xml, final)
+        triples = self.triples
+        self.triples = []
+        return triples
+
+
+class TriplesWriter(RdfWriter):
+    """
+    Write a thesaurus as N-Triples or Turtle, one triple per line.
+
+    The skeleton and the concepts are rendered with the RDF/XML template as by RdfWriter, but are not formatted: they
+    are streamed to a RdfXmlConverter and the triples are written as each concept is converted, without building a
+    tree of the document. The Turtle file starts with the prefixes declared by the template, each triple being then
+    written on its own line as in N-Triples, so that both files can be split by line.
+    """
+
+    def __init__(self, template_env, template_name, syntax='nt'):
+        """
+        :param template_env:    the Jinja environment
+        :param template_name:   the name of the thesaurus template
+        :param syntax:          one of TRIPLES_SYNTAXES
+        """
+        if syntax not in TRIPLES_SYNTAXES:
+            raise ValueError(u"Unknown triples syntax: {}".format(syntax))
+        RdfWriter.__init__(self, template_env, template_name)
+        self.syntax = syntax
+        self.prefixes = []
+        # Formatted IRIs, most of them being predicates and types repeated in each concept
+        self.iris = {}
+
+    def render_skeleton(self, data):
+        """
+        :param data:    the data passed to the template
+        :return:        the (header, footer, concepts depth) tuple, not formatted
+        """
+        skeleton = self.skeleton_template.render(data)
+        marker_start = skeleton.index(CONCEPTS_MARKER)
+        return skeleton[:marker_start], skeleton[marker_start + len(CONCEPTS_MARKER):], 0
+
+    def render_concept(self, data, terr, depth):
+        return self.fragment_template.render(data, **{self.var_name: terr})
+
+    def format_iri(self, iri):
+        if self.syntax == 'ttl':
+            for prefix, uri in self.prefixes:
+                if iri.startswith(uri) and _LOCAL_NAME_RE.match(iri[len(uri):]):
+                    return prefix + u":" + iri[len(uri):]
+        return format_iri(iri)
+
+    def format_term(self, term):
+        kind = term[0]
+        if kind == 'iri':
+            formatted = self.iris.get(term[1])
+            if formatted is None:
+                formatted = self.format_iri(term[1])
+                if len(self.iris) < MAX_CACHED_IRIS:
+                    self.iris[term[1]] = formatted
+            return formatted
+        if kind == 'bnode':
+            return u"_:" + term[1]
+        return format_literal(term[1], term[2], term[3])
+
+    def format_triples(self, triples):
+        format_term = self.format_term
+        rdf_type = u"a" if self.syntax == 'ttl' else format_iri(RDF_TYPE)
+        return u"".join(u"{} {} {} .\n".format(format_term(s), rdf_type if p[1] == RDF_TYPE else format_term(p),
+                                                format_term(o))
+                        for s, p, o in triples)
+
+    def write(self, output_file, data):
+        """
+        :param output_file:     the file object the thesaurus is written to
+        :param data:            the data passed to the template, with the territories in terr_list
+        """
+        header, footer, depth = self.render_skeleton(data)
+        converter = RdfXmlConverter()
+        triples = converter.feed(header)
+        self.iris = {}
+        if self.syntax == 'ttl':
+            # The longest namespaces first, for the namespaces prefixing others
+            self.prefixes = sorted(converter.namespaces, key=lambda ns: -len(ns[1]))
+            output_file.write(u"".join(u"@prefix {}: {} .\n".format(prefix, format_iri(uri))
+                                       for prefix, uri in converter.namespaces))
+        output_file.write(self.format_triples(triples))
+        for terr in data["terr_list"]:
+            output_file.write(self.format_triples(converter.feed(self.render_concept(data, terr, depth))))
+        output_file.write(self.format_triples(converter.feed(footer, True)))
@@ -1,14 +1,82 @@
 # -*- coding: utf-8 -*-
 
 # Standard imports
+import importlib
+import os
 import os.path
+import re
 import xml.dom.minidom as minidom
 
+
+class LazyModule(object):
+    """
+    Module imported on the first access to one of its attributes, so that the heavy modules (shapely, fiona, pyproj,
+    numpy, jinja2) are only imported by the code paths using them: --help or a run whose thesauri are all up to date
+    does not pay for them.
+
+    The attributes accessed are kept by the instance, a later access costing the same as the one of a module attribute.
+    """
+
+    def __init__(self, name, after=()):
+        """
+        :param name:    the name of the module, e.g. shapely.ops
+        :param after:   the names of the modules to import before it
+        """
+        self._lazy_name = name
+        self._lazy_after = after
+
+    def __getattr__(self, attr):
+        if attr.startswith('_lazy_'):
+            raise AttributeError(attr)
+        for name in self._lazy_after:
+            importlib.import_module(name)
+        value = getattr(importlib.import_module(self._lazy_name), attr)
+        setattr(self, attr, value)
+        return value
+
+
 # Non standard imports (see requirements.txt)
-from shapely.geometry import shape
-from shapely.ops import unary_union
+shapely_geometry = LazyModule('shapely.geometry')
+shapely_ops = LazyModule('shapely.ops')
 # Fiona should be imported after shapely - see https://github.com/Toblerity/Shapely/issues/288
-import fiona
+fiona = LazyModule('fiona', after=('shapely.geometry',))
+
+
+# Separator of the path of a file and the name of one of its layers (GeoPackage...) in the source of a layer, as in QGIS
+LAYER_NAME_SEPARATOR = u"|layername="
+
+
+def get_layer_source(path, layer_name=None):
+    """
+    :param path:        the path of a file readable by fiona: shapefile, GeoPackage, FlatGeobuf...
+    :param layer_name:  the name of the layer in the file, None for its first layer
+    :return:            the source of the layer: the path, followed by |layername=NAME if a layer name is given
+    """
+    if not layer_name:
+        return path
+    return u"{}{}{}".format(path, LAYER_NAME_SEPARATOR, layer_name)
+
+
+def split_layer_source(source):
+    """
+    :param source:  the source of a layer, as returned by get_layer_source
+    :return:        the (path, layer name) tuple, the layer name being None for the first layer of the file
+    """
+    path, separator, layer_name = source.partition(LAYER_NAME_SEPARATOR)
+    return path, layer_name or None
+
+
+def get_layer_label(source):
+    """
+    :param source:  the source of a layer
+    :return:        a name of the layer usable in a file name: the name of the file without extension, followed by
+                    the layer name if any
+    """
+    path, layer_name = split_layer_source(source)
+    label = os.path.splitext(os.path.basename(path))[0]
+    if layer_name:
+        label = u"{}-{}".format(label, re.sub(r"[^\w.-]", u"_", layer_name))
+    return label
 
 
 class Bunch:
@@ -19,29 +87,54 @@ class Bunch:
         self.__dict__.update(kwds)
 
 
+try:
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
+
+
 def u(s):
     """
-    decodes utf8
+    encodes text to utf8, decodes utf8 bytes
     """
-    if isinstance(s, unicode):
+    if isinstance(s, text_type):
         return s.encode("utf-8")
-    if isinstance(s, str):
+    if isinstance(s, bytes):
         return s.decode("utf-8")
     # fix this, item may be unicode
     elif isinstance(s, list):
         return [i.decode("utf-8") for i in s]
 
 
+def replace_file(src, dst):
+    """
+    Rename a file, replacing the destination file if it exists (os.replace, atomic, where available).
+
+    :param src:     the path of the file to rename
+    :param dst:     the path of the file to replace
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    # Python 2
+    if os.path.isfile(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
 def get_geometry_from_file(input_file_path):
     """
     Get the union of all the geometries contained in one shapefile.
 
-    :param input_file_path:     the path of the shapefile from which the geometry is computed
+    :param input_file_path:     the path of the shapefile from which the geometry is computed, or the source of a layer
+                                of another file (see get_layer_source)
     :return:                    the geomtry resulting in the union of the geometries of the shapefile
     """
-    with fiona.open(input_file_path) as input_layer:
-        geoms = [shape(feat['geometry']) for feat in input_layer]
-        geom = unary_union(geoms)
+    path, layer_name = split_layer_source(input_file_path)
+    with fiona.open(path, layer=layer_name) as input_layer:
+        geoms = [shapely_geometry.shape(feat['geometry']) for feat in input_layer]
+        geom = shapely_ops.unary_union(geoms)
         return geom
 
 